@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class FilesConfig(AppConfig):
+    name = 'files'
+    verbose_name = '影视'
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals  # noqa: F401
@@ -0,0 +1,192 @@
+"""演员、导演简介生成
+
+发布影视内容时先用占位简介创建 Actor/Director，简介交给后台线程池并发生成，
+并发数有上限。生成结果写入 CastDescription 持久缓存，同名人物不会重复生成；
+人物的简介仍是占位内容时才会被替换，手工编辑过的不受影响。生成失败的人物保留
+占位简介，再次发布引用该人物的内容时重新生成，``enrich_cast`` 命令批量重试。
+
+生成器可配置，测试和本地开发可以换成不访问网络的实现：
+    CAST_DESCRIPTION_GENERATOR = 'files.cast_enrichment.OpenAIDescriptionGenerator'
+    CAST_DESCRIPTION_CONCURRENCY = 4
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+from django.utils.module_loading import import_string
+
+from .models import Actor, Director, CastDescription
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GENERATOR = 'files.cast_enrichment.OpenAIDescriptionGenerator'
+DEFAULT_CONCURRENCY = 4
+
+ROLE_MODELS = {
+    'actor': Actor,
+    'director': Director,
+}
+
+
+def placeholder_suffix(role):
+    return f"是一位知名{'演员' if role == 'actor' else '导演'}。"
+
+
+def placeholder_description(name, role):
+    """生成前使用的占位简介"""
+    return f'{name}{placeholder_suffix(role)}'
+
+
+def with_placeholder(role):
+    """简介仍是占位内容的人物"""
+    return ROLE_MODELS[role].objects.filter(description=Concat(F('name'), Value(placeholder_suffix(role))))
+
+
+class OpenAIDescriptionGenerator:
+    """使用AI生成演员或导演的描述"""
+
+    def generate(self, name, role):
+        import openai
+
+        # 设置 OpenAI API
+        openai.api_key = settings.OPENAI_API_KEY
+
+        # 根据角色构建不同的提示
+        if role == 'actor':
+            prompt = f"请用100字简要介绍演员{name}的主要成就和代表作品。"
+        else:  # director
+            prompt = f"请用100字简要介绍导演{name}的导演风格和代表作品。"
+
+        # 调用 OpenAI API
+        response = openai.ChatCompletion.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "你是一个专业的影视资料编辑。"},
+                {"role": "user", "content": prompt}
+            ]
+        )
+
+        return response.choices[0].message.content
+
+
+class FakeDescriptionGenerator:
+    """本地生成器，不访问网络"""
+
+    def generate(self, name, role):
+        return f"{name}的{'演员' if role == 'actor' else '导演'}简介。"
+
+
+class CastEnricher:
+    """后台并发生成人物简介"""
+
+    def __init__(self, generator=None, concurrency=None):
+        self.generator = generator or import_string(
+            getattr(settings, 'CAST_DESCRIPTION_GENERATOR', DEFAULT_GENERATOR)
+        )()
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency or getattr(settings, 'CAST_DESCRIPTION_CONCURRENCY', DEFAULT_CONCURRENCY),
+            thread_name_prefix='cast-enrich',
+        )
+        self._lock = threading.Lock()
+        self._in_flight = set()
+
+    def schedule(self, name, role):
+        """提交生成任务，同名人物正在生成时不重复提交"""
+        with self._lock:
+            if (name, role) in self._in_flight:
+                return None
+            self._in_flight.add((name, role))
+        return self.executor.submit(self._enrich, name, role)
+
+    def _enrich(self, name, role):
+        close_old_connections()
+        try:
+            cached = CastDescription.objects.filter(name=name, role=role).first()
+            if cached is None:
+                description = self.generator.generate(name, role)
+                cached, _ = CastDescription.objects.get_or_create(
+                    name=name, role=role, defaults={'description': description}
+                )
+            ROLE_MODELS[role].objects.filter(
+                name=name, description=placeholder_description(name, role)
+            ).update(description=cached.description)
+            return cached.description
+        except Exception as e:
+            logger.error(f'AI生成描述失败: {name} ({role}): {str(e)}')
+            return None
+        finally:
+            with self._lock:
+                self._in_flight.discard((name, role))
+            close_old_connections()
+
+
+_enricher = None
+_enricher_lock = threading.Lock()
+
+
+def get_enricher():
+    global _enricher
+    if _enricher is None:
+        with _enricher_lock:
+            if _enricher is None:
+                _enricher = CastEnricher()
+    return _enricher
+
+
+def process_cast(names, role):
+    """处理演员或导演名单，新人物用占位或已缓存的简介立即创建，简介在后台生成"""
+    names = list(dict.fromkeys(name.strip() for name in names.split('，') if name.strip()))  # 使用中文逗号分隔
+    if not names:
+        return []
+
+    cached = dict(
+        CastDescription.objects.filter(name__in=names, role=role).values_list('name', 'description')
+    )
+    model = ROLE_MODELS[role]
+    placeholders = {name: placeholder_description(name, role) for name in names}
+    result = []
+    pending = []
+    for name in names:
+        person, _ = model.objects.get_or_create(
+            name=name,
+            defaults={
+                'description': cached.get(name) or placeholders[name],
+                'status': 'active'
+            }
+        )
+        # 新建的人物，以及之前生成失败、仍是占位简介的人物
+        if person.description == placeholders[name]:
+            if name in cached:
+                model.objects.filter(pk=person.pk, description=placeholders[name]).update(
+                    description=cached[name]
+                )
+                person.description = cached[name]
+            else:
+                pending.append(name)
+        result.append(person)
+
+    # 事务提交后再生成，保证后台线程能查到新建的人物
+    def schedule_pending():
+        enricher = get_enricher()
+        for name in pending:
+            enricher.schedule(name, role)
+
+    if pending:
+        transaction.on_commit(schedule_pending)
+    return result
+
+
+def retry_placeholders(roles=None):
+    """为简介仍是占位内容的人物重新提交生成任务，返回任务列表"""
+    enricher = get_enricher()
+    futures = []
+    for role in roles or ROLE_MODELS:
+        for name in with_placeholder(role).values_list('name', flat=True).distinct().iterator():
+            future = enricher.schedule(name, role)
+            if future is not None:
+                futures.append(future)
+    return futures
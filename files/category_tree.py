@@ -0,0 +1,164 @@
+"""分类树缓存
+
+整棵启用中的分类树只用一次查询构建，父子关系在内存中组装，支持任意层级，
+构建结果按版本号缓存。
+Category 保存或删除时递增版本号（见 signals.py），旧版本的缓存自然失效。
+"""
+from collections import defaultdict
+import hashlib
+import logging
+
+from django.core.cache import cache
+
+from .models import Category
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION_KEY = 'category_tree:version'
+CACHE_KEY_TEMPLATE = 'category_tree:v{version}'
+CACHE_TIMEOUT = 24 * 3600
+
+# 进程内缓存，版本号不变时连反序列化都省掉
+_local_tree = {'version': None, 'tree': None}
+
+
+class CategoryTree:
+    """内存中的分类树"""
+
+    def __init__(self, categories):
+        categories = sorted(categories, key=lambda c: (c.order, c.id))
+
+        # 版本标识覆盖全部分类（含未启用的），停用或删除分类同样会改变它
+        digest = hashlib.md5()
+        self.last_modified = None
+        for category in categories:
+            digest.update(f'{category.id}:{category.updated_at.isoformat()};'.encode())
+            if self.last_modified is None or category.updated_at > self.last_modified:
+                self.last_modified = category.updated_at
+        self.etag = digest.hexdigest()
+
+        categories = [category for category in categories if category.is_active]
+        self.nodes = {category.id: category for category in categories}
+        self.slugs = {category.slug: category for category in categories}
+        self.children = defaultdict(list)
+        self.roots = []
+
+        for category in categories:
+            if category.parent_id is None:
+                self.roots.append(category)
+            elif category.parent_id in self.nodes:
+                self.children[category.parent_id].append(category)
+            # 父分类未启用时，子分类不挂到树上
+
+        for category in categories:
+            _attach_children(category, self.children.get(category.id, []))
+
+        # 按父子关系逐层计算层级，支持任意深度
+        self.levels = {}
+        stack = [(root, 0) for root in self.roots]
+        while stack:
+            category, level = stack.pop()
+            self.levels[category.id] = level
+            stack.extend((child, level + 1) for child in self.children.get(category.id, []))
+
+    def get(self, category_id):
+        """按ID获取分类，不存在返回None"""
+        return self.nodes.get(category_id)
+
+    def get_by_slug(self, slug):
+        """按别名获取分类，不存在返回None"""
+        return self.slugs.get(slug)
+
+    def get_children(self, category_id, menu_only=False):
+        """获取直接子分类"""
+        children = self.children.get(category_id, [])
+        if menu_only:
+            return [child for child in children if child.show_in_menu]
+        return list(children)
+
+    def get_level(self, category_id):
+        """获取分类层级，一级分类为0，不在树上返回None"""
+        return self.levels.get(category_id)
+
+    def get_descendants(self, category_id):
+        """获取全部后代分类（深度优先）"""
+        result = []
+        stack = list(reversed(self.children.get(category_id, [])))
+        while stack:
+            category = stack.pop()
+            result.append(category)
+            stack.extend(reversed(self.children.get(category.id, [])))
+        return result
+
+    def serialize(self, category, max_depth=None):
+        """把分类及其子树转换为接口使用的字典"""
+        data = {'id': category.id, 'name': category.name, 'children': []}
+        stack = [(category, data, 0)]
+        while stack:
+            node, node_data, depth = stack.pop()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for child in self.children.get(node.id, []):
+                child_data = {'id': child.id, 'name': child.name, 'children': []}
+                node_data['children'].append(child_data)
+                stack.append((child, child_data, depth + 1))
+        return data
+
+    def get_roots(self, menu_only=False, category_type=None):
+        """获取一级分类"""
+        roots = self.roots
+        if menu_only:
+            roots = [root for root in roots if root.show_in_menu]
+        if category_type:
+            roots = [root for root in roots if root.category_type == category_type]
+        return list(roots)
+
+
+def _attach_children(category, children):
+    """把子分类写入预取缓存，模板里的 category.children.all 不再查库"""
+    queryset = category.children.all()
+    queryset._result_cache = list(children)
+    queryset._prefetch_done = True
+    category._prefetched_objects_cache = {'children': queryset}
+
+
+def get_tree_version():
+    """获取当前分类树版本号"""
+    version = cache.get(CACHE_VERSION_KEY)
+    if version is None:
+        cache.add(CACHE_VERSION_KEY, 1, None)
+        version = cache.get(CACHE_VERSION_KEY, 1)
+    return version
+
+
+def build_category_tree():
+    """一次查询构建整棵启用中的分类树"""
+    return CategoryTree(Category.objects.all())
+
+
+def get_category_tree():
+    """获取分类树，优先使用进程内缓存，其次共享缓存，最后查库"""
+    version = get_tree_version()
+    if _local_tree['version'] == version:
+        return _local_tree['tree']
+
+    cache_key = CACHE_KEY_TEMPLATE.format(version=version)
+    tree = cache.get(cache_key)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(cache_key, tree, CACHE_TIMEOUT)
+
+    _local_tree['version'] = version
+    _local_tree['tree'] = tree
+    return tree
+
+
+def invalidate_category_tree():
+    """递增版本号使分类树缓存失效"""
+    try:
+        cache.incr(CACHE_VERSION_KEY)
+    except ValueError:
+        cache.set(CACHE_VERSION_KEY, 2, None)
+    _local_tree['version'] = None
+    _local_tree['tree'] = None
+    logger.debug('分类树缓存已失效')
@@ -0,0 +1,101 @@
+"""频道页数据加载
+
+频道页和发现页需要的幻灯片、子分类和榜单视频集中在这里加载：
+
+- 幻灯片连同关联视频一次查询取出，频道位置和回退位置（首页）的幻灯片同时查询，
+  频道没有幻灯片时直接使用回退位置的结果，不再额外查询
+- 最新和热门榜单的视频合并为一个候选集，一次查询加载
+- 分类和子分类来自分类树缓存，不查询数据库
+"""
+from cms.models import Slide
+
+from .category_tree import get_category_tree
+from . import leaderboards
+
+_slide_has_video = None
+
+
+def slide_has_video():
+    """Slide 是否有 video 外键，有时随幻灯片一起取出关联视频"""
+    global _slide_has_video
+    if _slide_has_video is None:
+        try:
+            _slide_has_video = Slide._meta.get_field('video').is_relation
+        except Exception:
+            _slide_has_video = False
+    return _slide_has_video
+
+
+def load_slides(position, fallback_position=None):
+    """按顺序返回 position 的幻灯片，没有时返回 fallback_position 的幻灯片"""
+    positions = [position] + ([fallback_position] if fallback_position else [])
+    slides = Slide.objects.filter(position__in=positions, is_active=True).order_by('order')
+    if slide_has_video():
+        slides = slides.select_related('video')
+    by_position = {}
+    for slide in slides:
+        by_position.setdefault(slide.position, []).append(slide)
+    return by_position.get(position) or by_position.get(fallback_position, [])
+
+
+class ChannelPage:
+    """频道页数据"""
+
+    def __init__(self, category, slides, subcategories, latest_videos=None, hot_videos=None,
+                 selected_subcategory=None):
+        self.category = category
+        self.slides = slides
+        self.subcategories = subcategories
+        self.latest_videos = latest_videos or []
+        self.hot_videos = hot_videos or []
+        self.selected_subcategory = selected_subcategory
+
+    def context(self):
+        """模板上下文"""
+        return {
+            'category': self.category,
+            'slides': self.slides,
+            'subcategories': self.subcategories,
+            'latest_videos': self.latest_videos,
+            'hot_videos': self.hot_videos,
+            'selected_subcategory': self.selected_subcategory,
+            'is_channel_page': True,
+            'current_category': self.category,
+        }
+
+
+def load_channel_page(category, latest_limit=12, hot_limit=12):
+    """一级频道页：频道幻灯片（没有时使用首页幻灯片）、菜单中的子分类、最新和热门视频"""
+    slides = [
+        slide for slide in load_slides(category.slug, fallback_position='home')
+        if not slide_has_video() or slide.video_id
+    ]
+    latest_videos, hot_videos = leaderboards.get_videos_many([
+        (leaderboards.LATEST, category, latest_limit),
+        (leaderboards.HOT, category, hot_limit),
+    ])
+    return ChannelPage(
+        category,
+        slides,
+        get_category_tree().get_children(category.id, menu_only=True),
+        latest_videos=latest_videos,
+        hot_videos=hot_videos,
+    )
+
+
+def load_discover_page(category, subcategory_slug=None, hot_limit=20):
+    """发现页：发现页幻灯片、全部子分类、所选子分类（或整个频道）的热门视频"""
+    tree = get_category_tree()
+    selected_subcategory = None
+    if subcategory_slug:
+        subcategory = tree.get_by_slug(subcategory_slug)
+        if subcategory and subcategory.parent_id == category.id:
+            selected_subcategory = subcategory
+    hot_videos, = leaderboards.get_videos_many([(leaderboards.HOT, selected_subcategory, hot_limit)])
+    return ChannelPage(
+        category,
+        load_slides('discover'),
+        tree.get_children(category.id),
+        hot_videos=hot_videos,
+        selected_subcategory=selected_subcategory,
+    )
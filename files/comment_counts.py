@@ -0,0 +1,54 @@
+"""评论数校正
+
+Comment 的新增和删除会原子地增减 Video.comment_count，但批量删除、直接改库等
+路径仍可能造成偏差。这里按视频ID分批，每批用一条 UPDATE 把不一致的行设为相关
+子查询统计的实际评论数。修正在数据库中完成，不会覆盖同时发生的原子增减。
+"""
+import logging
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Video, Comment
+
+logger = logging.getLogger(__name__)
+
+
+def actual_comment_count():
+    """当前视频实际评论数的相关子查询"""
+    counts = (
+        Comment.objects.filter(video_id=OuterRef('pk'))
+        .order_by().values('video_id').annotate(total=Count('id')).values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def reconcile_batch(video_ids):
+    """校正一批视频的评论数，返回修正的视频数"""
+    return (
+        Video.objects.filter(id__in=video_ids)
+        .exclude(comment_count=actual_comment_count())
+        .update(comment_count=actual_comment_count())
+    )
+
+
+def reconcile_comment_counts(batch_size=1000, video_ids=None):
+    """校正全部（或指定）视频的评论数，返回 (检查数, 修正数)"""
+    if video_ids is None:
+        video_ids = Video.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+
+    checked = fixed = 0
+    batch = []
+    for video_id in video_ids:
+        batch.append(video_id)
+        if len(batch) >= batch_size:
+            fixed += reconcile_batch(batch)
+            checked += len(batch)
+            batch = []
+    if batch:
+        fixed += reconcile_batch(batch)
+        checked += len(batch)
+
+    if fixed:
+        logger.info(f'评论数校正完成: 检查 {checked} 个视频，修正 {fixed} 个')
+    return checked, fixed
@@ -0,0 +1,301 @@
+"""计数器写缓冲
+
+播放数、点赞数等计数的递增先累积在缓冲区中，由后台线程按固定间隔合并为
+批量的 ``UPDATE ... SET x = x + n`` 写入数据库，避免热门视频的单行锁竞争。
+读取时使用数据库中的值加上尚未落库的增量。进程崩溃最多丢失一个刷新间隔内的增量。
+
+缓冲区后端可配置：
+    COUNTER_BACKEND = 'memory'            # 进程内缓冲（默认）
+    COUNTER_BACKEND = 'redis'             # 多进程共享缓冲，需要 COUNTER_REDIS_URL
+    COUNTER_BACKEND = 'local_redis'       # 进程内的 Redis 替身，用于本地开发和测试
+    COUNTER_FLUSH_INTERVAL = 5            # 刷新间隔（秒）
+"""
+from collections import defaultdict
+import atexit
+import logging
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+# 允许缓冲的计数字段
+COUNTER_FIELDS = {
+    'files.Video': {'play_count', 'views', 'like_count'},
+    'files.Music': {'play_count'},
+    'files.SeriesVideo': {'play_count'},
+}
+
+DEFAULT_FLUSH_INTERVAL = 5
+
+REDIS_PENDING_KEY = 'counters:pending'
+REDIS_FLUSHING_KEY = 'counters:flushing'
+REDIS_FLUSH_LOCK_KEY = 'counters:flush_lock'
+# 锁的过期时间（秒），应远大于一次落库的耗时
+REDIS_FLUSH_LOCK_TIMEOUT = 60
+
+# 增量落库后发送，changes 为 {(模型标签, 字段): 主键集合}
+counters_flushed = Signal()
+
+
+def make_key(model_label, pk, field):
+    return f'{model_label}:{pk}:{field}'
+
+
+def parse_key(key):
+    if isinstance(key, bytes):
+        key = key.decode()
+    model_label, pk, field = key.rsplit(':', 2)
+    return model_label, int(pk), field
+
+
+class InMemoryCounterBackend:
+    """进程内缓冲"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+
+    def incr(self, key, amount):
+        with self._lock:
+            self._pending[key] += amount
+
+    def get(self, key):
+        with self._lock:
+            return self._pending.get(key, 0)
+
+    def drain(self):
+        """取出全部待落库的增量并清空缓冲区"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        return dict(pending)
+
+    def restore(self, pending):
+        """落库失败时把增量放回缓冲区"""
+        with self._lock:
+            for key, amount in pending.items():
+                self._pending[key] += amount
+
+    def ack(self):
+        pass
+
+
+class RedisCounterBackend:
+    """基于 Redis 哈希的共享缓冲
+
+    刷新时先把待处理哈希 RENAME 为处理中哈希再读取，落库成功后删除。
+    若进程在落库前退出，下次刷新会先处理遗留的处理中哈希。
+    从 RENAME 到删除处理中哈希的整个过程持有 Redis 锁，同一时间只有一个进程
+    处理该哈希，增量不会被重复写入。
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._lock = None
+
+    def incr(self, key, amount):
+        self.client.hincrby(REDIS_PENDING_KEY, key, amount)
+
+    def get(self, key):
+        value = self.client.hget(REDIS_PENDING_KEY, key)
+        flushing = self.client.hget(REDIS_FLUSHING_KEY, key)
+        return int(value or 0) + int(flushing or 0)
+
+    def drain(self):
+        lock = self.client.lock(REDIS_FLUSH_LOCK_KEY, timeout=REDIS_FLUSH_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            # 其他进程正在刷新
+            return {}
+        self._lock = lock
+        if not self.client.exists(REDIS_FLUSHING_KEY):
+            try:
+                self.client.rename(REDIS_PENDING_KEY, REDIS_FLUSHING_KEY)
+            except Exception:
+                # 待处理哈希不存在
+                self._release()
+                return {}
+        pending = {
+            (key.decode() if isinstance(key, bytes) else key): int(value)
+            for key, value in self.client.hgetall(REDIS_FLUSHING_KEY).items()
+        }
+        if not pending:
+            self._release()
+        return pending
+
+    def restore(self, pending):
+        # 处理中哈希保留在 Redis 中，下次刷新重试
+        self._release()
+
+    def ack(self):
+        self.client.delete(REDIS_FLUSHING_KEY)
+        self._release()
+
+    def _release(self):
+        lock, self._lock = self._lock, None
+        if lock is not None:
+            try:
+                lock.release()
+            except Exception:
+                # 锁已过期，由过期时间释放
+                logger.warning('计数器刷新锁已过期')
+
+
+class LocalRedis:
+    """进程内的 Redis 替身，只实现计数器用到的命令"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            bucket = self._data.setdefault(name, {})
+            bucket[key] = bucket.get(key, 0) + amount
+            return bucket[key]
+
+    def hget(self, name, key):
+        with self._lock:
+            return self._data.get(name, {}).get(key)
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._data.get(name, {}))
+
+    def exists(self, name):
+        with self._lock:
+            return int(name in self._data)
+
+    def rename(self, src, dst):
+        with self._lock:
+            if src not in self._data:
+                raise KeyError('no such key')
+            self._data[dst] = self._data.pop(src)
+            return True
+
+    def delete(self, name):
+        with self._lock:
+            return int(self._data.pop(name, None) is not None)
+
+    def lock(self, name, timeout=None):
+        with self._lock:
+            return self._data.setdefault(('lock', name), LocalRedisLock())
+
+
+class LocalRedisLock:
+    """LocalRedis 的锁，接口与 redis-py 的 Lock 一致"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True):
+        return self._lock.acquire(blocking)
+
+    def release(self):
+        self._lock.release()
+
+
+def create_backend():
+    """根据配置创建缓冲区后端"""
+    backend = getattr(settings, 'COUNTER_BACKEND', 'memory')
+    if backend == 'redis':
+        import redis
+        return RedisCounterBackend(redis.Redis.from_url(settings.COUNTER_REDIS_URL))
+    if backend == 'local_redis':
+        return RedisCounterBackend(LocalRedis())
+    return InMemoryCounterBackend()
+
+
+class CounterBuffer:
+    """计数器缓冲与后台刷新"""
+
+    def __init__(self, backend=None, flush_interval=None):
+        self.backend = backend or create_backend()
+        self.flush_interval = flush_interval or getattr(
+            settings, 'COUNTER_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL
+        )
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def incr(self, instance, field, amount=1):
+        """递增计数，写入缓冲区"""
+        model_label = instance._meta.label
+        if field not in COUNTER_FIELDS.get(model_label, ()):
+            raise ValueError(f'{model_label}.{field} 不是可缓冲的计数字段')
+        self.backend.incr(make_key(model_label, instance.pk, field), amount)
+        self.start()
+
+    def get(self, instance, field):
+        """读取计数：数据库中的值加上尚未落库的增量"""
+        pending = self.backend.get(make_key(instance._meta.label, instance.pk, field))
+        return getattr(instance, field) + pending
+
+    def flush(self):
+        """把缓冲区的增量批量写入数据库，返回执行的 UPDATE 语句数"""
+        with self._flush_lock:
+            pending = self.backend.drain()
+            if not pending:
+                return 0
+
+            # 按 (模型, 字段, 增量) 分组，相同增量的行合并为一条 UPDATE
+            groups = defaultdict(list)
+            for key, amount in pending.items():
+                if not amount:
+                    continue
+                model_label, pk, field = parse_key(key)
+                groups[(model_label, field, amount)].append(pk)
+
+            try:
+                with transaction.atomic():
+                    for (model_label, field, amount), pks in groups.items():
+                        model = apps.get_model(model_label)
+                        model.objects.filter(pk__in=pks).update(**{field: F(field) + amount})
+            except Exception:
+                logger.exception('计数器落库失败，增量将在下次刷新时重试')
+                self.backend.restore(pending)
+                return 0
+
+            self.backend.ack()
+
+        changes = defaultdict(set)
+        for (model_label, field, amount), pks in groups.items():
+            changes[(model_label, field)].update(pks)
+        counters_flushed.send(sender=self.__class__, changes=dict(changes))
+        return len(groups)
+
+    def start(self):
+        """启动后台刷新线程"""
+        if self._thread is not None:
+            return
+        with self._flush_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='counter-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """停止后台线程并刷新剩余增量"""
+        self._stopped.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+
+counter_buffer = CounterBuffer()
+
+
+def incr(instance, field, amount=1):
+    """递增计数"""
+    counter_buffer.incr(instance, field, amount)
+
+
+def get_count(instance, field):
+    """读取包含未落库增量的计数"""
+    return counter_buffer.get(instance, field)
@@ -0,0 +1,246 @@
+"""弹幕写入管道
+
+发送的弹幕先进入队列，由后台线程校验、审核后按微批次 bulk_create 写入，
+代替每条弹幕一次 INSERT。写入成功的已审核弹幕同时放入按视频划分的环形缓冲区，
+读取当前时间窗口的客户端可以直接从内存获取最新弹幕，不必查库。
+
+环形缓冲区只包含本进程写入的弹幕。批量写入失败时改为逐条写入，只丢弃本身无法
+写入的弹幕；全部失败（通常是数据库不可用）时放回队列重试。进程退出时写入队列中
+剩余的弹幕。
+
+相关配置：
+    DANMAKU_BATCH_SIZE = 200          # 每批最多写入的条数
+    DANMAKU_BATCH_WAIT = 0.2          # 凑批最长等待时间（秒）
+    DANMAKU_RING_SIZE = 2000          # 每个视频保留的最近弹幕条数
+    DANMAKU_BLOCKED_WORDS = []        # 命中后标记为未审核的词
+"""
+from collections import OrderedDict, deque
+import atexit
+import logging
+import queue
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import Danmaku, Video
+from .danmaku_segments import DANMAKU_TYPES
+
+logger = logging.getLogger(__name__)
+
+MAX_TEXT_LENGTH = 100
+MIN_FONT_SIZE = 12
+MAX_FONT_SIZE = 64
+MAX_RING_VIDEOS = 1000
+# 整批写入失败时的最多重试次数和重试间隔（秒）
+MAX_RETRIES = 3
+RETRY_DELAY = 1
+COLOR_RE = re.compile(r'^#[0-9a-fA-F]{6}$')
+
+
+class DanmakuValidationError(ValueError):
+    """弹幕校验失败"""
+
+
+def validate(data):
+    """校验并规范化一条弹幕，返回字段字典"""
+    text = (data.get('text') or '').strip()
+    if not text:
+        raise DanmakuValidationError('弹幕内容不能为空')
+    if len(text) > MAX_TEXT_LENGTH:
+        raise DanmakuValidationError(f'弹幕内容不能超过{MAX_TEXT_LENGTH}个字符')
+
+    try:
+        danmaku_time = float(data.get('time'))
+    except (TypeError, ValueError):
+        raise DanmakuValidationError('时间点无效')
+    if danmaku_time < 0:
+        raise DanmakuValidationError('时间点无效')
+
+    color = data.get('color') or '#ffffff'
+    if not COLOR_RE.match(color):
+        raise DanmakuValidationError('颜色格式无效')
+
+    danmaku_type = data.get('type') or 'right'
+    if danmaku_type not in DANMAKU_TYPES:
+        raise DanmakuValidationError('弹幕类型无效')
+
+    try:
+        font_size = int(data.get('font_size') or 25)
+    except (TypeError, ValueError):
+        raise DanmakuValidationError('字体大小无效')
+    font_size = max(MIN_FONT_SIZE, min(font_size, MAX_FONT_SIZE))
+
+    return {
+        'text': text,
+        'time': danmaku_time,
+        'color': color.lower(),
+        'type': danmaku_type,
+        'font_size': font_size,
+    }
+
+
+def moderate(text):
+    """审核弹幕，命中屏蔽词时返回False"""
+    blocked_words = getattr(settings, 'DANMAKU_BLOCKED_WORDS', [])
+    return not any(word in text for word in blocked_words)
+
+
+class RingBuffer:
+    """按视频划分的最近弹幕环形缓冲区，视频数量按最近使用淘汰"""
+
+    def __init__(self, size, max_videos=MAX_RING_VIDEOS):
+        self.size = size
+        self.max_videos = max_videos
+        self._lock = threading.Lock()
+        self._buffers = OrderedDict()
+
+    def extend(self, video_id, items):
+        with self._lock:
+            buffer = self._buffers.get(video_id)
+            if buffer is None:
+                buffer = self._buffers[video_id] = deque(maxlen=self.size)
+                while len(self._buffers) > self.max_videos:
+                    self._buffers.popitem(last=False)
+            else:
+                self._buffers.move_to_end(video_id)
+            buffer.extend(items)
+
+    def recent(self, video_id, start=None, end=None, since=None):
+        """获取最近弹幕，可按时间点范围和创建时间（Unix时间戳）过滤"""
+        with self._lock:
+            items = list(self._buffers.get(video_id, ()))
+        return [
+            item for item in items
+            if (start is None or item['time'] >= start)
+            and (end is None or item['time'] < end)
+            and (since is None or item['created_at'] >= since)
+        ]
+
+
+class DanmakuIngestor:
+    """弹幕微批次写入"""
+
+    def __init__(self, batch_size=None, batch_wait=None, ring_size=None):
+        self.batch_size = batch_size or getattr(settings, 'DANMAKU_BATCH_SIZE', 200)
+        self.batch_wait = batch_wait or getattr(settings, 'DANMAKU_BATCH_WAIT', 0.2)
+        self.ring = RingBuffer(ring_size or getattr(settings, 'DANMAKU_RING_SIZE', 2000))
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, video_id, user_id, data):
+        """校验并提交一条弹幕，校验失败抛出 DanmakuValidationError"""
+        fields = validate(data)
+        if not Video.objects.filter(pk=video_id, is_active=True).exists():
+            raise DanmakuValidationError('视频不存在')
+        fields['is_approved'] = moderate(fields['text'])
+        self._queue.put(Danmaku(video_id=video_id, user_id=user_id, **fields))
+        self.start()
+        return fields
+
+    def write_batch(self, batch):
+        """批量写入一批弹幕并放入环形缓冲区
+
+        创建时间取写入时刻而不是入队时刻，弹幕分段按创建时间截止，入队后等待凑批
+        或重试的弹幕不会落到已关闭的分段中。
+        """
+        now = timezone.now()
+        for danmaku in batch:
+            danmaku.created_at = now
+        created = Danmaku.objects.bulk_create(batch, batch_size=self.batch_size)
+        by_video = {}
+        for danmaku in created:
+            if not danmaku.is_approved:
+                continue
+            by_video.setdefault(danmaku.video_id, []).append({
+                'id': danmaku.pk,
+                'time': danmaku.time,
+                'text': danmaku.text,
+                'color': danmaku.color,
+                'type': danmaku.type,
+                'font_size': danmaku.font_size,
+                'created_at': danmaku.created_at.timestamp(),
+            })
+        for video_id, items in by_video.items():
+            self.ring.extend(video_id, items)
+        return len(created)
+
+    def drain(self, block=True):
+        """从队列中取出一批弹幕，最多等待 batch_wait 秒凑满一批"""
+        batch = []
+        try:
+            batch.append(self._queue.get(block=block))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch, retry=True):
+        """写入一批弹幕，失败时逐条写入；全部失败且 retry 为真时放回队列"""
+        try:
+            self.write_batch(batch)
+            return
+        except Exception:
+            logger.warning(f'弹幕批量写入失败，改为逐条写入 {len(batch)} 条', exc_info=True)
+
+        failed = []
+        for danmaku in batch:
+            try:
+                self.write_batch([danmaku])
+            except Exception:
+                failed.append(danmaku)
+        if not failed:
+            return
+        if retry and len(failed) == len(batch):
+            # 没有一条能写入，通常是数据库不可用，稍后整批重试
+            retried = []
+            for danmaku in failed:
+                danmaku._attempts = getattr(danmaku, '_attempts', 0) + 1
+                if danmaku._attempts <= MAX_RETRIES:
+                    retried.append(danmaku)
+            for danmaku in retried:
+                self._queue.put(danmaku)
+            failed = [danmaku for danmaku in failed if danmaku._attempts > MAX_RETRIES]
+            time.sleep(RETRY_DELAY)
+        if failed:
+            logger.error(f'弹幕写入失败，丢弃 {len(failed)} 条')
+
+    def flush(self):
+        """同步写入队列中剩余的弹幕"""
+        while True:
+            batch = self.drain(block=False)
+            if not batch:
+                return
+            self.write(batch, retry=False)
+
+    def start(self):
+        """启动后台写入线程，进程退出时写入剩余弹幕"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='danmaku-ingest', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = self.drain()
+            close_old_connections()
+            self.write(batch)
+
+
+ingestor = DanmakuIngestor()
@@ -0,0 +1,123 @@
+"""弹幕分段
+
+播放器按固定时长（默认6分钟）分段拉取弹幕，每段用紧凑的二进制格式编码并 gzip 压缩。
+
+弹幕会持续新增，因此分段内容以创建时间截止点 ``until`` 划分版本：截止点按
+``DANMAKU_CLOSE_INTERVAL`` 对齐，过去超过 CLOSE_DELAY 秒的截止点对应的分段内容
+不再变化，可以永久缓存；截止点之后发布的弹幕由客户端通过实时接口获取。
+CLOSE_DELAY 覆盖写入管道的提交延迟，截止点之前创建的弹幕在截止点关闭前已经落库。
+
+二进制格式（大端序）::
+
+    头部    magic 'DMK'(3B) version(1B) segment(4B) segment_seconds(4B) count(4B)
+    每条    offset_ms(4B) id(8B) color(4B) type(1B) font_size(1B) text_len(2B) text(UTF-8)
+
+offset_ms 为弹幕时间点相对分段起点的毫秒数。
+"""
+from datetime import datetime, timezone as dt_timezone
+import gzip
+import struct
+import time
+
+from django.core.cache import cache
+
+from .models import Danmaku
+
+SEGMENT_SECONDS = 360
+CLOSE_INTERVAL = 300
+# 截止点过去后再等待的秒数，需大于弹幕从取得创建时间到提交的最长耗时
+CLOSE_DELAY = 30
+SEGMENT_CACHE_TIMEOUT = 7 * 24 * 3600
+
+MAGIC = b'DMK'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('>3sBIII')
+RECORD = struct.Struct('>IQIBBH')
+
+DANMAKU_TYPES = ['right', 'top', 'bottom', 'left']
+TYPE_CODES = {name: code for code, name in enumerate(DANMAKU_TYPES)}
+DEFAULT_COLOR = 0xffffff
+
+
+def current_until(now=None):
+    """当前已关闭的最新截止点（Unix 时间戳）"""
+    closed = int(now if now is not None else time.time()) - CLOSE_DELAY
+    return closed - closed % CLOSE_INTERVAL
+
+
+def is_valid_until(until, now=None):
+    """截止点必须对齐且已经过去"""
+    return until > 0 and until % CLOSE_INTERVAL == 0 and until <= current_until(now)
+
+
+def parse_color(color):
+    try:
+        return int(color.lstrip('#'), 16) & 0xffffff
+    except (AttributeError, ValueError):
+        return DEFAULT_COLOR
+
+
+def encode_segment(segment, rows):
+    """编码分段，rows 为 (id, time, text, color, type, font_size) 序列"""
+    start = segment * SEGMENT_SECONDS
+    records = []
+    for danmaku_id, danmaku_time, text, color, danmaku_type, font_size in rows:
+        text_bytes = text.encode('utf-8')[:0xffff]
+        records.append(RECORD.pack(
+            max(0, int(round((danmaku_time - start) * 1000))),
+            danmaku_id,
+            parse_color(color),
+            TYPE_CODES.get(danmaku_type, 0),
+            max(0, min(font_size, 0xff)),
+            len(text_bytes),
+        ))
+        records.append(text_bytes)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, segment, SEGMENT_SECONDS, len(records) // 2)
+    return header + b''.join(records)
+
+
+def decode_segment(payload):
+    """解码分段，返回 (segment, 弹幕字典列表)"""
+    magic, version, segment, segment_seconds, count = HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('不支持的弹幕分段格式')
+    offset = HEADER.size
+    start = segment * segment_seconds
+    items = []
+    for _ in range(count):
+        offset_ms, danmaku_id, color, type_code, font_size, text_len = RECORD.unpack_from(payload, offset)
+        offset += RECORD.size
+        text = payload[offset:offset + text_len].decode('utf-8', errors='ignore')
+        offset += text_len
+        items.append({
+            'id': danmaku_id,
+            'time': start + offset_ms / 1000,
+            'text': text,
+            'color': f'#{color:06x}',
+            'type': DANMAKU_TYPES[type_code] if type_code < len(DANMAKU_TYPES) else DANMAKU_TYPES[0],
+            'font_size': font_size,
+        })
+    return segment, items
+
+
+def load_segment_rows(video_id, segment, until):
+    """查询分段内截止点之前发布的已审核弹幕"""
+    start = segment * SEGMENT_SECONDS
+    return Danmaku.objects.filter(
+        video_id=video_id,
+        is_approved=True,
+        time__gte=start,
+        time__lt=start + SEGMENT_SECONDS,
+        created_at__lt=datetime.fromtimestamp(until, tz=dt_timezone.utc),
+    ).order_by('time', 'id').values_list('id', 'time', 'text', 'color', 'type', 'font_size')
+
+
+def get_segment(video_id, segment, until):
+    """获取 gzip 压缩后的分段，已关闭的分段内容不变，直接缓存"""
+    cache_key = f'danmaku:seg:{video_id}:{segment}:{until}'
+    body = cache.get(cache_key)
+    if body is None:
+        payload = encode_segment(segment, load_segment_rows(video_id, segment, until))
+        body = gzip.compress(payload, compresslevel=6, mtime=0)
+        cache.set(cache_key, body, SEGMENT_CACHE_TIMEOUT)
+    return body
@@ -0,0 +1,263 @@
+"""视频编码任务调度
+
+每个媒体文件按启用中的 EncodeProfile 生成 Encoding 任务。调度进程原子地领取
+等待中的任务（支持时使用 ``SELECT ... FOR UPDATE SKIP LOCKED``，SQLite 等不支持的
+数据库退化为按状态条件更新），交给按 CPU 核数设定大小的进程池执行 ffmpeg 转码。
+子进程把进度写入队列，且只在进度变化达到一定幅度时才上报；调度进程定期把进度
+合并为一次批量更新。失败的任务按指数退避重试，超过次数后标记为失败。
+"""
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+import logging
+import multiprocessing
+import os
+import queue
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import Encoding, EncodeProfile, VideoMedia
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 60
+STALE_TIMEOUT = timedelta(hours=6)
+
+# 子进程只在进度至少变化这么多（百分点）时上报
+PROGRESS_STEP = 5
+# 调度进程合并写入进度的间隔（秒）
+PROGRESS_FLUSH_INTERVAL = 2
+POLL_INTERVAL = 1
+
+STATS_CACHE_KEY = 'encoding:stats'
+
+
+def enqueue_media(media):
+    """为媒体文件创建所有启用中配置的编码任务，已存在的配置跳过"""
+    existing = set(Encoding.objects.filter(media=media).values_list('profile_id', flat=True))
+    jobs = [
+        Encoding(media=media, profile=profile)
+        for profile in EncodeProfile.objects.filter(is_active=True)
+        if profile.id not in existing
+    ]
+    return Encoding.objects.bulk_create(jobs)
+
+
+def claimable():
+    now = timezone.now()
+    return Encoding.objects.filter(
+        Q(next_retry_at__isnull=True) | Q(next_retry_at__lte=now),
+        status='pending',
+        profile__is_active=True,
+    ).select_related('profile').order_by('created_at', 'id')
+
+
+def claim_jobs(limit):
+    """原子地领取最多 limit 个等待中的任务，返回已标记为处理中的任务"""
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            jobs = list(claimable().select_for_update(skip_locked=True, of=('self',))[:limit])
+            Encoding.objects.filter(id__in=[job.id for job in jobs]).update(
+                status='running', started_at=now, progress=0
+            )
+    else:
+        # 不支持 SKIP LOCKED 时逐个按状态条件更新，更新成功才算领到
+        jobs = []
+        for job in claimable()[:limit * 2]:
+            if Encoding.objects.filter(id=job.id, status='pending').update(
+                    status='running', started_at=now, progress=0):
+                jobs.append(job)
+                if len(jobs) >= limit:
+                    break
+    for job in jobs:
+        job.status, job.started_at, job.progress = 'running', now, 0
+    return jobs
+
+
+def requeue_stale(timeout=STALE_TIMEOUT):
+    """把超时仍处于处理中的任务（工作进程已退出）放回队列
+
+    工作进程退出也计为一次尝试，反复导致进程退出的任务达到次数后标记为失败。
+    返回放回队列的任务数。
+    """
+    now = timezone.now()
+    stale = Encoding.objects.filter(status='running', started_at__lt=now - timeout)
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS - 1).update(
+        status='failed', attempts=F('attempts') + 1, error_message='工作进程异常退出', completed_at=now,
+    )
+    if failed:
+        logger.error(f'{failed} 个编码任务多次导致工作进程退出，标记为失败')
+    return stale.update(status='pending', progress=0, attempts=F('attempts') + 1)
+
+
+def build_job_spec(job):
+    """构造可传给子进程的任务描述"""
+    media = VideoMedia.objects.get(id=job.media_id)
+    profile = job.profile
+    relative_output = os.path.join('encoded', str(media.id), f'{profile.resolution}p.{profile.extension}')
+    return {
+        'id': job.id,
+        'input': media.file_path.path,
+        'output': os.path.join(settings.MEDIA_ROOT, relative_output),
+        'output_url': f'{settings.MEDIA_URL}{relative_output}',
+        'duration': media.duration,
+        'resolution': profile.resolution,
+        'bitrate': profile.bitrate,
+        'audio_bitrate': profile.audio_bitrate,
+        'ffmpeg': getattr(settings, 'FFMPEG_BINARY', 'ffmpeg'),
+    }
+
+
+def transcode(spec, progress_queue):
+    """在子进程中执行转码，按 PROGRESS_STEP 节流上报进度"""
+    os.makedirs(os.path.dirname(spec['output']), exist_ok=True)
+    command = [
+        spec['ffmpeg'], '-y', '-nostdin', '-i', spec['input'],
+        '-vf', f"scale=-2:{spec['resolution']}",
+        '-c:v', 'libx264', '-b:v', f"{spec['bitrate']}k",
+        '-c:a', 'aac', '-b:a', f"{spec['audio_bitrate']}k",
+        '-progress', 'pipe:1', '-nostats', '-loglevel', 'error',
+        spec['output'],
+    ]
+    started = time.monotonic()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    reported = 0
+    duration_us = spec['duration'] * 1000000
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        if key != 'out_time_us' or not duration_us:
+            continue
+        try:
+            percent = min(99, int(int(value) * 100 / duration_us))
+        except ValueError:
+            continue
+        if percent - reported >= PROGRESS_STEP:
+            reported = percent
+            progress_queue.put((spec['id'], percent))
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise RuntimeError(stderr.strip()[-2000:] or f'ffmpeg 退出码 {process.returncode}')
+    return {'output_url': spec['output_url'], 'seconds': time.monotonic() - started}
+
+
+class EncodingScheduler:
+    """领取任务、分派到进程池、回写进度和结果"""
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = {
+            'workers': self.workers,
+            'completed': 0,
+            'failed': 0,
+            'retried': 0,
+            'encode_seconds': 0.0,
+            'queue_latency_total': 0.0,
+            'started_at': time.time(),
+        }
+
+    def run(self, once=False):
+        requeue_stale()
+        manager = multiprocessing.Manager()
+        progress_queue = manager.Queue()
+        running = {}
+        last_flush = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                for job in claim_jobs(self.workers - len(running)):
+                    self.stats['queue_latency_total'] += (job.started_at - job.created_at).total_seconds()
+                    try:
+                        spec = build_job_spec(job)
+                    except Exception as e:
+                        self.finish_failed(job, e)
+                        continue
+                    running[pool.submit(transcode, spec, progress_queue)] = job
+
+                if not running:
+                    if once:
+                        self.publish_stats()
+                        break
+                    time.sleep(POLL_INTERVAL)
+                    continue
+
+                done, _ = wait(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                if time.monotonic() - last_flush >= PROGRESS_FLUSH_INTERVAL:
+                    self.flush_progress(progress_queue)
+                    last_flush = time.monotonic()
+
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.finish_failed(job, e)
+                    else:
+                        self.finish_completed(job, result)
+                if done:
+                    self.publish_stats()
+        manager.shutdown()
+
+    def flush_progress(self, progress_queue):
+        """把队列中的进度合并为一次批量更新"""
+        latest = {}
+        while True:
+            try:
+                job_id, percent = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            latest[job_id] = max(percent, latest.get(job_id, 0))
+        if latest:
+            # 只更新仍在处理中的任务，已完成或失败的任务不会被迟到的进度覆盖
+            Encoding.objects.filter(id__in=latest, status='running').update(progress=Case(
+                *[When(id=job_id, then=Value(percent)) for job_id, percent in latest.items()],
+                default=F('progress'),
+                output_field=IntegerField(),
+            ))
+
+    def finish_completed(self, job, result):
+        Encoding.objects.filter(id=job.id).update(
+            status='completed', progress=100, output_url=result['output_url'],
+            error_message='', completed_at=timezone.now(),
+        )
+        self.stats['completed'] += 1
+        self.stats['encode_seconds'] += result['seconds']
+
+    def finish_failed(self, job, error):
+        """失败的任务按指数退避重新排队，超过次数后标记为失败"""
+        attempts = job.attempts + 1
+        if attempts < MAX_ATTEMPTS:
+            Encoding.objects.filter(id=job.id).update(
+                status='pending', progress=0, attempts=attempts, error_message=str(error),
+                next_retry_at=timezone.now() + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (attempts - 1)),
+            )
+            self.stats['retried'] += 1
+            logger.warning(f'编码任务 {job.id} 第{attempts}次失败，稍后重试: {error}')
+        else:
+            Encoding.objects.filter(id=job.id).update(
+                status='failed', attempts=attempts, error_message=str(error), completed_at=timezone.now(),
+            )
+            self.stats['failed'] += 1
+            logger.error(f'编码任务 {job.id} 失败: {error}')
+
+    def get_stats(self):
+        """吞吐量和排队延迟"""
+        elapsed = max(time.time() - self.stats['started_at'], 1e-9)
+        claimed = self.stats['completed'] + self.stats['failed'] + self.stats['retried']
+        return {
+            **self.stats,
+            'jobs_per_core_hour': self.stats['completed'] * 3600 / elapsed / self.workers,
+            'avg_encode_seconds': self.stats['encode_seconds'] / self.stats['completed'] if self.stats['completed'] else 0,
+            'avg_queue_latency': self.stats['queue_latency_total'] / claimed if claimed else 0,
+            'pending': Encoding.objects.filter(status='pending').count(),
+        }
+
+    def publish_stats(self):
+        cache.set(STATS_CACHE_KEY, self.get_stats(), None)
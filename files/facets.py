@@ -0,0 +1,471 @@
+"""视频列表分面筛选
+
+每个分面取值（年份、地区、语言、类型、更新状态、分类、标签）对应一个内存中的
+压缩位图，位图的每一位对应一个启用中的视频。多个分面组合筛选就是位图求交（同一
+分面选多个值时求并），各取值的数量就是位图交集的基数，都在内存中完成，不需要
+关联查询。
+
+位图按 Roaring 的方式压缩：行号按高16位分桶，每桶元素不超过 ARRAY_LIMIT 时存为
+集合，否则存为 65536 位的整数位图，稀疏的标签和稠密的类型都占用较少内存。
+
+索引在每个进程内构建。视频或其分类、标签变化时（见 signals.py）变更的视频ID记入
+缓存中的变更日志并递增版本号，各进程下次查询时只重新加载这些视频；变更日志过期
+或落后太多时整体重建。
+"""
+from collections import defaultdict
+import logging
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Video, VideoCategory, VIDEO_TYPES
+
+logger = logging.getLogger(__name__)
+
+# 分面：查询参数名 -> 标题，标量分面的参数名即 Video 字段名
+FACETS = {
+    'category': '分类',
+    'tag': '标签',
+    'year': '年份',
+    'area': '地区',
+    'language': '语言',
+    'video_type': '类型',
+    'update_status': '状态',
+}
+SCALAR_FACETS = ('year', 'area', 'language', 'video_type', 'update_status')
+ID_FACETS = ('category', 'tag')
+
+# 影响分面的 Video 字段，只更新其他字段时不记录变更
+FACET_FIELDS = set(SCALAR_FACETS) | {'is_active'}
+
+CONTAINER_BITS = 16
+CONTAINER_BYTES = (1 << CONTAINER_BITS) // 8
+LOW_MASK = (1 << CONTAINER_BITS) - 1
+ARRAY_LIMIT = 4096
+
+VERSION_KEY = 'facets:version'
+CHANGE_KEY_TEMPLATE = 'facets:change:{seq}'
+CHANGE_TIMEOUT = 3600
+# 落后的变更超过该数量时整体重建
+MAX_PENDING_CHANGES = 500
+# 进程内索引的最长使用时间，定期重建以回收已删除视频的行号
+MAX_INDEX_AGE = 6 * 3600
+
+# 结果不超过该数量时列表页按ID列表查询，否则由数据库按条件筛选
+MAX_ID_FILTER = 2000
+
+# 每个分面最多返回的取值数（按数量降序，已选中的取值总是返回）
+MAX_FACET_VALUES = 30
+
+# 每个字节中为1的位
+BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+def _to_bits(container):
+    if isinstance(container, int):
+        return container
+    buffer = bytearray(CONTAINER_BYTES)
+    for low in container:
+        buffer[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def _to_lows(container):
+    """桶内元素，升序"""
+    if not isinstance(container, int):
+        return sorted(container)
+    lows = []
+    for i, byte in enumerate(container.to_bytes(CONTAINER_BYTES, 'little')):
+        if byte:
+            base = i << 3
+            lows.extend(base + bit for bit in BYTE_BITS[byte])
+    return lows
+
+
+def _cardinality(container):
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+
+def _compact(container):
+    """空桶返回None，整数位图元素较少时转为集合"""
+    if isinstance(container, int) and container.bit_count() <= ARRAY_LIMIT:
+        container = set(_to_lows(container))
+    return container or None
+
+
+def _split(a, b):
+    """混合类型的一对桶，返回 (集合, 整数位图的字节表示)"""
+    if isinstance(a, int):
+        a, b = b, a
+    return a, b.to_bytes(CONTAINER_BYTES, 'little')
+
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _compact(a & b)
+    if not isinstance(a, int) and not isinstance(b, int):
+        return a & b or None
+    lows, data = _split(a, b)
+    return {low for low in lows if data[low >> 3] >> (low & 7) & 1} or None
+
+
+def _and_count(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return (a & b).bit_count()
+    if not isinstance(a, int) and not isinstance(b, int):
+        return len(a & b)
+    lows, data = _split(a, b)
+    return sum(data[low >> 3] >> (low & 7) & 1 for low in lows)
+
+
+def _or(a, b):
+    if not isinstance(a, int) and not isinstance(b, int):
+        merged = a | b
+        return merged if len(merged) <= ARRAY_LIMIT else _to_bits(merged)
+    return _to_bits(a) | _to_bits(b)
+
+
+class Bitmap:
+    """Roaring 风格的压缩位图，元素为非负整数行号"""
+
+    __slots__ = ('containers',)
+
+    def __init__(self, containers=None):
+        self.containers = containers or {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        buckets = defaultdict(set)
+        for row in rows:
+            buckets[row >> CONTAINER_BITS].add(row & LOW_MASK)
+        return cls({
+            high: lows if len(lows) <= ARRAY_LIMIT else _to_bits(lows)
+            for high, lows in buckets.items()
+        })
+
+    def add(self, row):
+        high, low = row >> CONTAINER_BITS, row & LOW_MASK
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = {low}
+        elif isinstance(container, int):
+            self.containers[high] = container | (1 << low)
+        else:
+            container.add(low)
+            if len(container) > ARRAY_LIMIT:
+                self.containers[high] = _to_bits(container)
+
+    def discard(self, row):
+        high, low = row >> CONTAINER_BITS, row & LOW_MASK
+        container = self.containers.get(high)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container = _compact(container & ~(1 << low))
+        else:
+            container.discard(low)
+        if container:
+            self.containers[high] = container
+        else:
+            del self.containers[high]
+
+    def __and__(self, other):
+        containers = {}
+        for high, container in self.containers.items():
+            other_container = other.containers.get(high)
+            if other_container is not None:
+                result = _and(container, other_container)
+                if result:
+                    containers[high] = result
+        return Bitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for high, container in other.containers.items():
+            containers[high] = _or(containers[high], container) if high in containers else container
+        return Bitmap(containers)
+
+    def intersection_count(self, other):
+        """与另一位图交集的元素数，不构造交集"""
+        return sum(
+            _and_count(container, other.containers[high])
+            for high, container in self.containers.items()
+            if high in other.containers
+        )
+
+    def __len__(self):
+        return sum(_cardinality(container) for container in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            base = high << CONTAINER_BITS
+            for low in _to_lows(self.containers[high]):
+                yield base + low
+
+
+def load_facet_values(video_ids=None):
+    """启用中视频的分面取值 {视频ID: {(分面, 取值), ...}}，video_ids 为空时加载全部"""
+    videos = Video.objects.filter(is_active=True)
+    categories = VideoCategory.objects.filter(video__is_active=True)
+    tags = Video.tags.through.objects.filter(video__is_active=True)
+    if video_ids is not None:
+        videos = videos.filter(id__in=video_ids)
+        categories = categories.filter(video_id__in=video_ids)
+        tags = tags.filter(video_id__in=video_ids)
+
+    values = {}
+    for row in videos.values_list('id', *SCALAR_FACETS).iterator(chunk_size=5000):
+        values[row[0]] = {(facet, value) for facet, value in zip(SCALAR_FACETS, row[1:]) if value}
+    for facet, relations, field in (('category', categories, 'category_id'), ('tag', tags, 'tag_id')):
+        for video_id, value in relations.values_list('video_id', field).iterator(chunk_size=5000):
+            if video_id in values:
+                values[video_id].add((facet, value))
+    return values
+
+
+class FacetIndex:
+    """进程内的分面位图索引"""
+
+    def __init__(self, version):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.rows = {}          # 视频ID -> 行号
+        self.video_ids = []     # 行号 -> 视频ID，已移除的为None
+        self.row_values = {}    # 行号 -> 分面取值，移除时用
+        self.all = Bitmap()
+        self.bitmaps = {facet: {} for facet in FACETS}
+
+    @classmethod
+    def build(cls, version):
+        index = cls(version)
+        values = load_facet_values()
+        for video_id in sorted(values):
+            index.rows[video_id] = len(index.video_ids)
+            index.video_ids.append(video_id)
+        rows_by_value = defaultdict(list)
+        for video_id, pairs in values.items():
+            row = index.rows[video_id]
+            index.row_values[row] = frozenset(pairs)
+            for pair in pairs:
+                rows_by_value[pair].append(row)
+        index.all = Bitmap.from_rows(range(len(index.video_ids)))
+        for (facet, value), rows in rows_by_value.items():
+            index.bitmaps[facet][value] = Bitmap.from_rows(rows)
+        return index
+
+    def _remove(self, row):
+        for facet, value in self.row_values.pop(row, ()):
+            bitmap = self.bitmaps[facet].get(value)
+            if bitmap is not None:
+                bitmap.discard(row)
+                if not bitmap:
+                    del self.bitmaps[facet][value]
+
+    def apply(self, video_ids, version):
+        """重新加载变更的视频"""
+        values = load_facet_values(video_ids)
+        with self.lock:
+            for video_id in video_ids:
+                row = self.rows.get(video_id)
+                pairs = values.get(video_id)
+                if row is not None:
+                    self._remove(row)
+                if pairs is None:
+                    if row is not None:
+                        self.all.discard(row)
+                        self.video_ids[row] = None
+                        del self.rows[video_id]
+                    continue
+                if row is None:
+                    row = self.rows[video_id] = len(self.video_ids)
+                    self.video_ids.append(video_id)
+                    self.all.add(row)
+                self.row_values[row] = frozenset(pairs)
+                for facet, value in pairs:
+                    self.bitmaps[facet].setdefault(value, Bitmap()).add(row)
+            self.version = version
+
+    def _match(self, selection, exclude=None):
+        result = self.all
+        for facet, values in selection.items():
+            if facet == exclude or not values:
+                continue
+            union = Bitmap()
+            for value in values:
+                bitmap = self.bitmaps[facet].get(value)
+                if bitmap is not None:
+                    union = union | bitmap
+            result = result & union
+        return result
+
+    def search(self, selection, max_ids=None):
+        """筛选，返回 (视频ID列表, 结果数, 各分面的 [(取值, 数量), ...])
+
+        结果数超过 max_ids 时不展开视频ID，返回None。各分面的数量按“其他分面的
+        筛选条件”计算，同一分面内切换取值时数量不变。
+        """
+        with self.lock:
+            matched = self._match(selection)
+            total = len(matched)
+            video_ids = None
+            if max_ids is None or total <= max_ids:
+                video_ids = [self.video_ids[row] for row in matched]
+            counts = {}
+            for facet in FACETS:
+                base = matched if not selection.get(facet) else self._match(selection, exclude=facet)
+                facet_counts = [
+                    (value, base.intersection_count(bitmap))
+                    for value, bitmap in self.bitmaps[facet].items()
+                ]
+                selected = set(selection.get(facet, ()))
+                facet_counts = [item for item in facet_counts if item[1] or item[0] in selected]
+                facet_counts.sort(key=lambda item: (-item[1], str(item[0])))
+                top = facet_counts[:MAX_FACET_VALUES]
+                top += [item for item in facet_counts[MAX_FACET_VALUES:] if item[0] in selected]
+                counts[facet] = top
+        return video_ids, total, counts
+
+
+_local = {'index': None}
+_build_lock = threading.Lock()
+
+
+def mark_changed(video_ids):
+    """记录分面取值可能变化的视频，事务提交后生效"""
+    video_ids = list(video_ids)
+    if not video_ids:
+        return
+
+    def record():
+        cache.add(VERSION_KEY, 0, None)
+        try:
+            seq = cache.incr(VERSION_KEY)
+        except ValueError:
+            return
+        cache.set(CHANGE_KEY_TEMPLATE.format(seq=seq), video_ids, CHANGE_TIMEOUT)
+
+    transaction.on_commit(record)
+
+
+def get_index():
+    """返回与缓存版本同步的分面索引"""
+    version = cache.get(VERSION_KEY, 0)
+    index = _local['index']
+    if index is not None and index.version == version and time.monotonic() - index.built_at < MAX_INDEX_AGE:
+        return index
+
+    with _build_lock:
+        index = _local['index']
+        expired = index is None or time.monotonic() - index.built_at >= MAX_INDEX_AGE
+        if not expired and index.version < version <= index.version + MAX_PENDING_CHANGES:
+            keys = [CHANGE_KEY_TEMPLATE.format(seq=seq) for seq in range(index.version + 1, version + 1)]
+            changes = cache.get_many(keys)
+            if len(changes) == len(keys):
+                index.apply({video_id for ids in changes.values() for video_id in ids}, version)
+                return index
+        elif not expired and index.version == version:
+            return index
+        started = time.monotonic()
+        index = FacetIndex.build(version)
+        _local['index'] = index
+        logger.info(f'分面索引重建完成: {len(index.video_ids)} 个视频，耗时 {time.monotonic() - started:.2f}s')
+        return index
+
+
+def parse_selection(params):
+    """从查询参数解析筛选条件，分类和标签为ID，忽略无效值"""
+    selection = {}
+    for facet in FACETS:
+        values = [value for value in params.getlist(facet) if value]
+        if facet in ID_FACETS:
+            values = [int(value) for value in values if value.isdigit()]
+        if values:
+            selection[facet] = list(dict.fromkeys(values))
+    return selection
+
+
+def filter_queryset(queryset, selection):
+    """用数据库条件筛选，结果较多、不适合按ID列表查询时使用"""
+    for facet, values in selection.items():
+        if facet == 'category':
+            queryset = queryset.filter(
+                id__in=VideoCategory.objects.filter(category_id__in=values).values('video_id')
+            )
+        elif facet == 'tag':
+            queryset = queryset.filter(
+                id__in=Video.tags.through.objects.filter(tag_id__in=values).values('video_id')
+            )
+        else:
+            queryset = queryset.filter(**{f'{facet}__in': values})
+    return queryset
+
+
+def selection_query(selection, **extra):
+    """筛选条件对应的查询字符串"""
+    params = [(facet, value) for facet, values in selection.items() for value in values]
+    params += [(name, value) for name, value in extra.items() if value]
+    return urlencode(params)
+
+
+def facet_context(selection, counts, sort=None):
+    """筛选界面：每个分面的标题、取值、数量、是否选中和切换该取值的链接"""
+    label = value_labels(counts)
+    facets = []
+    for facet, title in FACETS.items():
+        selected = selection.get(facet, [])
+        others = {name: values for name, values in selection.items() if name != facet}
+        values = []
+        for value, count in counts.get(facet, ()):
+            name = label(facet, value)
+            if name is None:
+                continue
+            toggled = [item for item in selected if item != value] if value in selected else selected + [value]
+            values.append({
+                'value': value,
+                'label': name,
+                'count': count,
+                'selected': value in selected,
+                'query': selection_query({**others, facet: toggled}, sort=sort),
+            })
+        if values:
+            facets.append({
+                'name': facet,
+                'title': title,
+                'values': values,
+                'selected': bool(selected),
+                'clear_query': selection_query(others, sort=sort),
+            })
+    return facets
+
+
+def value_labels(counts):
+    """分面取值的显示名称"""
+    from .category_tree import get_category_tree
+    from .models import Tag
+
+    tree = get_category_tree()
+    tag_ids = [value for value, _ in counts.get('tag', ())]
+    tags = dict(Tag.objects.filter(id__in=tag_ids).values_list('id', 'name')) if tag_ids else {}
+    status_labels = dict(Video._meta.get_field('update_status').choices)
+    type_labels = dict(VIDEO_TYPES)
+
+    def label(facet, value):
+        if facet == 'category':
+            category = tree.get(value)
+            return category.name if category else None
+        if facet == 'tag':
+            return tags.get(value)
+        if facet == 'video_type':
+            return type_labels.get(value, value)
+        if facet == 'update_status':
+            return status_labels.get(value, value)
+        return value
+
+    return label
@@ -0,0 +1,84 @@
+"""视频卡片和网格的片段缓存
+
+每张卡片渲染后的 HTML 按 (模板, 视频ID) 缓存，同时记录视频的 updated_at；读取时
+updated_at 不一致即视为失效。一页卡片只需一次 get_many，命中的卡片直接拼接，
+只有未命中的卡片才渲染模板。列表页通过 video_cards 标签使用。
+
+视频网格组件通过 video_grid 标签使用，拼接好的整组卡片再按视频ID列表及各自的
+updated_at 缓存，命中时只需一次缓存读取；未命中时卡片仍从卡片缓存拼接。
+
+视频保存、删除或计数落库时删除对应卡片缓存。网格缓存时间较短，计数类字段在
+网格中最多滞后 GRID_TIMEOUT 秒。
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+CARD_TEMPLATE = 'components/video-card.html'
+GRID_TEMPLATE = 'components/video-grid.html'
+
+# 模板结构变化时递增，使旧片段全部失效
+VERSION = 1
+CARD_TIMEOUT = 600
+GRID_TIMEOUT = 60
+
+# 使用片段缓存的卡片模板，失效时逐个删除
+CARD_TEMPLATES = (
+    'components/video-card.html',
+    'components/video-list-card.html',
+)
+
+
+def card_key(template_name, video_id):
+    return f'fragment:v{VERSION}:card:{template_name}:{video_id}'
+
+
+def video_stamp(video):
+    return video.updated_at.timestamp() if video.updated_at else 0
+
+
+def render_cards(videos, template_name=CARD_TEMPLATE):
+    """渲染一组卡片，返回按顺序排列的 HTML 片段列表"""
+    videos = list(videos)
+    keys = [card_key(template_name, video.id) for video in videos]
+    cached = cache.get_many(keys)
+    fragments = []
+    missing = {}
+    for key, video in zip(keys, videos):
+        entry = cached.get(key)
+        if entry is not None and entry[0] == video_stamp(video):
+            fragments.append(entry[1])
+            continue
+        html = render_to_string(template_name, {'video': video})
+        missing[key] = (video_stamp(video), html)
+        fragments.append(html)
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+    return [mark_safe(html) for html in fragments]
+
+
+def grid_key(videos, template_name):
+    identity = ','.join(f'{video.id}:{video_stamp(video)}' for video in videos)
+    digest = hashlib.sha1(f'{template_name}|{identity}'.encode()).hexdigest()
+    return f'fragment:v{VERSION}:grid:{digest}'
+
+
+def render_grid(videos, template_name=CARD_TEMPLATE):
+    """拼接一组卡片的 HTML，整组按视频ID列表缓存"""
+    videos = list(videos)
+    key = grid_key(videos, template_name)
+    html = cache.get(key)
+    if html is None:
+        html = ''.join(render_cards(videos, template_name))
+        cache.set(key, html, GRID_TIMEOUT)
+    return mark_safe(html)
+
+
+def invalidate_cards(video_ids):
+    cache.delete_many([
+        card_key(template_name, video_id)
+        for template_name in CARD_TEMPLATES
+        for video_id in video_ids
+    ])
@@ -0,0 +1,378 @@
+"""剧集 HLS 本地缓存
+
+播放数达到阈值的剧集把远端 m3u8 拉取到本地：播放列表中的分片、密钥和初始化
+分段并发下载到 ``media_files/<剧集ID>/``，播放列表改写为指向本地文件的地址。
+本地文件按远端地址的哈希命名，哈希时去掉查询参数中每次变化的签名和过期时间
+（HLS_CACHE_VOLATILE_PARAMS），其余参数保留，刷新时已下载的分片直接复用，只下载
+新增部分。远端链接48小时过期，到期前 HLS_CACHE_REFRESH_MARGIN 内重新拉取一次，
+链接过期后本地缓存继续可用，直到链接更新。
+
+缓存总大小受磁盘预算限制，超出时按播放数随闲置时间衰减后的得分淘汰得分最低的
+剧集，缓存已满时得分低于所有已缓存剧集的新剧集不会被缓存：
+    HLS_CACHE_MAX_BYTES = 50 * 1024 ** 3
+    HLS_CACHE_CONCURRENCY = 8
+    HLS_CACHE_REFRESH_MARGIN = 6 * 3600   # 秒
+    HLS_CACHE_HALF_LIFE = 24 * 3600       # 播放数衰减半衰期（秒）
+    HLS_CACHE_VOLATILE_PARAMS = [...]     # 不参与文件命名的查询参数，默认见 VOLATILE_PARAMS
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import SeriesVideo, M3U8_TTL_HOURS
+from . import counters
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 50 * 1024 ** 3
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REFRESH_MARGIN = 6 * 3600
+DEFAULT_HALF_LIFE = 24 * 3600
+
+CACHE_DIR = 'media_files'
+PLAYLIST_NAME = 'index.m3u8'
+FETCH_TIMEOUT = 30
+FETCH_RETRIES = 2
+READ_SIZE = 64 * 1024
+# 最后播放时间的最小写入间隔（秒）
+LAST_PLAYED_RESOLUTION = 60
+USER_AGENT = 'Mozilla/5.0 (compatible; hls-cache)'
+# 常见 CDN 防盗链的签名和过期参数（不区分大小写），以及 S3 预签名参数前缀
+VOLATILE_PARAMS = (
+    'auth_key', 'sign', 'signature', 'sig', 'token', 'expires', 'expire',
+    'wssecret', 'wstime', 'txsecret', 'txtime', 'policy', 'key-pair-id', 'hdnts', 'hdnea',
+)
+VOLATILE_PREFIXES = ('x-amz-',)
+
+URI_ATTRIBUTE = re.compile(r'URI="([^"]+)"')
+BANDWIDTH_ATTRIBUTE = re.compile(r'BANDWIDTH=(\d+)')
+
+
+class HLSCacheError(Exception):
+    """远端播放列表无法缓存"""
+
+
+def cache_root():
+    return os.path.join(settings.MEDIA_ROOT, CACHE_DIR)
+
+
+def series_dir(series_id):
+    return os.path.join(cache_root(), str(series_id))
+
+
+def local_url(series_id, name):
+    return f'{settings.MEDIA_URL}{CACHE_DIR}/{series_id}/{name}'
+
+
+def is_volatile(param, volatile):
+    param = param.lower()
+    return param in volatile or param.startswith(VOLATILE_PREFIXES)
+
+
+def local_name(url):
+    """远端地址对应的本地文件名
+
+    忽略签名和过期时间参数，其余查询参数排序后参与哈希：同一分片换签名后文件名
+    不变，只靠查询参数区分的不同分片（如 ``seg.php?n=1``）不会相互覆盖。
+    """
+    volatile = {param.lower() for param in getattr(settings, 'HLS_CACHE_VOLATILE_PARAMS', VOLATILE_PARAMS)}
+    parts = urlsplit(url)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not is_volatile(key, volatile))
+    stable = urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+    extension = os.path.splitext(parts.path)[1].lower() or '.ts'
+    return hashlib.sha1(stable.encode()).hexdigest()[:20] + extension
+
+
+def fetch(url, timeout=FETCH_TIMEOUT):
+    request = Request(url, headers={'User-Agent': USER_AGENT})
+    return urlopen(request, timeout=timeout)
+
+
+def fetch_text(url):
+    with fetch(url) as response:
+        return response.read().decode('utf-8-sig'), response.geturl()
+
+
+def is_master_playlist(text):
+    return '#EXT-X-STREAM-INF' in text
+
+
+def select_variant(text, base_url):
+    """主播放列表中码率最高的子播放列表地址"""
+    best, best_bandwidth = None, -1
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if not line.startswith('#EXT-X-STREAM-INF'):
+            continue
+        match = BANDWIDTH_ATTRIBUTE.search(line)
+        bandwidth = int(match.group(1)) if match else 0
+        uri = next((l.strip() for l in lines[i + 1:] if l.strip() and not l.startswith('#')), None)
+        if uri and bandwidth > best_bandwidth:
+            best, best_bandwidth = urljoin(base_url, uri), bandwidth
+    if best is None:
+        raise HLSCacheError('主播放列表中没有可用的子播放列表')
+    return best
+
+
+def rewrite_playlist(text, base_url, series_id):
+    """把媒体播放列表中的远端地址改写为本地地址
+
+    返回 (改写后的播放列表, {本地文件名: 远端地址})
+    """
+    resources = {}
+
+    def localize(uri):
+        remote = urljoin(base_url, uri)
+        name = local_name(remote)
+        resources[name] = remote
+        return local_url(series_id, name)
+
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith('#'):
+            if stripped.startswith(('#EXT-X-KEY', '#EXT-X-MAP')):
+                stripped = URI_ATTRIBUTE.sub(lambda m: f'URI="{localize(m.group(1))}"', stripped)
+            lines.append(stripped)
+        else:
+            lines.append(localize(stripped))
+    if not lines or lines[0] != '#EXTM3U':
+        raise HLSCacheError('不是有效的m3u8播放列表')
+    return '\n'.join(lines) + '\n', resources
+
+
+def download_file(url, path):
+    """下载到临时文件后原子替换，返回文件大小"""
+    tmp_path = f'{path}.part'
+    for attempt in range(FETCH_RETRIES + 1):
+        try:
+            with fetch(url) as response, open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(response, f, READ_SIZE)
+            os.replace(tmp_path, path)
+            return os.path.getsize(path)
+        except OSError as e:
+            if attempt == FETCH_RETRIES:
+                raise HLSCacheError(f'下载失败: {url}: {e}')
+    return 0
+
+
+def directory_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def cache_series(series, concurrency=None):
+    """下载或刷新剧集的本地缓存，返回本地缓存大小
+
+    已存在的分片不重复下载；刷新完成后删除新播放列表不再引用的文件。
+    """
+    if not series.m3u8_url or series.is_m3u8_expired():
+        raise HLSCacheError('m3u8链接为空或已过期')
+
+    text, base_url = fetch_text(series.m3u8_url)
+    if is_master_playlist(text):
+        text, base_url = fetch_text(select_variant(text, base_url))
+    playlist, resources = rewrite_playlist(text, base_url, series.id)
+
+    directory = series_dir(series.id)
+    os.makedirs(directory, exist_ok=True)
+    missing = {name: url for name, url in resources.items()
+               if not os.path.exists(os.path.join(directory, name))}
+    workers = concurrency or getattr(settings, 'HLS_CACHE_CONCURRENCY', DEFAULT_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hls-fetch') as executor:
+        futures = [executor.submit(download_file, url, os.path.join(directory, name))
+                   for name, url in missing.items()]
+        for future in futures:
+            future.result()
+
+    playlist_path = os.path.join(directory, PLAYLIST_NAME)
+    with open(f'{playlist_path}.part', 'w', encoding='utf-8') as f:
+        f.write(playlist)
+    os.replace(f'{playlist_path}.part', playlist_path)
+
+    keep = set(resources) | {PLAYLIST_NAME}
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name not in keep:
+            os.remove(entry.path)
+
+    size = directory_size(directory)
+    SeriesVideo.objects.filter(id=series.id).update(
+        is_downloaded=True,
+        local_path=os.path.join(CACHE_DIR, str(series.id)),
+        cache_size=size,
+        cached_at=timezone.now(),
+    )
+    series.is_downloaded, series.cache_size = True, size
+    logger.info(f'剧集 {series.id} 已缓存 {len(resources)} 个文件，新下载 {len(missing)} 个，共 {size} 字节')
+    return size
+
+
+def remove_series(series):
+    """删除剧集的本地缓存"""
+    shutil.rmtree(series_dir(series.id), ignore_errors=True)
+    SeriesVideo.objects.filter(id=series.id).update(is_downloaded=False, local_path='', cache_size=0)
+    series.is_downloaded, series.local_path, series.cache_size = False, '', 0
+
+
+def cache_score(series, now=None):
+    """淘汰得分：播放数按距最后一次播放的时间指数衰减，兼顾访问频率和最近访问"""
+    now = now or timezone.now()
+    half_life = getattr(settings, 'HLS_CACHE_HALF_LIFE', DEFAULT_HALF_LIFE)
+    idle = (now - (series.last_played_at or series.updated_at)).total_seconds()
+    return series.play_count * 0.5 ** (max(idle, 0) / half_life)
+
+
+def cached_size():
+    return SeriesVideo.objects.filter(is_downloaded=True).aggregate(total=Sum('cache_size'))['total'] or 0
+
+
+def should_admit(series):
+    """缓存已满时，只有得分高于最低已缓存剧集的新剧集才值得缓存"""
+    budget = getattr(settings, 'HLS_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    if cached_size() < budget:
+        return True
+    now = timezone.now()
+    cached = SeriesVideo.objects.filter(is_downloaded=True).exclude(id=series.id)
+    lowest = min((cache_score(other, now) for other in cached), default=0)
+    return cache_score(series, now) > lowest
+
+
+def enforce_budget(protect=()):
+    """缓存超出预算时按得分从低到高淘汰，返回淘汰的剧集数"""
+    budget = getattr(settings, 'HLS_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    total = cached_size()
+    if total <= budget:
+        return 0
+    now = timezone.now()
+    candidates = sorted(
+        SeriesVideo.objects.filter(is_downloaded=True).exclude(id__in=protect),
+        key=lambda series: cache_score(series, now),
+    )
+    evicted = 0
+    for series in candidates:
+        if total <= budget:
+            break
+        total -= series.cache_size
+        remove_series(series)
+        evicted += 1
+        logger.info(f'淘汰剧集缓存 {series.id}')
+    return evicted
+
+
+def refresh_due(margin=None):
+    """链接即将过期、且在本次有效期的刷新窗口内还没有重新拉取过的已缓存剧集"""
+    margin = margin if margin is not None else getattr(settings, 'HLS_CACHE_REFRESH_MARGIN', DEFAULT_REFRESH_MARGIN)
+    now = timezone.now()
+    refresh_after = timedelta(hours=M3U8_TTL_HOURS) - timedelta(seconds=margin)
+    return SeriesVideo.objects.filter(
+        is_downloaded=True,
+        updated_at__gt=now - timedelta(hours=M3U8_TTL_HOURS),
+        updated_at__lte=now - refresh_after,
+        cached_at__lt=F('updated_at') + refresh_after,
+    ).exclude(m3u8_url='')
+
+
+def download_due():
+    """播放数达到阈值、尚未缓存且链接仍有效的剧集"""
+    return SeriesVideo.objects.filter(
+        is_downloaded=False,
+        play_count__gte=F('download_threshold'),
+        updated_at__gt=timezone.now() - timedelta(hours=M3U8_TTL_HOURS),
+    ).exclude(m3u8_url='').order_by('-play_count')
+
+
+def sync(concurrency=None):
+    """刷新即将过期的缓存、缓存新的热门剧集并执行预算淘汰，返回统计"""
+    stats = {'refreshed': 0, 'downloaded': 0, 'skipped': 0, 'failed': 0, 'evicted': 0}
+    for series in refresh_due():
+        try:
+            cache_series(series, concurrency)
+            stats['refreshed'] += 1
+        except Exception as e:
+            stats['failed'] += 1
+            logger.warning(f'刷新剧集缓存 {series.id} 失败: {e}')
+    for series in download_due():
+        if not should_admit(series):
+            stats['skipped'] += 1
+            continue
+        try:
+            cache_series(series, concurrency)
+            stats['downloaded'] += 1
+        except Exception as e:
+            stats['failed'] += 1
+            logger.warning(f'缓存剧集 {series.id} 失败: {e}')
+            continue
+        stats['evicted'] += enforce_budget(protect={series.id})
+    stats['evicted'] += enforce_budget()
+    return stats
+
+
+class HLSCacheWorker:
+    """播放触发的后台缓存任务，同一剧集同时只下载一次"""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hls-cache')
+        self._lock = threading.Lock()
+        self._in_flight = set()
+
+    def schedule(self, series_id):
+        with self._lock:
+            if series_id in self._in_flight:
+                return None
+            self._in_flight.add(series_id)
+        return self.executor.submit(self._cache, series_id)
+
+    def _cache(self, series_id):
+        close_old_connections()
+        try:
+            series = SeriesVideo.objects.get(id=series_id)
+            if series.is_downloaded or not should_admit(series):
+                return
+            cache_series(series)
+            enforce_budget(protect={series_id})
+        except Exception as e:
+            logger.warning(f'缓存剧集 {series_id} 失败: {e}')
+        finally:
+            with self._lock:
+                self._in_flight.discard(series_id)
+            close_old_connections()
+
+
+worker = HLSCacheWorker()
+
+
+def record_play(series):
+    """记录一次播放，达到阈值时在后台缓存"""
+    now = timezone.now()
+    counters.incr(series, 'play_count')
+    series.play_count = counters.get_count(series, 'play_count')
+    if series.last_played_at is None or (now - series.last_played_at).total_seconds() > LAST_PLAYED_RESOLUTION:
+        SeriesVideo.objects.filter(id=series.id).update(last_played_at=now)
+        series.last_played_at = now
+    if series.should_download() and not series.is_m3u8_expired():
+        worker.schedule(series.id)
+
+
+def playlist_for(series):
+    """本地缓存的播放列表内容，未缓存时返回None"""
+    if not series.is_downloaded:
+        return None
+    try:
+        with open(os.path.join(series_dir(series.id), PLAYLIST_NAME), encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,278 @@
+"""响应式图片衍生版本
+
+封面、海报等原图按用途（卡片、详情、横幅）生成多个宽度的 WebP 版本，模板通过
+srcset 让浏览器按显示尺寸选择，卡片网格不再加载原图。
+
+衍生图片按来源和生成参数的哈希寻址，存放在 ``media/derivatives/`` 下；来源或参数
+变化时地址随之变化，因此可以长期缓存。首次请求时按需生成：同一来源同一用途的
+全部宽度一次生成，进程内和进程间都只有一个请求在生成（单飞），其余请求等待结果。
+缓存总大小超过 IMAGE_DERIVATIVE_MAX_BYTES 时按最近访问时间淘汰。
+
+需要 Pillow。
+"""
+from io import BytesIO
+import hashlib
+import logging
+import os
+import threading
+import time
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+
+from .models import Video, ImageResource
+
+logger = logging.getLogger(__name__)
+
+# 各用途的输出宽度
+PRESETS = {
+    'card': (240, 360, 480),
+    'detail': (640, 960, 1280),
+    'banner': (960, 1440, 1920),
+}
+
+# 模板 sizes 属性的默认值
+PRESET_SIZES = {
+    'card': '(max-width: 768px) 50vw, 240px',
+    'detail': '(max-width: 992px) 100vw, 640px',
+    'banner': '100vw',
+}
+
+# 图片资源类型对应的用途
+IMAGE_TYPE_PRESETS = {
+    'cover': ('card', 'detail'),
+    'poster': ('card', 'detail'),
+    'screenshot': ('card', 'detail'),
+    'banner': ('banner',),
+    'avatar': ('card',),
+    'other': ('detail',),
+}
+
+SOURCE_MODELS = {
+    'video': Video,
+    'image': ImageResource,
+}
+
+# 生成参数变化时递增，使旧地址全部失效
+VERSION = 1
+OUTPUT_FORMAT = 'WEBP'
+OUTPUT_EXTENSION = 'webp'
+OUTPUT_QUALITY = 80
+
+DERIVATIVE_DIR = 'derivatives'
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+FETCH_TIMEOUT = 15
+LOCK_TIMEOUT = 30
+WAIT_INTERVAL = 0.1
+
+
+class DerivativeError(Exception):
+    """无法生成衍生图片"""
+
+
+def source_kind(obj):
+    return 'video' if isinstance(obj, Video) else 'image'
+
+
+def get_source(obj):
+    """原图位置：本地文件的绝对路径或远端地址，没有原图时返回None"""
+    if isinstance(obj, Video):
+        if obj.thumbnail:
+            return obj.thumbnail
+        # 没有缩略图时使用主图，卡片查询中已预取
+        image = obj.main_image
+        return get_source(image) if image else None
+    if obj.local_path:
+        try:
+            if os.path.exists(obj.local_path.path):
+                return obj.local_path.path
+        except (ValueError, NotImplementedError):
+            pass
+    return obj.cdn_url or obj.url or None
+
+
+def source_identity(source):
+    """参与寻址的来源标识，本地文件包含修改时间和大小；本地文件不存在时抛出 DerivativeError"""
+    if source.startswith(('http://', 'https://')):
+        return source
+    try:
+        stat = os.stat(source)
+    except OSError as e:
+        raise DerivativeError(f'读取原图失败: {e}')
+    return f'{source}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def derivative_name(source, preset, width):
+    digest = hashlib.sha1(
+        f'{VERSION}|{OUTPUT_FORMAT}|{OUTPUT_QUALITY}|{preset}|{width}|{source_identity(source)}'.encode()
+    ).hexdigest()
+    return f'{digest[:2]}/{digest}.{OUTPUT_EXTENSION}'
+
+
+def derivative_path(name):
+    return os.path.join(settings.MEDIA_ROOT, DERIVATIVE_DIR, name)
+
+
+def derivative_url(obj, preset, width, source=None):
+    """已生成时返回媒体地址，否则返回按需生成的视图地址"""
+    source = source or get_source(obj)
+    try:
+        name = derivative_name(source, preset, width)
+    except DerivativeError:
+        name = None
+    if name and os.path.exists(derivative_path(name)):
+        return f'{settings.MEDIA_URL}{DERIVATIVE_DIR}/{name}'
+    return reverse('files:image_derivative', args=[source_kind(obj), obj.id, preset, width])
+
+
+def srcset(obj, preset):
+    """模板 srcset 属性值，没有原图时返回空字符串"""
+    source = get_source(obj)
+    if not source:
+        return ''
+    return ', '.join(f'{derivative_url(obj, preset, width, source)} {width}w' for width in PRESETS[preset])
+
+
+def default_src(obj, preset):
+    """不支持 srcset 时使用的地址：该用途的中间宽度"""
+    source = get_source(obj)
+    if not source:
+        return ''
+    widths = PRESETS[preset]
+    return derivative_url(obj, preset, widths[len(widths) // 2], source)
+
+
+def read_source(source):
+    if not source.startswith(('http://', 'https://')):
+        with open(source, 'rb') as f:
+            return f.read(MAX_SOURCE_BYTES + 1)
+    request = Request(source, headers={'User-Agent': 'Mozilla/5.0'})
+    with urlopen(request, timeout=FETCH_TIMEOUT) as response:
+        return response.read(MAX_SOURCE_BYTES + 1)
+
+
+def generate(source, preset):
+    """解码原图一次，生成该用途的全部宽度"""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise DerivativeError('未安装 Pillow')
+
+    try:
+        data = read_source(source)
+    except OSError as e:
+        raise DerivativeError(f'读取原图失败: {e}')
+    if len(data) > MAX_SOURCE_BYTES:
+        raise DerivativeError('原图过大')
+
+    widths = PRESETS[preset]
+    try:
+        image = Image.open(BytesIO(data))
+        # JPEG 解码时直接缩小到接近最大输出宽度，减少解码开销
+        image.draft('RGB', (max(widths), max(widths) * image.height // max(image.width, 1)))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    except Exception as e:
+        raise DerivativeError(f'无法解码原图: {e}')
+
+    for width in sorted(widths, reverse=True):
+        output_width = min(width, image.width)
+        output_height = max(1, round(image.height * output_width / image.width))
+        resized = image.resize((output_width, output_height), Image.LANCZOS) if output_width != image.width else image
+        path = derivative_path(derivative_name(source, preset, width))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        resized.save(tmp_path, OUTPUT_FORMAT, quality=OUTPUT_QUALITY, method=4)
+        os.replace(tmp_path, path)
+        # 从已缩小的版本继续缩小，比每次都从原图缩小更快
+        image = resized
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def ensure_derivatives(source, preset):
+    """确保该来源该用途的衍生图片都已生成，同一时间只有一个请求在生成"""
+    names = [derivative_name(source, preset, width) for width in PRESETS[preset]]
+    if all(os.path.exists(derivative_path(name)) for name in names):
+        return
+
+    key = names[0].split('/')[1].split('.')[0]
+    with _locks_guard:
+        lock = _locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            if all(os.path.exists(derivative_path(name)) for name in names):
+                return
+            lock_key = f'image_derivative:lock:{key}'
+            if cache.add(lock_key, 1, LOCK_TIMEOUT):
+                try:
+                    generate(source, preset)
+                finally:
+                    cache.delete(lock_key)
+                return
+            # 其他进程正在生成，等待结果
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                if all(os.path.exists(derivative_path(name)) for name in names):
+                    return
+                time.sleep(WAIT_INTERVAL)
+            raise DerivativeError('等待生成超时')
+    finally:
+        with _locks_guard:
+            _locks.pop(key, None)
+
+
+def get_derivative_path(obj, preset, width):
+    """生成（如需要）并返回衍生图片的本地路径"""
+    source = get_source(obj)
+    if not source:
+        raise DerivativeError('没有原图')
+    ensure_derivatives(source, preset)
+    path = derivative_path(derivative_name(source, preset, width))
+    try:
+        os.utime(path)  # 记录访问时间，供淘汰使用
+    except OSError:
+        pass
+    return path
+
+
+def presets_for(obj):
+    if isinstance(obj, Video):
+        return ('card', 'detail')
+    return IMAGE_TYPE_PRESETS.get(obj.image_type, ('detail',))
+
+
+def prune(max_bytes=None):
+    """缓存超过预算时删除最久未访问的衍生图片，返回 (删除数, 释放字节数)"""
+    max_bytes = max_bytes if max_bytes is not None else getattr(
+        settings, 'IMAGE_DERIVATIVE_MAX_BYTES', DEFAULT_MAX_BYTES
+    )
+    root = os.path.join(settings.MEDIA_ROOT, DERIVATIVE_DIR)
+    if not os.path.isdir(root):
+        return 0, 0
+    files = []
+    total = 0
+    for bucket in os.scandir(root):
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+                total += stat.st_size
+    removed = freed = 0
+    for _, size, path in sorted(files):
+        if total - freed <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        removed += 1
+        freed += size
+    return removed, freed
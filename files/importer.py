@@ -0,0 +1,492 @@
+"""第三方来源批量导入
+
+从 ThirdPartySource 的接口分页拉取视频目录（苹果CMS格式：``list`` 中为 vod_*
+字段，``pagecount`` 为总页数），写入 Video 和 VideoMedia：
+
+- 抓取使用 asyncio 和 aiohttp，连接池复用长连接，同时进行的请求数不超过
+  concurrency；安装 ijson 时边下载边解析 ``list`` 中的条目，否则整页解析
+- 解析出的条目经有界队列交给唯一的写入线程，按 batch_size 成批写入：视频按
+  third_party_id（``<来源ID>:<vod_id>``）批量 upsert，剧集和播放源批量新增、
+  更新或删除，一批只需几条语句
+- 每批写入后把进度保存到来源的 extra_info['import_checkpoint']：连续完成的页
+  之前的部分记为水位，之后零散完成的页单独记录。中断后再次导入从检查点继续，
+  不重复请求已写入的页；检查点记录附加的请求参数（如 h），参数不同时从第一页开始
+
+导入使用批量写入，不触发 Video 的 post_save 信号；排行榜、分面索引、搜索建议
+和卡片缓存在每批写入后直接更新，搜索索引需要导入后执行 rebuild_search_index。
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import asyncio
+import json
+import logging
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import Video, VideoMedia, ThirdPartySource
+from . import facets
+from . import fragments
+from . import leaderboards
+from . import suggestions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_BATCH_SIZE = 500
+REQUEST_TIMEOUT = 30
+RETRIES = 3
+RETRY_BACKOFF = 1.0
+# 凑批最长等待时间（秒）
+BATCH_WAIT = 1.0
+
+CHECKPOINT_KEY = 'import_checkpoint'
+SOURCE_SEPARATOR = '$$$'
+EPISODE_SEPARATOR = '#'
+TITLE_SEPARATOR = '$'
+URL_MAX_LENGTH = 200
+
+# 冲突时更新的字段；播放数、启用状态、审核状态等站内维护的字段不覆盖
+UPSERT_FIELDS = [
+    'title', 'description', 'video_type', 'thumbnail', 'year', 'area', 'language',
+    'total_episodes', 'current_episodes', 'update_status', 'extra_info', 'updated_at',
+]
+MEDIA_FIELDS = ['cdn_url', 'api_request_url', 'episode_title', 'source_name', 'media_type']
+
+
+class SourceError(Exception):
+    """来源配置或响应无效"""
+
+
+def truncate(value, length):
+    value = (value or '').strip()
+    return value[:length] if value else None
+
+
+def to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def valid_url(url):
+    return bool(url) and url.startswith(('http://', 'https://')) and len(url) <= URL_MAX_LENGTH
+
+
+def parse_episodes(item):
+    """播放源和剧集 [(来源索引, 来源名称, 集数索引, 标题, 地址), ...]"""
+    names = (item.get('vod_play_from') or '').split(SOURCE_SEPARATOR)
+    episodes = []
+    for source_index, playlist in enumerate((item.get('vod_play_url') or '').split(SOURCE_SEPARATOR)):
+        source_name = truncate(names[source_index] if source_index < len(names) else '', 50)
+        for episode_index, entry in enumerate(filter(None, playlist.split(EPISODE_SEPARATOR))):
+            title, _, url = entry.rpartition(TITLE_SEPARATOR)
+            url = url.strip()
+            if valid_url(url):
+                episodes.append((source_index, source_name, episode_index, truncate(title, 200), url))
+    return episodes
+
+
+def build_video(source, item, now):
+    """把一个条目转换为未保存的 Video，缺少ID或标题时返回None"""
+    vod_id = item.get('vod_id')
+    title = truncate(item.get('vod_name'), 200)
+    if vod_id in (None, '') or not title:
+        return None
+    episodes = parse_episodes(item)
+    total = max(to_int(item.get('vod_total'), 1), 1)
+    current = max(to_int(item.get('vod_serial'), 0), max((e[2] for e in episodes), default=0) + 1)
+    thumbnail = (item.get('vod_pic') or '').strip()
+    return Video(
+        third_party_id=f'{source.id}:{vod_id}',
+        title=title,
+        description=strip_tags(item.get('vod_content') or '').strip() or '暂无描述',
+        video_type='series' if max(total, current) > 1 else 'single',
+        status='published',
+        thumbnail=thumbnail if valid_url(thumbnail) else None,
+        year=truncate(str(item.get('vod_year') or ''), 20),
+        area=truncate(item.get('vod_area'), 100),
+        language=truncate(item.get('vod_lang'), 50),
+        total_episodes=total,
+        current_episodes=min(current, total) if total > 1 else current,
+        update_status='completed' if to_int(item.get('vod_isend')) or current >= total else 'ongoing',
+        extra_info={
+            'source_id': source.id,
+            'vod_id': vod_id,
+            'remarks': item.get('vod_remarks') or '',
+            'type_name': item.get('type_name') or '',
+            'actor': item.get('vod_actor') or '',
+            'director': item.get('vod_director') or '',
+        },
+        created_at=now,
+        updated_at=now,
+    )
+
+
+def write_batch(source, entries):
+    """写入一批 (页码, 条目, 请求地址)，返回 (写入的视频数, 写入的媒体数)"""
+    now = timezone.now()
+    videos = {}
+    episodes = {}
+    request_urls = {}
+    for _, item, request_url in entries:
+        video = build_video(source, item, now)
+        if video is None:
+            continue
+        videos[video.third_party_id] = video
+        episodes[video.third_party_id] = parse_episodes(item)
+        request_urls[video.third_party_id] = request_url if len(request_url) <= URL_MAX_LENGTH else None
+    if not videos:
+        return 0, 0
+
+    with transaction.atomic():
+        Video.objects.bulk_create(
+            list(videos.values()),
+            update_conflicts=True,
+            unique_fields=['third_party_id'],
+            update_fields=UPSERT_FIELDS,
+        )
+        ids = dict(Video.objects.filter(third_party_id__in=list(videos)).values_list('third_party_id', 'id'))
+        media_count = sync_media(source, ids, episodes, request_urls)
+
+    video_ids = list(ids.values())
+    leaderboards.refresh_videos(video_ids)
+    facets.mark_changed(video_ids)
+    suggestions.mark_changed('video', video_ids)
+    fragments.invalidate_cards(video_ids)
+    return len(ids), media_count
+
+
+def sync_media(source, ids, episodes, request_urls):
+    """按 (视频, 来源索引, 集数索引) 批量新增、更新或删除本来源导入的媒体"""
+    through = Video.media_files.through
+    existing = {}
+    stale = []
+    links = through.objects.filter(video_id__in=list(ids.values())).select_related('videomedia')
+    for link in links:
+        media = link.videomedia
+        if (media.extra_info or {}).get('import_source') != source.id:
+            continue
+        key = (link.video_id, media.source_index, media.episode_index)
+        if key in existing:
+            stale.append(media.id)
+        else:
+            existing[key] = media
+
+    to_create = []
+    to_update = []
+    for third_party_id, video_episodes in episodes.items():
+        video_id = ids.get(third_party_id)
+        if video_id is None:
+            continue
+        for source_index, source_name, episode_index, title, url in video_episodes:
+            fields = {
+                'cdn_url': url,
+                'api_request_url': request_urls[third_party_id],
+                'episode_title': title,
+                'source_name': source_name,
+                'media_type': 'm3u8' if '.m3u8' in url else 'mp4',
+            }
+            media = existing.pop((video_id, source_index, episode_index), None)
+            if media is None:
+                to_create.append((video_id, VideoMedia(
+                    episode_index=episode_index,
+                    source_index=source_index,
+                    extra_info={'import_source': source.id},
+                    **fields
+                )))
+            elif any(getattr(media, name) != value for name, value in fields.items()):
+                for name, value in fields.items():
+                    setattr(media, name, value)
+                to_update.append(media)
+    # 来源中已不存在的剧集
+    stale.extend(media.id for media in existing.values())
+
+    if stale:
+        VideoMedia.objects.filter(id__in=stale).delete()
+    if to_update:
+        VideoMedia.objects.bulk_update(to_update, MEDIA_FIELDS)
+    if to_create:
+        created = VideoMedia.objects.bulk_create([media for _, media in to_create])
+        through.objects.bulk_create([
+            through(video_id=video_id, videomedia_id=media.id)
+            for (video_id, _), media in zip(to_create, created)
+        ])
+    return len(to_create) + len(to_update)
+
+
+class Checkpoint:
+    """导入进度：水位之前的页全部完成，之后零散完成的页记在 done 中"""
+
+    def __init__(self, next_page=1, done=(), page_count=None, params=None):
+        self.next_page = next_page
+        self.done = set(done)
+        self.page_count = page_count
+        # 附加的请求参数，页码只对同样参数的列表有效
+        self.params = params or {}
+
+    @classmethod
+    def load(cls, source):
+        data = (source.extra_info or {}).get(CHECKPOINT_KEY) or {}
+        return cls(data.get('next_page', 1), data.get('done_pages', ()), data.get('page_count'),
+                   data.get('params'))
+
+    def is_done(self, page):
+        return page < self.next_page or page in self.done
+
+    def complete(self, page):
+        self.done.add(page)
+        while self.next_page in self.done:
+            self.done.remove(self.next_page)
+            self.next_page += 1
+
+    @property
+    def finished(self):
+        return self.page_count is not None and self.next_page > self.page_count
+
+    def to_dict(self):
+        return {
+            'next_page': self.next_page,
+            'done_pages': sorted(self.done),
+            'page_count': self.page_count,
+            'params': self.params,
+            'updated_at': timezone.now().isoformat(),
+        }
+
+
+def save_checkpoint(source, checkpoint):
+    """保存进度；全部完成时清除进度并记录完成时间"""
+    source.refresh_from_db(fields=['extra_info'])
+    extra_info = dict(source.extra_info or {})
+    if checkpoint is None or checkpoint.finished:
+        extra_info.pop(CHECKPOINT_KEY, None)
+        extra_info['last_import_at'] = timezone.now().isoformat()
+    else:
+        extra_info[CHECKPOINT_KEY] = checkpoint.to_dict()
+    ThirdPartySource.objects.filter(pk=source.pk).update(extra_info=extra_info)
+    source.extra_info = extra_info
+
+
+def request_config(source, extra_params=None):
+    """请求头和查询参数：来源配置的请求头、参数，加上认证信息"""
+    if not source.base_url:
+        raise SourceError(f'来源 {source} 没有配置基础URL')
+    headers = {'User-Agent': 'Mozilla/5.0', **(source.headers or {})}
+    if source.auth_token:
+        headers.setdefault('Authorization', f'Bearer {source.auth_token}')
+    params = {'ac': 'detail', **(source.params or {}), **(extra_params or {})}
+    if source.api_key:
+        params.setdefault((source.extra_info or {}).get('api_key_param', 'api_key'), source.api_key)
+    return headers, params
+
+
+def page_url(source, params, page):
+    page_param = (source.extra_info or {}).get('page_param', 'pg')
+    separator = '&' if '?' in source.base_url else '?'
+    return f'{source.base_url}{separator}{urlencode({**params, page_param: page})}'
+
+
+class Importer:
+    """单个来源的一次导入"""
+
+    def __init__(self, source, concurrency=None, batch_size=None, extra_params=None,
+                 max_pages=None, restart=False, stdout=None):
+        self.source = source
+        self.concurrency = concurrency or DEFAULT_CONCURRENCY
+        self.batch_size = batch_size or DEFAULT_BATCH_SIZE
+        self.headers, self.params = request_config(source, extra_params)
+        self.max_pages = max_pages
+        self.stdout = stdout
+        # 经过 JSON 往返，与检查点中保存的参数可以直接比较
+        extra_params = json.loads(json.dumps(extra_params or {}))
+        self.checkpoint = Checkpoint(params=extra_params)
+        if not restart:
+            checkpoint = Checkpoint.load(source)
+            if checkpoint.params == extra_params:
+                self.checkpoint = checkpoint
+            elif checkpoint.next_page > 1 or checkpoint.done:
+                self.log(f'检查点的请求参数 {checkpoint.params} 与本次不同，从第一页开始')
+        # 每页尚未写入的条目数，整页解析完成前为负数占位
+        self.pending = Counter()
+        self.parsed = set()
+        self.failed_pages = []
+        self.videos = 0
+        self.media = 0
+        # Django 连接属于线程，数据库操作全部在同一个线程中执行
+        self._db = ThreadPoolExecutor(max_workers=1, thread_name_prefix='import-db')
+
+    def log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+        logger.info(message)
+
+    async def db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db, func, *args)
+
+    async def fetch_page(self, session, page, queue):
+        """拉取一页，条目逐个放入队列，返回 (条目数, 总页数)"""
+        url = page_url(self.source, self.params, page)
+        for attempt in range(RETRIES):
+            count = 0
+            try:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    async for item, page_count in iter_items(response):
+                        if item is not None:
+                            await queue.put((page, item, url))
+                            count += 1
+                        elif page_count is not None:
+                            self.checkpoint.page_count = page_count
+                return count
+            except Exception as e:
+                if count or attempt == RETRIES - 1:
+                    # 部分条目已入队时不重试，该页留待下次导入
+                    raise
+                logger.warning(f'第 {page} 页请求失败，重试: {e}')
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    async def fetcher(self, session, pages, queue):
+        while True:
+            try:
+                page = pages.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                count = await self.fetch_page(session, page, queue)
+            except Exception as e:
+                logger.warning(f'第 {page} 页导入失败: {e}')
+                self.failed_pages.append(page)
+                continue
+            # 写入线程按页递减计数，解析完成后计数归零即整页完成
+            self.pending[page] += count
+            self.parsed.add(page)
+            await self.settle([page])
+
+    async def settle(self, pages):
+        """把已解析且条目全部写入的页记为完成，并保存进度"""
+        completed = [page for page in pages if page in self.parsed and self.pending[page] <= 0]
+        for page in completed:
+            self.checkpoint.complete(page)
+            self.parsed.discard(page)
+            self.pending.pop(page, None)
+        if completed:
+            await self.db(save_checkpoint, self.source, self.checkpoint)
+
+    async def writer(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            batch = [entry]
+            deadline = loop.time() + BATCH_WAIT
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    queue.put_nowait(None)
+                    break
+                batch.append(entry)
+
+            videos, media = await self.db(write_batch, self.source, batch)
+            self.videos += videos
+            self.media += media
+            written = Counter(page for page, _, _ in batch)
+            self.pending.subtract(written)
+            await self.settle(written)
+            self.log(f'已写入 {self.videos} 个视频，{self.media} 个媒体，进度 {self.checkpoint.next_page - 1}'
+                     f'/{self.checkpoint.page_count or "?"} 页')
+
+    async def fetch_all(self, session, queue):
+        # 先拉取第一个未完成的页以得到总页数
+        first = self.checkpoint.next_page
+        if self.checkpoint.page_count is None or not self.checkpoint.is_done(first):
+            pages = asyncio.Queue()
+            pages.put_nowait(first)
+            await self.fetcher(session, pages, queue)
+        last = self.checkpoint.page_count or first
+        if self.max_pages:
+            last = min(last, first + self.max_pages - 1)
+
+        pages = asyncio.Queue()
+        for page in range(first + 1, last + 1):
+            if not self.checkpoint.is_done(page):
+                pages.put_nowait(page)
+        await asyncio.gather(*(
+            self.fetcher(session, pages, queue) for _ in range(self.concurrency)
+        ))
+        await queue.put(None)
+
+    async def run(self):
+        try:
+            import aiohttp
+        except ImportError:
+            raise SourceError('未安装 aiohttp')
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        queue = asyncio.Queue(maxsize=self.batch_size * 2)
+        try:
+            async with aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=timeout) as session:
+                fetch = asyncio.create_task(self.fetch_all(session, queue))
+                writer = asyncio.create_task(self.writer(queue))
+                done, running = await asyncio.wait([fetch, writer], return_when=asyncio.FIRST_EXCEPTION)
+                # 一方失败时另一方无法结束（队列无人消费或不会收到结束标记），一并取消；
+                # 已保存的进度仍然有效
+                for task in running:
+                    task.cancel()
+                await asyncio.gather(*running, return_exceptions=True)
+                for task in done:
+                    task.result()
+        finally:
+            await self.db(close_old_connections)
+            self._db.shutdown()
+        return self.videos, self.media
+
+
+async def iter_items(response):
+    """逐个产出 (条目, None)；响应中的总页数以 (None, 总页数) 产出"""
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+    if ijson is None:
+        data = await response.json(content_type=None)
+        if not isinstance(data, dict):
+            raise SourceError('响应格式无效')
+        yield None, to_int(data.get('pagecount'), None)
+        for item in data.get('list') or ():
+            if isinstance(item, dict):
+                yield item, None
+        return
+
+    # 边下载边解析：顶层的 pagecount 和 list 中的每个条目
+    item = None
+    builder = None
+    async for prefix, event, value in ijson.parse_async(response.content, use_float=True):
+        if prefix == 'pagecount' and event in ('number', 'string'):
+            yield None, to_int(value, None)
+        elif prefix == 'list.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif builder is not None:
+            builder.event(event, value)
+            if prefix == 'list.item' and event == 'end_map':
+                item, builder = builder.value, None
+                yield item, None
+
+
+def import_source(source, **options):
+    """导入一个来源，返回 (写入的视频数, 写入的媒体数, 失败的页)"""
+    importer = Importer(source, **options)
+    videos, media = asyncio.run(importer.run())
+    return videos, media, sorted(importer.failed_pages)
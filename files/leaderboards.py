@@ -0,0 +1,183 @@
+"""视频排行榜
+
+为全站和每个分类维护热门（play_count）与最新（created_at）两种前N名视频ID列表，
+一级分类的榜单汇总其全部子分类。榜单存放在缓存中，缓存缺失时用一条查询重建；
+播放数落库、分类关联变化、视频保存时增量更新，数据库只用于按ID取出视频。
+
+增量更新的读取、合并、写回持有按榜单划分的缓存锁，多个进程不会互相覆盖；
+抢不到锁时把榜单标记为失效并删除，持锁的进程写回后发现标记会再删除一次，
+榜单在下次读取时重建。
+"""
+import logging
+
+from django.core.cache import cache
+from django.dispatch import Signal
+
+from .models import Video
+from .category_tree import get_category_tree
+
+logger = logging.getLogger(__name__)
+
+HOT = 'hot'
+LATEST = 'latest'
+BOARD_SIZE = 100
+CACHE_TIMEOUT = 3600
+LOCK_TIMEOUT = 5
+
+# 页面上展示的榜单长度，只有这一段的视频集合变化时才发送 board_changed
+DISPLAY_SIZE = 20
+
+# 影响榜单的 Video 字段，只更新其他字段时不刷新榜单
+RANKED_FIELDS = {'play_count', 'created_at', 'is_active'}
+
+# 榜单展示部分的成员变化或榜单失效后发送，kind 为榜单类型，category_ids 为受影响的范围
+board_changed = Signal()
+
+
+def board_key(kind, category_id=None):
+    scope = category_id if category_id is not None else 'global'
+    return f'leaderboard:{kind}:{scope}'
+
+
+def lock_key(key):
+    return f'{key}:lock'
+
+
+def dirty_key(key):
+    return f'{key}:dirty'
+
+
+def video_score(kind, play_count, created_at):
+    return play_count if kind == HOT else created_at.timestamp()
+
+
+def scope_category_ids(category_id):
+    """榜单覆盖的分类：分类本身及其全部子孙分类"""
+    tree = get_category_tree()
+    return [category_id] + [category.id for category in tree.get_descendants(category_id)]
+
+
+def build_board(kind, category_id=None):
+    """从数据库构建榜单，返回 [[得分, 视频ID], ...]"""
+    videos = Video.objects.filter(is_active=True)
+    if category_id is not None:
+        videos = videos.filter(categories__in=scope_category_ids(category_id)).distinct()
+    if kind == HOT:
+        rows = videos.order_by('-play_count', '-id').values_list('id', 'play_count', 'created_at')
+    else:
+        rows = videos.order_by('-created_at', '-id').values_list('id', 'play_count', 'created_at')
+    return [[video_score(kind, play_count, created_at), video_id]
+            for video_id, play_count, created_at in rows[:BOARD_SIZE]]
+
+
+def get_board(kind, category_id=None):
+    board = cache.get(board_key(kind, category_id))
+    if board is None:
+        board = build_board(kind, category_id)
+        cache.set(board_key(kind, category_id), board, CACHE_TIMEOUT)
+    return board
+
+
+def get_video_ids(kind, category=None, limit=12):
+    """获取榜单前 limit 个视频ID"""
+    category_id = category.id if category is not None else None
+    return [video_id for _, video_id in get_board(kind, category_id)[:limit]]
+
+
+def get_videos(kind, category=None, limit=12):
+    """获取榜单前 limit 个视频，按榜单顺序返回"""
+    return get_videos_many([(kind, category, limit)])[0]
+
+
+def get_videos_many(boards):
+    """一次查询取出多个榜单的视频
+
+    boards 为 [(榜单类型, 分类, 数量), ...]，返回与之对应的视频列表，同一视频只加载一次。
+    """
+    id_lists = [get_video_ids(kind, category, limit) for kind, category, limit in boards]
+    all_ids = {video_id for video_ids in id_lists for video_id in video_ids}
+    videos = Video.objects.filter(is_active=True).cards().in_bulk(all_ids) if all_ids else {}
+    return [[videos[video_id] for video_id in video_ids if video_id in videos] for video_ids in id_lists]
+
+
+def affected_scopes(category_ids):
+    """视频所属分类影响到的榜单范围：全站、所属分类及其全部祖先分类"""
+    tree = get_category_tree()
+    scopes = {None}
+    for category_id in category_ids:
+        category = tree.get(category_id)
+        while category is not None:
+            scopes.add(category.id)
+            category = tree.get(category.parent_id) if category.parent_id else None
+    return scopes
+
+
+def update_board(kind, category_id, video_id, score):
+    """把视频的新得分写入已缓存的榜单，未缓存的榜单等读取时再重建"""
+    key = board_key(kind, category_id)
+    if not cache.add(lock_key(key), True, LOCK_TIMEOUT):
+        # 其他进程正在更新该榜单，改为使其失效
+        cache.set(dirty_key(key), True, LOCK_TIMEOUT)
+        cache.delete(key)
+        board_changed.send(sender=None, kind=kind, category_ids=[category_id])
+        return
+    try:
+        changed = merge_into_board(key, video_id, score)
+        if cache.get(dirty_key(key)):
+            cache.delete_many([key, dirty_key(key)])
+            changed = True
+    finally:
+        cache.delete(lock_key(key))
+    if changed:
+        board_changed.send(sender=None, kind=kind, category_ids=[category_id])
+
+
+def merge_into_board(key, video_id, score):
+    """合并得分并写回，返回展示部分的成员是否变化
+
+    只在展示部分的视频集合变化时才算变化，名次调整不算，避免频繁清除页面缓存。
+    榜单上的视频得分降到榜尾之下时，无法得知榜外是否有视频应当补位，删除榜单等
+    下次读取时重建。
+    """
+    board = cache.get(key)
+    if board is None:
+        return False
+    displayed = {entry[1] for entry in board[:DISPLAY_SIZE]}
+    remaining = [entry for entry in board if entry[1] != video_id]
+    entry = [score, video_id]
+    if len(board) >= BOARD_SIZE and entry < board[-1]:
+        if len(remaining) == len(board):
+            # 不在榜上，也进不了榜
+            return False
+        cache.delete(key)
+        return video_id in displayed
+    remaining.append(entry)
+    remaining.sort(reverse=True)
+    cache.set(key, remaining[:BOARD_SIZE], CACHE_TIMEOUT)
+    return {entry[1] for entry in remaining[:DISPLAY_SIZE]} != displayed
+
+
+def refresh_videos(video_ids):
+    """按视频当前的播放数、创建时间和分类增量更新榜单"""
+    videos = Video.objects.filter(id__in=video_ids).values_list('id', 'play_count', 'created_at', 'is_active')
+    memberships = {}
+    for video_id, category_id in Video.categories.through.objects.filter(
+            video_id__in=video_ids).values_list('video_id', 'category_id'):
+        memberships.setdefault(video_id, []).append(category_id)
+
+    for video_id, play_count, created_at, is_active in videos:
+        scopes = affected_scopes(memberships.get(video_id, []))
+        if not is_active:
+            invalidate(scopes)
+            continue
+        for kind in (HOT, LATEST):
+            score = video_score(kind, play_count, created_at)
+            for category_id in scopes:
+                update_board(kind, category_id, video_id, score)
+
+
+def invalidate(category_ids):
+    """删除榜单缓存，下次读取时重建"""
+    cache.delete_many([board_key(kind, category_id) for kind in (HOT, LATEST) for category_id in category_ids])
+    for kind in (HOT, LATEST):
+        board_changed.send(sender=None, kind=kind, category_ids=list(category_ids))
@@ -0,0 +1,50 @@
+"""弹幕写入吞吐测试
+
+在事务中按不同批次大小批量写入弹幕并测量每秒写入条数，结束时回滚，不保留数据。
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from files.models import Video, Danmaku
+from files.danmaku_ingest import DanmakuIngestor
+
+
+class Command(BaseCommand):
+    help = '测量不同批次大小下弹幕的持续写入速度'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--total', type=int, default=20000, help='每种批次大小写入的条数')
+        parser.add_argument('--batch-sizes', default='1,10,50,200,1000', help='逗号分隔的批次大小')
+
+    def handle(self, *args, **options):
+        video = Video.objects.only('id').first()
+        user = get_user_model().objects.only('id').first()
+        if video is None or user is None:
+            raise CommandError('需要至少一个视频和一个用户')
+
+        total = options['total']
+        for batch_size in [int(size) for size in options['batch_sizes'].split(',')]:
+            ingestor = DanmakuIngestor(batch_size=batch_size)
+            with transaction.atomic():
+                started = time.perf_counter()
+                written = 0
+                while written < total:
+                    count = min(batch_size, total - written)
+                    batch = [
+                        Danmaku(
+                            video_id=video.id,
+                            user_id=user.id,
+                            text=f'benchmark {written + i}',
+                            time=float((written + i) % 7200),
+                            created_at=timezone.now(),
+                        )
+                        for i in range(count)
+                    ]
+                    written += ingestor.write_batch(batch)
+                elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+            self.stdout.write(f'批次 {batch_size:>5}: {written / elapsed:,.0f} 条/秒 ({elapsed:.2f}s)')
@@ -0,0 +1,83 @@
+"""卡片片段缓存性能测试
+
+用未保存的内存视频对象渲染一页卡片，分别测量不使用缓存逐卡片渲染、
+以及通过视频网格组件渲染时缓存未命中、只有卡片命中（网格变化）和整个网格命中时
+每页的耗时。不访问数据库。
+"""
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from files import fragments
+from files.models import Video
+
+# 测试数据使用的ID起点，避免与真实视频的缓存键冲突
+ID_OFFSET = 10 ** 12
+
+
+class Command(BaseCommand):
+    help = '对比视频网格在有无片段缓存时的渲染耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=24, help='每页卡片数')
+        parser.add_argument('--pages', type=int, default=50, help='测量的页数')
+
+    def handle(self, *args, **options):
+        pages = [self.build_page(page, options['cards']) for page in range(options['pages'])]
+        try:
+            uncached = [self.measure(self.render_uncached, videos) for videos in pages]
+            cold = [self.measure(self.render_grid, videos) for videos in pages]
+            warm = [self.measure(self.render_grid, videos) for videos in pages]
+            # 网格缓存未命中、卡片缓存仍然有效：例如同一批视频换了排列顺序
+            cards_only = [self.measure(self.render_grid, list(reversed(videos))) for videos in pages]
+        finally:
+            fragments.invalidate_cards([video.id for videos in pages for video in videos])
+            cache.delete_many([fragments.grid_key(videos, fragments.CARD_TEMPLATE) for videos in pages])
+            cache.delete_many([fragments.grid_key(list(reversed(videos)), fragments.CARD_TEMPLATE)
+                               for videos in pages])
+
+        self.stdout.write(f"每页 {options['cards']} 张卡片，{options['pages']} 页")
+        self.report('逐卡片渲染', uncached)
+        self.report('缓存未命中', cold)
+        self.report('仅卡片命中', cards_only)
+        self.report('网格命中', warm)
+        speedup = statistics.mean(uncached) / max(statistics.mean(warm), 1e-9)
+        self.stdout.write(self.style.SUCCESS(f'网格命中时快 {speedup:.1f} 倍'))
+
+    def build_page(self, page, count):
+        now = timezone.now()
+        return [
+            Video(
+                id=ID_OFFSET + page * count + i,
+                title=f'测试视频 {page}-{i}',
+                thumbnail=f'https://example.com/covers/{page}-{i}.jpg',
+                duration=1800 + i,
+                views=1000 * i,
+                like_count=10 * i,
+                video_type='series' if i % 3 == 0 else 'single',
+                update_status='completed',
+                current_episodes=i + 1,
+                created_at=now,
+                updated_at=now,
+            )
+            for i in range(count)
+        ]
+
+    def render_uncached(self, videos):
+        return ''.join(render_to_string(fragments.CARD_TEMPLATE, {'video': video}) for video in videos)
+
+    def render_grid(self, videos):
+        return render_to_string(fragments.GRID_TEMPLATE, {'videos': videos})
+
+    def measure(self, func, *args):
+        started = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - started
+
+    def report(self, label, times):
+        self.stdout.write(f'{label}: 平均 {statistics.mean(times) * 1000:.2f}ms/页，'
+                          f'中位数 {statistics.median(times) * 1000:.2f}ms/页')
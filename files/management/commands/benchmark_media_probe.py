@@ -0,0 +1,89 @@
+"""媒体元数据读取性能测试
+
+对目录下的 MP4/MOV/TS 文件分别用容器头解析和 ffprobe（如已安装）读取时长与
+分辨率，输出耗时并列出两者结果不一致的文件。
+"""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from files.media_probe import probe_file, ProbeError
+
+EXTENSIONS = ('.mp4', '.m4v', '.mov', '.ts')
+
+
+def ffprobe(binary, path):
+    output = subprocess.run(
+        [binary, '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+         'stream=width,height:format=duration', '-of', 'json', path],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    data = json.loads(output)
+    stream = (data.get('streams') or [{}])[0]
+    duration = float(data.get('format', {}).get('duration') or 0)
+    return int(round(duration)), stream.get('width', 0), stream.get('height', 0)
+
+
+class Command(BaseCommand):
+    help = '测试媒体元数据读取耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='样本文件目录')
+        parser.add_argument('--ffprobe', default=shutil.which('ffprobe'), help='ffprobe 路径，为空时跳过对比')
+
+    def handle(self, *args, **options):
+        paths = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(options['directory'])
+            for name in names if name.lower().endswith(EXTENSIONS)
+        ]
+        if not paths:
+            raise CommandError('目录中没有 MP4/MOV/TS 文件')
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        self.stdout.write(f'{len(paths)} 个文件，共 {total_bytes / 1024 ** 2:.0f}MB')
+
+        results, times, errors = {}, [], 0
+        for path in paths:
+            started = time.perf_counter()
+            try:
+                result = probe_file(path)
+                results[path] = (result.duration, result.width, result.height)
+            except ProbeError as e:
+                errors += 1
+                self.stdout.write(f'解析失败 {path}: {e}')
+            times.append(time.perf_counter() - started)
+        self.report('容器头解析', times)
+        if errors:
+            self.stdout.write(f'失败 {errors} 个')
+
+        if not options['ffprobe']:
+            self.stdout.write('未找到 ffprobe，跳过对比')
+            return
+        ffprobe_times, mismatches = [], 0
+        for path in paths:
+            started = time.perf_counter()
+            try:
+                expected = ffprobe(options['ffprobe'], path)
+            except (subprocess.CalledProcessError, ValueError):
+                continue
+            finally:
+                ffprobe_times.append(time.perf_counter() - started)
+            if path in results and results[path] != expected:
+                mismatches += 1
+                self.stdout.write(f'结果不一致 {path}: {results[path]} != ffprobe {expected}')
+        self.report('ffprobe', ffprobe_times)
+        speedup = statistics.mean(ffprobe_times) / max(statistics.mean(times), 1e-9)
+        self.stdout.write(self.style.SUCCESS(f'平均快 {speedup:.1f} 倍，结果不一致 {mismatches} 个'))
+
+    def report(self, label, times):
+        times = sorted(times)
+        self.stdout.write(
+            f'{label}: 平均 {statistics.mean(times) * 1000:.2f}ms，'
+            f'p95 {times[min(len(times) - 1, int(len(times) * 0.95))] * 1000:.2f}ms，'
+            f'{len(times) / max(sum(times), 1e-9):.0f} 个/秒'
+        )
@@ -0,0 +1,142 @@
+"""搜索性能对比
+
+在临时 SQLite 数据库中生成合成视频库，分别测量 icontains（LIKE '%q%'）查询和
+倒排索引查询的耗时。不会读写项目数据库。
+"""
+from collections import defaultdict
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from files.search_index import tokenize, select_terms, rank, FIELD_WEIGHTS
+
+# 合成数据使用的常用汉字
+CHARS = (
+    '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定'
+    '行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些'
+    '然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公'
+    '无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将'
+    '组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金'
+    '增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类'
+    '八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非'
+    '验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效'
+)
+WORDS = ['love', 'war', 'city', 'night', 'dream', 'star', 'king', 'river', 'storm', 'legend', 'hero', 'ghost']
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice(CHARS) for _ in range(length))
+
+
+class Command(BaseCommand):
+    help = '对比 icontains 与倒排索引的搜索耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--videos', type=int, default=1000000, help='合成视频数量')
+        parser.add_argument('--queries', type=int, default=50, help='查询次数')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = sqlite3.connect(os.path.join(tmpdir, 'bench.sqlite3'))
+            titles, avg_length = self.build_catalog(conn, rng, options['videos'])
+            queries = self.build_queries(rng, titles, options['queries'])
+
+            like_times = [self.time_icontains(conn, query) for query in queries]
+            index_times = [self.time_index(conn, query, options['videos'], avg_length) for query in queries]
+            conn.close()
+
+        self.report('icontains', like_times)
+        self.report('倒排索引', index_times)
+        speedup = statistics.mean(like_times) / max(statistics.mean(index_times), 1e-9)
+        self.stdout.write(self.style.SUCCESS(f'平均加速 {speedup:.1f} 倍'))
+
+    def build_catalog(self, conn, rng, count):
+        """生成合成视频库及其倒排索引"""
+        self.stdout.write(f'生成 {count} 个合成视频...')
+        conn.execute('CREATE TABLE video (id INTEGER PRIMARY KEY, title TEXT, description TEXT, '
+                     'is_active INTEGER, created_at INTEGER)')
+        conn.execute('CREATE TABLE posting (term TEXT, video_id INTEGER, weight REAL, doc_length REAL)')
+        titles = []
+        total_length = 0.0
+        batch_videos, batch_postings = [], []
+        for video_id in range(1, count + 1):
+            title = random_text(rng, rng.randint(2, 8))
+            if rng.random() < 0.2:
+                title = f'{title} {rng.choice(WORDS)}'
+            description = random_text(rng, rng.randint(10, 30))
+            titles.append(title)
+            batch_videos.append((video_id, title, description, 1, video_id))
+
+            weights = defaultdict(float)
+            length = 0.0
+            for field, text in (('title', title), ('description', description)):
+                for token in tokenize(text):
+                    weights[token] += FIELD_WEIGHTS[field]
+                    length += FIELD_WEIGHTS[field]
+            batch_postings.extend((term, video_id, weight, length) for term, weight in weights.items())
+            total_length += length
+
+            if len(batch_videos) >= 10000:
+                self.flush(conn, batch_videos, batch_postings)
+                batch_videos, batch_postings = [], []
+        self.flush(conn, batch_videos, batch_postings)
+
+        conn.execute('CREATE INDEX video_created ON video (created_at)')
+        conn.execute('CREATE INDEX posting_term ON posting (term, video_id)')
+        conn.commit()
+        return titles, total_length / max(count, 1)
+
+    def flush(self, conn, videos, postings):
+        conn.executemany('INSERT INTO video VALUES (?, ?, ?, ?, ?)', videos)
+        conn.executemany('INSERT INTO posting VALUES (?, ?, ?, ?)', postings)
+
+    def build_queries(self, rng, titles, count):
+        """从标题中截取子串作为查询"""
+        queries = []
+        for _ in range(count):
+            title = rng.choice(titles).split(' ')[0]
+            start = rng.randrange(max(1, len(title) - 1))
+            queries.append(title[start:start + rng.randint(2, 4)])
+        return queries
+
+    def time_icontains(self, conn, query):
+        """原有实现：COUNT(*) 加排序后的第一页"""
+        pattern = f'%{query}%'
+        started = time.perf_counter()
+        conn.execute('SELECT COUNT(*) FROM video WHERE is_active = 1 AND (title LIKE ? OR description LIKE ?)',
+                     (pattern, pattern)).fetchone()
+        conn.execute('SELECT id FROM video WHERE is_active = 1 AND (title LIKE ? OR description LIKE ?) '
+                     'ORDER BY created_at DESC LIMIT 20', (pattern, pattern)).fetchall()
+        return time.perf_counter() - started
+
+    def time_index(self, conn, query, doc_count, avg_length):
+        """倒排索引实现：文档频率、倒排记录、BM25 排序"""
+        started = time.perf_counter()
+        terms = list(dict.fromkeys(tokenize(query, unigrams=False)))
+        placeholders = ','.join('?' * len(terms))
+        doc_freqs = dict(conn.execute(
+            f'SELECT term, COUNT(*) FROM posting WHERE term IN ({placeholders}) GROUP BY term', terms
+        ).fetchall())
+        query_terms, term_count = select_terms(terms, doc_freqs, doc_count)
+        if query_terms:
+            placeholders = ','.join('?' * len(query_terms))
+            postings = conn.execute(
+                f'SELECT term, video_id, weight, doc_length FROM posting WHERE term IN ({placeholders})', query_terms
+            ).fetchall()
+            rank(postings, doc_freqs, doc_count, avg_length, term_count=term_count)
+        return time.perf_counter() - started
+
+    def report(self, name, timings):
+        timings = sorted(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f'{name}: 平均 {statistics.mean(timings) * 1000:.2f}ms, '
+            f'中位数 {statistics.median(timings) * 1000:.2f}ms, p95 {p95 * 1000:.2f}ms'
+        )
@@ -0,0 +1,171 @@
+"""视频缓存淘汰策略模拟
+
+按 Zipf 分布生成带热度漂移的合成播放序列，在给定预算下对比 LRU、LFU 与 GDSF
+的命中率和字节命中率。只在内存中模拟，不读写数据库和文件。
+"""
+from collections import OrderedDict
+import heapq
+import random
+
+from django.core.management.base import BaseCommand
+
+from files.video_cache import gdsf_priority
+
+# 各画质的平均文件大小（MB）和请求占比
+QUALITY_PROFILES = {
+    '240p': (60, 0.10),
+    '480p': (150, 0.35),
+    '720p': (350, 0.40),
+    '1080p': (800, 0.15),
+}
+
+
+class Policy:
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.evictions = 0
+
+    def request(self, key, size, quality):
+        """返回是否命中，未命中时放入缓存"""
+        if self.touch(key, quality):
+            return True
+        if size <= self.budget:
+            while self.used + size > self.budget:
+                self.used -= self.evict()
+                self.evictions += 1
+            self.insert(key, size, quality)
+            self.used += size
+        return False
+
+
+class LRUPolicy(Policy):
+    name = 'LRU'
+
+    def __init__(self, budget):
+        super().__init__(budget)
+        self.entries = OrderedDict()
+
+    def touch(self, key, quality):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return True
+        return False
+
+    def insert(self, key, size, quality):
+        self.entries[key] = size
+
+    def evict(self):
+        return self.entries.popitem(last=False)[1]
+
+
+class GreedyDualPolicy(Policy):
+    """按优先级淘汰，堆中过期的条目延迟删除"""
+
+    def __init__(self, budget):
+        super().__init__(budget)
+        self.entries = {}
+        self.heap = []
+        self.inflation = 0
+
+    def priority(self, hits, size, quality):
+        raise NotImplementedError
+
+    def push(self, key, hits, size, quality):
+        priority = self.priority(hits, size, quality)
+        self.entries[key] = (priority, hits, size)
+        heapq.heappush(self.heap, (priority, key))
+
+    def touch(self, key, quality):
+        if key not in self.entries:
+            return False
+        _, hits, size = self.entries[key]
+        self.push(key, hits + 1, size, quality)
+        return True
+
+    def insert(self, key, size, quality):
+        self.push(key, 1, size, quality)
+
+    def evict(self):
+        while True:
+            priority, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == priority:
+                del self.entries[key]
+                self.inflation = priority
+                return entry[2]
+
+
+class LFUPolicy(GreedyDualPolicy):
+    name = 'LFU'
+
+    def priority(self, hits, size, quality):
+        return hits
+
+
+class GDSFPolicy(GreedyDualPolicy):
+    name = 'GDSF'
+
+    def priority(self, hits, size, quality):
+        return gdsf_priority(self.inflation, hits, size, quality)
+
+
+class Command(BaseCommand):
+    help = '用合成播放序列对比视频缓存淘汰策略'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--videos', type=int, default=20000, help='视频数量')
+        parser.add_argument('--requests', type=int, default=500000, help='播放请求数')
+        parser.add_argument('--budget-ratio', type=float, default=0.05, help='缓存预算占全部文件大小的比例')
+        parser.add_argument('--zipf', type=float, default=0.9, help='热度分布的 Zipf 参数')
+        parser.add_argument('--drift', type=int, default=50000, help='每隔多少次请求打乱一部分热门视频')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        trace, sizes = self.build_trace(rng, options)
+        total_bytes = sum(sizes.values())
+        budget = int(total_bytes * options['budget_ratio'])
+        self.stdout.write(
+            f'{len(trace)} 次请求，{len(sizes)} 个文件共 {total_bytes / 1024 ** 4:.2f}TB，'
+            f'预算 {budget / 1024 ** 3:.0f}GB'
+        )
+
+        for policy_class in (LRUPolicy, LFUPolicy, GDSFPolicy):
+            policy = policy_class(budget)
+            hits = hit_bytes = requested_bytes = 0
+            for key in trace:
+                size = sizes[key]
+                requested_bytes += size
+                if policy.request(key, size, key[1]):
+                    hits += 1
+                    hit_bytes += size
+            self.stdout.write(
+                f'{policy.name:<5} 命中率 {hits / len(trace):.1%}  字节命中率 {hit_bytes / requested_bytes:.1%}  '
+                f'淘汰 {policy.evictions}'
+            )
+
+    def build_trace(self, rng, options):
+        videos = options['videos']
+        weights = [1 / (rank + 1) ** options['zipf'] for rank in range(videos)]
+        ranking = list(range(videos))
+        qualities = list(QUALITY_PROFILES)
+        quality_weights = [share for _, share in QUALITY_PROFILES.values()]
+
+        sizes = {}
+        for video in range(videos):
+            scale = rng.uniform(0.3, 2.0)  # 时长差异
+            for quality, (size_mb, _) in QUALITY_PROFILES.items():
+                sizes[(video, quality)] = int(size_mb * scale * 1024 * 1024)
+
+        trace = []
+        while len(trace) < options['requests']:
+            count = min(options['drift'], options['requests'] - len(trace))
+            picks = rng.choices(ranking, weights=weights, k=count)
+            picked_qualities = rng.choices(qualities, weights=quality_weights, k=count)
+            trace.extend(zip(picks, picked_qualities))
+            # 热度漂移：前1%的热门位置与随机视频交换
+            for rank in range(max(videos // 100, 1)):
+                other = rng.randrange(videos)
+                ranking[rank], ranking[other] = ranking[other], ranking[rank]
+        return trace, sizes
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from files import recommendations
+
+
+class Command(BaseCommand):
+    help = '计算相关视频推荐'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true', help='只计算还没有推荐的新视频')
+        parser.add_argument('--top-k', type=int, help='每个视频保留的相关视频数')
+        parser.add_argument('--block-nnz', type=int, help='每块相似度乘积的非零元上限')
+
+    def handle(self, *args, **options):
+        build = recommendations.refresh if options['incremental'] else recommendations.build
+        try:
+            total = build(top_k=options['top_k'], block_nnz=options['block_nnz'], stdout=self.stdout)
+        except recommendations.RecommendationError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'相关视频计算完成，共 {total} 个视频'))
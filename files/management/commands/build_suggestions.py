@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from files import suggestions
+
+
+class Command(BaseCommand):
+    help = '从数据库重建搜索建议索引并写入快照，各进程发现快照更新后重新加载'
+
+    def handle(self, *args, **options):
+        index = suggestions.build()
+        self.stdout.write(self.style.SUCCESS(
+            f'搜索建议索引重建完成，{len(index.items)} 个条目，{len(index.keys)} 个检索键，'
+            f'快照: {suggestions.snapshot_path()}'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from files.uploads import cleanup_expired
+
+
+class Command(BaseCommand):
+    help = '清理超时未完成的分块上传及其临时文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='超过多少小时未更新视为超时')
+
+    def handle(self, *args, **options):
+        count = cleanup_expired(max_age_hours=options['hours'])
+        self.stdout.write(self.style.SUCCESS(f'已清理 {count} 个上传会话'))
@@ -0,0 +1,18 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+
+from files.cast_enrichment import ROLE_MODELS, retry_placeholders
+
+
+class Command(BaseCommand):
+    help = '为简介仍是占位内容的演员、导演重新生成简介'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--role', choices=list(ROLE_MODELS), help='只处理演员或导演')
+
+    def handle(self, *args, **options):
+        futures = retry_placeholders([options['role']] if options['role'] else None)
+        wait(futures)
+        succeeded = sum(1 for future in futures if future.result() is not None)
+        self.stdout.write(self.style.SUCCESS(f'重新生成 {len(futures)} 个人物的简介，成功 {succeeded} 个'))
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from files import image_derivatives
+from files.models import Video, ImageResource
+
+
+class Command(BaseCommand):
+    help = '为已有的视频封面和图片资源批量生成衍生图片'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='并发生成数')
+        parser.add_argument('--preset', choices=list(image_derivatives.PRESETS), help='只生成指定用途')
+        parser.add_argument('--batch-size', type=int, default=200, help='每批处理的记录数')
+
+    def handle(self, *args, **options):
+        querysets = [
+            Video.objects.filter(is_active=True).exclude(thumbnail__isnull=True).exclude(thumbnail=''),
+            ImageResource.objects.filter(status='active'),
+        ]
+        self.generated = self.failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for queryset in querysets:
+                batch = []
+                for obj in queryset.order_by('id').iterator(chunk_size=options['batch_size']):
+                    batch.append(obj)
+                    if len(batch) >= options['batch_size']:
+                        self.process(executor, batch, options['preset'])
+                        batch = []
+                self.process(executor, batch, options['preset'])
+
+        removed, freed = image_derivatives.prune()
+        self.stdout.write(self.style.SUCCESS(
+            f'生成 {self.generated} 组，失败 {self.failed} 组；淘汰 {removed} 个文件，释放 {freed / 1024 ** 2:.0f}MB'
+        ))
+
+    def process(self, executor, batch, only_preset):
+        tasks = []
+        for obj in batch:
+            source = image_derivatives.get_source(obj)
+            if not source:
+                continue
+            for preset in image_derivatives.presets_for(obj):
+                if only_preset is None or preset == only_preset:
+                    tasks.append((source, preset))
+        for ok in executor.map(lambda task: self.generate(*task), tasks):
+            if ok:
+                self.generated += 1
+            else:
+                self.failed += 1
+
+    def generate(self, source, preset):
+        try:
+            image_derivatives.ensure_derivatives(source, preset)
+            return True
+        except (image_derivatives.DerivativeError, OSError) as e:
+            self.stderr.write(f'{source} ({preset}): {e}')
+            return False
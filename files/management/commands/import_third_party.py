@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from files import importer
+from files.models import ThirdPartySource
+
+
+class Command(BaseCommand):
+    help = '从第三方来源批量导入视频和剧集，中断后再次执行从检查点继续'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='来源ID或名称')
+        parser.add_argument('--concurrency', type=int, help='同时进行的请求数')
+        parser.add_argument('--batch-size', type=int, help='每批写入的条目数')
+        parser.add_argument('--hours', type=int, help='只导入最近若干小时更新的条目（苹果CMS的 h 参数）')
+        parser.add_argument('--max-pages', type=int, help='本次最多导入的页数')
+        parser.add_argument('--restart', action='store_true', help='忽略检查点，从第一页开始')
+
+    def handle(self, *args, **options):
+        lookup = {'pk': options['source']} if options['source'].isdigit() else {'name': options['source']}
+        try:
+            source = ThirdPartySource.objects.get(**lookup)
+        except ThirdPartySource.DoesNotExist:
+            raise CommandError(f'来源不存在: {options["source"]}')
+
+        try:
+            videos, media, failed_pages = importer.import_source(
+                source,
+                concurrency=options['concurrency'],
+                batch_size=options['batch_size'],
+                extra_params={'h': options['hours']} if options['hours'] else None,
+                max_pages=options['max_pages'],
+                restart=options['restart'],
+                stdout=self.stdout,
+            )
+        except importer.SourceError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f'导入完成，写入 {videos} 个视频，{media} 个媒体'))
+        if failed_pages:
+            self.stdout.write(self.style.WARNING(
+                f'{len(failed_pages)} 页导入失败（{", ".join(map(str, failed_pages[:20]))}），再次执行将从检查点继续'
+            ))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from files import media_probe
+
+
+class Command(BaseCommand):
+    help = '读取未处理媒体文件的时长、分辨率和大小'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=media_probe.DEFAULT_BATCH_SIZE, help='每批处理的记录数')
+        parser.add_argument('--workers', type=int, default=None, help='解析进程数，默认等于CPU核数')
+        parser.add_argument('--limit', type=int, default=None, help='最多处理的记录数')
+        parser.add_argument('--follow', action='store_true', help='处理完后继续轮询新上传的文件')
+        parser.add_argument('--interval', type=int, default=30, help='轮询间隔（秒）')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            succeeded, failed = media_probe.probe_pending(
+                batch_size=options['batch_size'], workers=options['workers'], limit=options['limit']
+            )
+            if succeeded or failed or not options['follow']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'成功 {succeeded}，失败 {failed}，耗时 {time.monotonic() - started:.1f}s'
+                ))
+            if not options['follow']:
+                break
+            time.sleep(options['interval'])
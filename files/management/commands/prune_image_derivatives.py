@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from files import image_derivatives
+
+
+class Command(BaseCommand):
+    help = '衍生图片缓存超过预算时删除最久未访问的文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-bytes', type=int, default=None, help='缓存预算（字节），默认读取配置')
+
+    def handle(self, *args, **options):
+        removed, freed = image_derivatives.prune(options['max_bytes'])
+        self.stdout.write(self.style.SUCCESS(f'删除 {removed} 个文件，释放 {freed / 1024 ** 2:.0f}MB'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from files import page_cache
+
+
+class Command(BaseCommand):
+    help = '使匿名整页缓存过期'
+
+    def add_arguments(self, parser):
+        parser.add_argument('namespaces', nargs='*', default=['index', 'channel'], help='页面命名空间')
+
+    def handle(self, *args, **options):
+        page_cache.purge(*options['namespaces'])
+        self.stdout.write(self.style.SUCCESS(f"已标记过期: {', '.join(options['namespaces'])}"))
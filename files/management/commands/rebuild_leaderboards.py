@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.core.cache import cache
+
+from files.category_tree import get_category_tree
+from files import leaderboards
+
+
+class Command(BaseCommand):
+    help = '从数据库重建全站和各分类的热门、最新排行榜'
+
+    def handle(self, *args, **options):
+        category_ids = [None] + list(get_category_tree().nodes)
+        for category_id in category_ids:
+            for kind in (leaderboards.HOT, leaderboards.LATEST):
+                board = leaderboards.build_board(kind, category_id)
+                cache.set(leaderboards.board_key(kind, category_id), board, leaderboards.CACHE_TIMEOUT)
+        self.stdout.write(self.style.SUCCESS(f'已重建 {len(category_ids)} 个范围的排行榜'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from files.search_index import rebuild_index
+
+
+class Command(BaseCommand):
+    help = '全量重建视频搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的视频数')
+
+    def handle(self, *args, **options):
+        total = rebuild_index(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'搜索索引重建完成，共 {total} 个视频'))
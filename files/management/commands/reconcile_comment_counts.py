@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from files.comment_counts import reconcile_comment_counts
+
+
+class Command(BaseCommand):
+    help = '按实际评论数批量校正 Video.comment_count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批处理的视频数')
+
+    def handle(self, *args, **options):
+        checked, fixed = reconcile_comment_counts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'检查 {checked} 个视频，修正 {fixed} 个'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from files.encoding import EncodingScheduler
+
+
+class Command(BaseCommand):
+    help = '运行视频编码调度进程'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='工作进程数，默认等于CPU核数')
+        parser.add_argument('--once', action='store_true', help='处理完当前队列后退出')
+
+    def handle(self, *args, **options):
+        scheduler = EncodingScheduler(workers=options['workers'])
+        self.stdout.write(f'编码调度启动，工作进程数 {scheduler.workers}')
+        try:
+            scheduler.run(once=options['once'])
+        except KeyboardInterrupt:
+            pass
+        stats = scheduler.get_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"完成 {stats['completed']}，失败 {stats['failed']}，重试 {stats['retried']}，"
+            f"每核每小时 {stats['jobs_per_core_hour']:.1f} 个，平均排队 {stats['avg_queue_latency']:.1f}s"
+        ))
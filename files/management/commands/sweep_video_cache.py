@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from files import video_cache
+
+
+class Command(BaseCommand):
+    help = '按预算增量淘汰视频缓存并抽查缓存文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=video_cache.SWEEP_BATCH, help='每轮最多淘汰的条数')
+        parser.add_argument('--rounds', type=int, default=1, help='最多执行的轮数')
+
+    def handle(self, *args, **options):
+        evicted = 0
+        for _ in range(options['rounds']):
+            count = video_cache.sweep(options['batch'])
+            evicted += count
+            if count < options['batch']:
+                break
+        checked = video_cache.verify()
+
+        metrics = video_cache.get_metrics()
+        self.stdout.write(self.style.SUCCESS(
+            f"淘汰 {evicted} 条，抽查 {checked} 条；累计命中率 {metrics['hit_ratio']:.1%}，"
+            f"淘汰 {metrics['evictions']} 条/{metrics['evicted_bytes'] / 1024 ** 3:.1f}GB，"
+            f"当前用量 {metrics['usage']['total'] / 1024 ** 3:.1f}GB"
+        ))
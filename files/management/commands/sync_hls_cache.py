@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from files import hls_cache
+
+
+class Command(BaseCommand):
+    help = '刷新即将过期的剧集缓存，缓存热门剧集并按磁盘预算淘汰'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None, help='分片并发下载数')
+
+    def handle(self, *args, **options):
+        stats = hls_cache.sync(concurrency=options['concurrency'])
+        self.stdout.write(self.style.SUCCESS(
+            f"刷新 {stats['refreshed']}，新缓存 {stats['downloaded']}，未准入 {stats['skipped']}，"
+            f"失败 {stats['failed']}，淘汰 {stats['evicted']}"
+        ))
@@ -0,0 +1,426 @@
+"""媒体文件元数据读取
+
+直接解析容器头部获取时长和分辨率，不调用 ffprobe，也不把整个文件读入内存：
+文件通过 mmap 映射，只访问需要的字节。
+
+- MP4/MOV：遍历 box 结构，读取 moov 中的 mvhd（时长）和视频轨道的 tkhd（宽高），
+  mdat 只跳过不读取，moov 在文件末尾时也只访问其所在区域
+- MPEG-TS：只扫描文件开头和结尾各一段，用首尾视频 PTS 计算时长，从 H.264 SPS
+  解析宽高
+- 图片：读取 PNG、GIF、JPEG 头部的宽高
+
+未读取过的 VideoMedia（probed_at 为空，包括历史数据）按批交给进程池并行解析，
+结果用 bulk_update 写回，同时补全视频的 Video.duration。
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import mmap
+import os
+import struct
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Video, VideoMedia
+
+logger = logging.getLogger(__name__)
+
+# MPEG-TS 首尾扫描的字节数
+TS_SCAN_BYTES = 2 * 1024 * 1024
+TS_PACKET_SIZE = 188
+PTS_CLOCK = 90000
+# 查找 SPS 时最多拼接的视频负载字节数
+SPS_SEARCH_BYTES = 256 * 1024
+
+DEFAULT_BATCH_SIZE = 200
+
+# 按高度选择清晰度
+QUALITY_BY_HEIGHT = [
+    (1080, '1080p'),
+    (720, '720p'),
+    (480, '480p'),
+    (0, '240p'),
+]
+
+ProbeResult = namedtuple('ProbeResult', ['format', 'duration', 'width', 'height', 'file_size'])
+
+
+class ProbeError(Exception):
+    """无法识别或解析的媒体文件"""
+
+
+# MP4 / MOV
+
+def iter_boxes(buf, start, end):
+    """遍历 [start, end) 范围内的 box，产出 (类型, 内容起点, 内容终点)"""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from('>Q', buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def find_box(buf, start, end, kind):
+    for box_kind, body, box_end in iter_boxes(buf, start, end):
+        if box_kind == kind:
+            return body, box_end
+    return None
+
+
+def parse_mp4(buf):
+    moov = find_box(buf, 0, len(buf), b'moov')
+    if moov is None:
+        raise ProbeError('缺少 moov')
+
+    duration = 0
+    mvhd = find_box(buf, *moov, b'mvhd')
+    if mvhd is not None:
+        body = mvhd[0]
+        if buf[body] == 1:
+            timescale, length = struct.unpack_from('>IQ', buf, body + 20)
+        else:
+            timescale, length = struct.unpack_from('>II', buf, body + 12)
+        if timescale and length not in (0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+            duration = length / timescale
+        if not duration:
+            # 分片 MP4 的总时长在 mvex/mehd 中
+            mvex = find_box(buf, *moov, b'mvex')
+            mehd = mvex and find_box(buf, *mvex, b'mehd')
+            if mehd and timescale:
+                body = mehd[0]
+                fmt = '>Q' if buf[body] == 1 else '>I'
+                duration = struct.unpack_from(fmt, buf, body + 4)[0] / timescale
+
+    width = height = 0
+    for kind, body, end in iter_boxes(buf, *moov):
+        if kind != b'trak':
+            continue
+        mdia = find_box(buf, body, end, b'mdia')
+        hdlr = mdia and find_box(buf, *mdia, b'hdlr')
+        if not hdlr or buf[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+            continue
+        tkhd = find_box(buf, body, end, b'tkhd')
+        if tkhd is not None:
+            offset = tkhd[0] + (88 if buf[tkhd[0]] == 1 else 76)
+            width, height = (value >> 16 for value in struct.unpack_from('>II', buf, offset))
+            break
+    return 'mp4', duration, width, height
+
+
+# MPEG-TS
+
+def ts_sync_offset(buf, start=0):
+    for offset in range(start, min(start + TS_PACKET_SIZE, len(buf) - TS_PACKET_SIZE)):
+        if buf[offset] == 0x47 and buf[offset + TS_PACKET_SIZE] == 0x47:
+            return offset
+    return None
+
+
+def iter_ts_payloads(buf, start, end):
+    """产出 (PID, 是否为PES起始, 负载起点, 负载终点)"""
+    offset = ts_sync_offset(buf, start)
+    if offset is None:
+        return
+    for pos in range(offset, end - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        if buf[pos] != 0x47:
+            continue
+        pid = ((buf[pos + 1] & 0x1F) << 8) | buf[pos + 2]
+        unit_start = bool(buf[pos + 1] & 0x40)
+        control = (buf[pos + 3] >> 4) & 0x3
+        payload = pos + 4
+        if control & 0x2:
+            payload += 1 + buf[pos + 4]
+        if control & 0x1 and payload < pos + TS_PACKET_SIZE:
+            yield pid, unit_start, payload, pos + TS_PACKET_SIZE
+
+
+def pes_video_pts(buf, payload):
+    """视频 PES 头中的 PTS，不是视频 PES 或没有 PTS 时返回None"""
+    if buf[payload:payload + 3] != b'\x00\x00\x01' or not 0xE0 <= buf[payload + 3] <= 0xEF:
+        return None
+    if not buf[payload + 7] & 0x80:
+        return None
+    p = buf[payload + 9:payload + 14]
+    return (((p[0] >> 1) & 0x07) << 30) | (p[1] << 22) | ((p[2] >> 1) << 15) | (p[3] << 7) | (p[4] >> 1)
+
+
+def parse_ts(buf):
+    size = len(buf)
+    head_end = min(size, TS_SCAN_BYTES)
+    video_pid = first_pts = None
+    es = bytearray()
+    for pid, unit_start, start, end in iter_ts_payloads(buf, 0, head_end):
+        if video_pid is None:
+            if not unit_start:
+                continue
+            pts = pes_video_pts(buf, start)
+            if pts is None:
+                continue
+            video_pid, first_pts = pid, pts
+        if pid == video_pid and len(es) < SPS_SEARCH_BYTES:
+            es += buf[start:end]
+    if video_pid is None:
+        raise ProbeError('未找到视频流')
+
+    last_pts = first_pts
+    for pid, unit_start, start, end in iter_ts_payloads(buf, max(0, size - TS_SCAN_BYTES), size):
+        if pid == video_pid and unit_start:
+            pts = pes_video_pts(buf, start)
+            if pts is not None:
+                last_pts = pts
+    if last_pts < first_pts:
+        last_pts += 1 << 33  # PTS 回绕
+    width, height = find_h264_dimensions(bytes(es))
+    return 'ts', (last_pts - first_pts) / PTS_CLOCK, width, height
+
+
+class BitReader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def bit(self):
+        byte = self.data[self.pos >> 3]
+        value = (byte >> (7 - (self.pos & 7))) & 1
+        self.pos += 1
+        return value
+
+    def bits(self, count):
+        value = 0
+        for _ in range(count):
+            value = (value << 1) | self.bit()
+        return value
+
+    def ue(self):
+        zeros = 0
+        while not self.bit():
+            zeros += 1
+            if zeros > 31:
+                raise ProbeError('SPS 数据无效')
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def find_h264_dimensions(es):
+    """在 H.264 基本流中查找 SPS 并解析宽高，找不到时返回 (0, 0)"""
+    pos = es.find(b'\x00\x00\x01')
+    while pos != -1 and pos + 4 < len(es):
+        if es[pos + 3] & 0x1F == 7:
+            end = es.find(b'\x00\x00\x01', pos + 4)
+            nal = es[pos + 4:end if end != -1 else len(es)]
+            try:
+                return parse_sps(nal.replace(b'\x00\x00\x03', b'\x00\x00'))
+            except (IndexError, ProbeError):
+                return 0, 0
+        pos = es.find(b'\x00\x00\x01', pos + 3)
+    return 0, 0
+
+
+def parse_sps(rbsp):
+    reader = BitReader(rbsp)
+    profile_idc = reader.bits(8)
+    reader.bits(16)  # constraint flags, level_idc
+    reader.ue()  # seq_parameter_set_id
+    chroma_format_idc = 1
+    if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format_idc = reader.ue()
+        if chroma_format_idc == 3:
+            reader.bit()  # separate_colour_plane_flag
+        reader.ue()  # bit_depth_luma_minus8
+        reader.ue()  # bit_depth_chroma_minus8
+        reader.bit()  # qpprime_y_zero_transform_bypass_flag
+        if reader.bit():  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if reader.bit():
+                    skip_scaling_list(reader, 16 if i < 6 else 64)
+    reader.ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.ue()
+    if pic_order_cnt_type == 0:
+        reader.ue()
+    elif pic_order_cnt_type == 1:
+        reader.bit()
+        reader.se()
+        reader.se()
+        for _ in range(reader.ue()):
+            reader.se()
+    reader.ue()  # max_num_ref_frames
+    reader.bit()  # gaps_in_frame_num_value_allowed_flag
+    width_mbs = reader.ue() + 1
+    height_map_units = reader.ue() + 1
+    frame_mbs_only = reader.bit()
+    if not frame_mbs_only:
+        reader.bit()  # mb_adaptive_frame_field_flag
+    reader.bit()  # direct_8x8_inference_flag
+    crop_left = crop_right = crop_top = crop_bottom = 0
+    if reader.bit():
+        crop_left, crop_right, crop_top, crop_bottom = reader.ue(), reader.ue(), reader.ue(), reader.ue()
+
+    crop_unit_x = 2 if chroma_format_idc in (1, 2) else 1
+    crop_unit_y = (2 - frame_mbs_only) * (2 if chroma_format_idc == 1 else 1)
+    width = width_mbs * 16 - (crop_left + crop_right) * crop_unit_x
+    height = (2 - frame_mbs_only) * height_map_units * 16 - (crop_top + crop_bottom) * crop_unit_y
+    return width, height
+
+
+def skip_scaling_list(reader, size):
+    last = next_scale = 8
+    for _ in range(size):
+        if next_scale:
+            next_scale = (last + reader.se() + 256) % 256
+        last = next_scale or last
+
+
+# 图片
+
+def parse_png(buf):
+    width, height = struct.unpack_from('>II', buf, 16)
+    return 'png', 0, width, height
+
+
+def parse_gif(buf):
+    width, height = struct.unpack_from('<HH', buf, 6)
+    return 'gif', 0, width, height
+
+
+def parse_jpeg(buf):
+    pos = 2
+    while pos + 9 < len(buf):
+        if buf[pos] != 0xFF:
+            raise ProbeError('JPEG 结构无效')
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length = struct.unpack_from('>H', buf, pos + 2)[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from('>HH', buf, pos + 5)
+            return 'jpeg', 0, width, height
+        pos += 2 + length
+    raise ProbeError('未找到 JPEG 帧头')
+
+
+def detect_parser(buf):
+    if buf[4:8] == b'ftyp' or buf[4:8] in (b'moov', b'mdat', b'free', b'wide', b'skip'):
+        return parse_mp4
+    if buf[0] == 0x47 and len(buf) > TS_PACKET_SIZE and buf[TS_PACKET_SIZE] == 0x47:
+        return parse_ts
+    if buf[:8] == b'\x89PNG\r\n\x1a\n':
+        return parse_png
+    if buf[:4] == b'GIF8':
+        return parse_gif
+    if buf[:3] == b'\xff\xd8\xff':
+        return parse_jpeg
+    return None
+
+
+def probe_file(path):
+    """读取媒体文件的格式、时长（秒）、宽高和大小"""
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size < 16:
+            raise ProbeError('文件过小')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            parser = detect_parser(buf)
+            if parser is None:
+                raise ProbeError('不支持的文件格式')
+            try:
+                fmt, duration, width, height = parser(buf)
+            except (IndexError, struct.error) as e:
+                raise ProbeError(f'文件结构不完整: {e}')
+    return ProbeResult(fmt, int(round(duration)), width, height, file_size)
+
+
+def probe_path(path):
+    """进程池任务：返回 (结果, 错误信息)"""
+    try:
+        return probe_file(path), None
+    except (OSError, ValueError, ProbeError) as e:
+        return None, str(e)
+
+
+def quality_for_height(height):
+    for min_height, quality in QUALITY_BY_HEIGHT:
+        if height >= min_height:
+            return quality
+    return QUALITY_BY_HEIGHT[-1][1]
+
+
+def media_path(media):
+    try:
+        return media.file_path.path
+    except (ValueError, NotImplementedError):
+        return None
+
+
+def pending_media():
+    """尚未读取元数据的媒体文件，包括新上传和历史数据"""
+    return VideoMedia.objects.filter(probed_at__isnull=True).order_by('id')
+
+
+def apply_results(batch, results):
+    """把一批解析结果写回 VideoMedia，并补全所属视频的时长"""
+    now = timezone.now()
+    for media, (result, error) in zip(batch, results):
+        media.probed_at = now
+        if result is None:
+            media.extra_info = {**(media.extra_info or {}), 'probe_error': error}
+            continue
+        media.file_size = result.file_size
+        media.duration = result.duration
+        media.width, media.height = result.width, result.height
+        if result.height:
+            media.quality = quality_for_height(result.height)
+        media.extra_info = {**(media.extra_info or {}), 'container': result.format}
+        media.extra_info.pop('probe_error', None)
+
+    with transaction.atomic():
+        VideoMedia.objects.bulk_update(
+            batch, ['file_size', 'duration', 'width', 'height', 'quality', 'extra_info', 'probed_at']
+        )
+        durations = {media.id: media.duration for media in batch if media.duration}
+        if not durations:
+            return
+        video_durations = {}
+        for video_id, media_id in Video.media_files.through.objects.filter(
+                videomedia_id__in=durations).values_list('video_id', 'videomedia_id'):
+            video_durations[video_id] = max(video_durations.get(video_id, 0), durations[media_id])
+        videos = list(Video.objects.filter(id__in=video_durations, duration=0))
+        for video in videos:
+            video.duration = video_durations[video.id]
+        Video.objects.bulk_update(videos, ['duration'])
+
+
+def probe_pending(batch_size=DEFAULT_BATCH_SIZE, workers=None, limit=None):
+    """按批并行读取待处理媒体文件的元数据，返回 (成功数, 失败数)"""
+    succeeded = failed = 0
+    last_id = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        while limit is None or succeeded + failed < limit:
+            size = batch_size if limit is None else min(batch_size, limit - succeeded - failed)
+            batch = list(pending_media().filter(id__gt=last_id)[:size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            paths = [media_path(media) for media in batch]
+            futures = {i: pool.submit(probe_path, path) for i, path in enumerate(paths) if path}
+            results = [futures[i].result() if i in futures else (None, '没有本地文件')
+                       for i in range(len(batch))]
+            apply_results(batch, results)
+            batch_failed = sum(1 for result, _ in results if result is None)
+            succeeded += len(batch) - batch_failed
+            failed += batch_failed
+    return succeeded, failed
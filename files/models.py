@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Prefetch
+from django.urls import reverse
 from django.utils import timezone
 from django.conf import settings
 from users.models import UserGroup
+from datetime import timedelta
 import os
 import logging
 
@@ -25,6 +28,9 @@ QUALITY_LEVELS = [
     ('1080p', '超清')
 ]
 
+# 第三方m3u8链接的有效期（小时）
+M3U8_TTL_HOURS = 48
+
 logger = logging.getLogger(__name__)
 
 
@@ -133,6 +139,7 @@ class VideoMedia(models.Model):
     source_name = models.CharField(max_length=50, blank=True, null=True, verbose_name='来源名称')
     source_index = models.IntegerField(default=0, verbose_name='来源索引')
     extra_info = models.JSONField(default=dict, blank=True, verbose_name='额外信息')
+    probed_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name='元数据读取时间')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
@@ -150,6 +157,30 @@ class VideoMedia(models.Model):
     def __str__(self):
         return f"{self.file_path}"
 
+# 视频卡片和列表渲染用到的字段，不加载描述、额外信息等大字段
+CARD_FIELDS = (
+    'id', 'title', 'video_type', 'thumbnail', 'duration', 'views', 'play_count', 'like_count',
+    'comment_count', 'year', 'area', 'total_episodes', 'current_episodes', 'update_status',
+    'is_active', 'created_at', 'updated_at',
+)
+
+
+class VideoQuerySet(models.QuerySet):
+    def cards(self):
+        """卡片查询：只取卡片字段，标签、分类和主图按页批量预取，查询数与卡片数无关"""
+        return self.only(*CARD_FIELDS).prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.only('id', 'name', 'slug')),
+            Prefetch('categories', queryset=Category.objects.only('id', 'name', 'slug', 'parent_id')),
+            Prefetch(
+                'images',
+                queryset=ImageResource.objects.filter(is_main=True, status='active').only(
+                    'id', 'video_id', 'image_type', 'url', 'cdn_url', 'local_path', 'width', 'height'
+                ),
+                to_attr='main_images',
+            ),
+        )
+
+
 class Video(models.Model):
     """视频"""
     title = models.CharField('标题', max_length=200)
@@ -181,17 +212,40 @@ class Video(models.Model):
     created_at = models.DateTimeField('创建时间', default=timezone.now)
     updated_at = models.DateTimeField('更新时间', auto_now=True)
 
-    objects = models.Manager()
+    objects = VideoQuerySet.as_manager()
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name='创建者', on_delete=models.CASCADE, default=1)
 
     class Meta:
         verbose_name = '视频'
         verbose_name_plural = '视频管理'
         ordering = ['-created_at']
+        constraints = [
+            # 导入时按第三方ID批量更新（格式为 <来源ID>:<来源中的ID>），空值不受限制
+            models.UniqueConstraint(fields=['third_party_id'], name='unique_video_third_party_id'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def get_absolute_url(self):
+        return reverse('files:video_detail', args=[self.id])
+
+    @property
+    def is_series(self):
+        return self.video_type == 'series'
+
+    @property
+    def current_episode(self):
+        return self.current_episodes
+
+    @property
+    def main_image(self):
+        """主图，卡片查询中已预取"""
+        images = getattr(self, 'main_images', None)
+        if images is None:
+            images = list(self.images.filter(is_main=True, status='active')[:1])
+        return images[0] if images else None
+
 
 
 class VideoCategory(models.Model):
@@ -231,6 +285,17 @@ class SeriesVideo(models.Model):
         ('completed', '已完结')
     ])
     next_update = models.DateTimeField('下次更新时间', null=True, blank=True)
+    m3u8_url = models.URLField('m3u8地址', max_length=1000, blank=True)
+    token = models.CharField('访问令牌', max_length=255, blank=True)
+    token_expires_at = models.DateTimeField('令牌过期时间', null=True, blank=True)
+    updated_at = models.DateTimeField('m3u8更新时间', default=timezone.now)
+    play_count = models.IntegerField('播放次数', default=0)
+    last_played_at = models.DateTimeField('最后播放时间', null=True, blank=True)
+    download_threshold = models.IntegerField('本地缓存阈值', default=100)
+    is_downloaded = models.BooleanField('已缓存到本地', default=False)
+    local_path = models.CharField('本地路径', max_length=255, blank=True)
+    cache_size = models.BigIntegerField('本地缓存大小', default=0)
+    cached_at = models.DateTimeField('本地缓存时间', null=True, blank=True)
 
     class Meta:
         verbose_name = '剧集视频'
@@ -250,8 +315,11 @@ class SeriesVideo(models.Model):
         """检查m3u8链接是否过期"""
         if not self.m3u8_url:
             return True
-        # m3u8链接48小时过期
-        return (timezone.now() - self.updated_at).total_seconds() > 48 * 3600
+        return timezone.now() > self.m3u8_expires_at()
+
+    def m3u8_expires_at(self):
+        """m3u8链接48小时过期"""
+        return self.updated_at + timedelta(hours=M3U8_TTL_HOURS)
 
     def should_download(self):
         """检查是否应该下载到本地"""
@@ -304,6 +372,8 @@ class Encoding(models.Model):
     progress = models.IntegerField('进度', default=0)
     output_url = models.URLField('输出URL', blank=True)
     error_message = models.TextField('错误信息', blank=True)
+    attempts = models.IntegerField('尝试次数', default=0)
+    next_retry_at = models.DateTimeField('下次重试时间', null=True, blank=True)
     created_at = models.DateTimeField('创建时间', default=timezone.now)
     started_at = models.DateTimeField('开始时间', null=True, blank=True)
     completed_at = models.DateTimeField('完成时间', null=True, blank=True)
@@ -338,6 +408,9 @@ class VideoCache(models.Model):
     quality = models.CharField('画质', max_length=20)
     file_path = models.CharField('文件路径', max_length=255)
     file_size = models.BigIntegerField('文件大小', default=0)
+    hit_count = models.IntegerField('命中次数', default=0)
+    priority = models.FloatField('保留优先级', default=0, db_index=True)
+    last_accessed_at = models.DateTimeField('最后访问时间', null=True, blank=True)
     created_at = models.DateTimeField('创建时间', default=timezone.now)
     
     class Meta:
@@ -345,15 +418,20 @@ class VideoCache(models.Model):
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
         unique_together = ['video', 'quality']
+        indexes = [
+            models.Index(fields=['quality', 'priority']),
+        ]
         
     def __str__(self):
         return f"{self.video} - {self.quality}"
 
 class HotSearch(models.Model):
-    keyword = models.CharField(max_length=100, verbose_name='搜索关键词')
+    keyword = models.CharField(max_length=100, unique=True, verbose_name='搜索关键词')
     count = models.IntegerField(default=0, verbose_name='搜索次数')
     order = models.IntegerField(default=0, verbose_name='排序')
     is_active = models.BooleanField(default=True, verbose_name='是否启用')
+    # 由搜索统计自动创建，次数由统计维护；手工添加的搜索词次数不会被统计覆盖
+    is_tracked = models.BooleanField(default=False, verbose_name='自动统计')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
@@ -382,6 +460,26 @@ class Actor(models.Model):
     def __str__(self):
         return self.name
 
+class CastDescription(models.Model):
+    """演员、导演简介缓存，同名人物不重复生成"""
+    ROLE_CHOICES = [
+        ('actor', '演员'),
+        ('director', '导演'),
+    ]
+
+    name = models.CharField(max_length=100, verbose_name='姓名')
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES, verbose_name='角色')
+    description = models.TextField(verbose_name='描述')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '人物简介缓存'
+        verbose_name_plural = verbose_name
+        unique_together = ['name', 'role']
+
+    def __str__(self):
+        return f"{self.name} ({self.role})"
+
 class Director(models.Model):
     """导演模型"""
     name = models.CharField(max_length=100, verbose_name='姓名')
@@ -599,11 +697,13 @@ class Comment(models.Model):
         if not self.uid:
             import uuid
             self.uid = str(uuid.uuid4())
-        super().save(*args, **kwargs)
-        
-        # 更新视频评论数
-        self.video.comment_count = Comment.objects.filter(video=self.video).count()
-        self.video.save(update_fields=['comment_count'])
+        is_new = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # 新增评论时原子递增视频评论数，编辑评论不影响计数（删除见 signals.py）
+            if is_new:
+                Video.objects.filter(pk=self.video_id).update(comment_count=F('comment_count') + 1)
 
 class Danmaku(models.Model):
     """弹幕"""
@@ -621,6 +721,88 @@ class Danmaku(models.Model):
         verbose_name = '弹幕'
         verbose_name_plural = '弹幕'
         ordering = ['time']
+        indexes = [models.Index(fields=['video', 'time'])]
     
     def __str__(self):
         return f"{self.user.username}在{self.video.title}的弹幕"
+
+
+class SearchDocument(models.Model):
+    """搜索索引文档"""
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, primary_key=True, related_name='search_document', verbose_name='视频')
+    length = models.FloatField('加权词元数', default=0)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '搜索索引文档'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.video_id} ({self.length})"
+
+class SearchPosting(models.Model):
+    """搜索倒排索引"""
+    term = models.CharField('词元', max_length=50)
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='search_postings', verbose_name='视频')
+    weight = models.FloatField('加权词频', default=0)
+    doc_length = models.FloatField('文档长度', default=0)
+
+    class Meta:
+        verbose_name = '搜索倒排索引'
+        verbose_name_plural = verbose_name
+        unique_together = ['term', 'video']
+
+    def __str__(self):
+        return f"{self.term} - {self.video_id}"
+
+class UploadSession(models.Model):
+    """分块上传会话"""
+    KIND_CHOICES = [
+        ('video', '视频发布'),
+        ('content', '内容发布'),
+    ]
+    STATUS_CHOICES = [
+        ('uploading', '上传中'),
+        ('completed', '已完成'),
+        ('failed', '失败'),
+    ]
+
+    upload_id = models.CharField('上传ID', max_length=50, unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='用户')
+    kind = models.CharField('上传类型', max_length=20, choices=KIND_CHOICES, default='video')
+    filename = models.CharField('文件名', max_length=255)
+    content_type = models.CharField('文件类型', max_length=100)
+    total_size = models.BigIntegerField('文件大小')
+    chunk_size = models.IntegerField('分块大小')
+    received_chunks = models.JSONField('已接收分块', default=list, blank=True)
+    metadata = models.JSONField('发布信息', default=dict, blank=True)
+    status = models.CharField('状态', max_length=20, choices=STATUS_CHOICES, default='uploading')
+    media = models.ForeignKey(VideoMedia, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='媒体文件')
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '分块上传'
+        verbose_name_plural = verbose_name
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.filename} ({self.upload_id})"
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+class RelatedVideos(models.Model):
+    """相关视频（离线计算）"""
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, primary_key=True, related_name='related_videos', verbose_name='视频')
+    # 按相似度降序排列的 (视频ID uint32, 相似度 float32) 小端序紧凑编码
+    data = models.BinaryField('相关视频', default=bytes)
+    computed_at = models.DateTimeField('计算时间', default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = '相关视频'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.video_id} ({len(self.data) // 8})"
@@ -0,0 +1,145 @@
+"""匿名用户整页缓存
+
+首页、频道页对未登录用户完全相同，整页响应按 (路径, 指定的查询参数) 缓存：
+
+- 新鲜期内直接返回缓存
+- 过期后的 stale 期内仍返回旧页面，同时由后台线程重新生成，同一页面同一时间
+  只有一个刷新任务
+- 完全未命中时只有一个请求生成页面，其余请求短暂等待它的结果，不会在缓存
+  过期瞬间同时压到数据库
+
+幻灯片、分类或热门榜变化时调用 ``purge`` 把对应页面标记为过期（软清除），页面
+继续以 stale 状态提供并在后台刷新。登录用户、非 GET 请求、带 Cookie 或 CSRF 令牌
+的响应不缓存。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+import copy
+import hashlib
+import logging
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FRESH = 60
+DEFAULT_STALE = 600
+LOCK_TIMEOUT = 30
+# 未命中时等待其他请求生成页面的时间
+WAIT_TIMEOUT = 5
+WAIT_INTERVAL = 0.05
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='page-cache')
+
+
+def page_key(namespace, request, vary_on):
+    params = sorted((name, value) for name in vary_on for value in request.GET.getlist(name))
+    identity = f'{request.path}?{urlencode(params)}'
+    return f'page:{namespace}:{hashlib.sha1(identity.encode()).hexdigest()}'
+
+
+def stale_before_key(namespace):
+    return f'page:{namespace}:stale_before'
+
+
+def purge(*namespaces):
+    """把命名空间下已缓存的页面标记为过期，下次请求返回旧页面并在后台刷新"""
+    now = time.time()
+    cache.set_many({stale_before_key(namespace): now for namespace in namespaces}, None)
+
+
+def is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    user = getattr(request, 'user', None)
+    return user is None or not user.is_authenticated
+
+
+def is_cacheable_response(request, response):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    # 页面中包含 CSRF 令牌时不同访客不能共享
+    if request.META.get('CSRF_COOKIE_USED') or request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+        return False
+    return True
+
+
+def build_response(entry, state):
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['X-Page-Cache'] = state
+    return response
+
+
+def anonymous_page_cache(namespace, vary_on=(), fresh=None, stale=None):
+    """匿名整页缓存装饰器
+
+    vary_on 为参与缓存键的查询参数，其他参数（如统计来源）不影响缓存。
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request) or not getattr(settings, 'PAGE_CACHE_ENABLED', True):
+                return view_func(request, *args, **kwargs)
+
+            fresh_seconds = fresh if fresh is not None else getattr(settings, 'PAGE_CACHE_FRESH', DEFAULT_FRESH)
+            stale_seconds = stale if stale is not None else getattr(settings, 'PAGE_CACHE_STALE', DEFAULT_STALE)
+            key = page_key(namespace, request, vary_on)
+            lock_key = f'{key}:lock'
+
+            def generate(req):
+                response = view_func(req, *args, **kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response = response.render()
+                if is_cacheable_response(req, response):
+                    cache.set(key, {
+                        'content': response.content,
+                        'content_type': response.get('Content-Type'),
+                        'created': time.time(),
+                    }, fresh_seconds + stale_seconds)
+                return response
+
+            def refresh():
+                close_old_connections()
+                try:
+                    background_request = copy.copy(request)
+                    background_request.user = AnonymousUser()
+                    background_request.META = dict(request.META)
+                    generate(background_request)
+                except Exception:
+                    logger.exception(f'后台刷新页面缓存失败: {request.path}')
+                finally:
+                    cache.delete(lock_key)
+                    close_old_connections()
+
+            entry = cache.get(key)
+            if entry is not None:
+                stale_before = cache.get(stale_before_key(namespace), 0)
+                if time.time() - entry['created'] < fresh_seconds and entry['created'] >= stale_before:
+                    return build_response(entry, 'hit')
+                if cache.add(lock_key, 1, LOCK_TIMEOUT):
+                    _executor.submit(refresh)
+                return build_response(entry, 'stale')
+
+            # 完全未命中：只有拿到锁的请求生成页面，其余请求等待结果
+            if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+                deadline = time.monotonic() + WAIT_TIMEOUT
+                while time.monotonic() < deadline:
+                    time.sleep(WAIT_INTERVAL)
+                    entry = cache.get(key)
+                    if entry is not None:
+                        return build_response(entry, 'coalesced')
+                return view_func(request, *args, **kwargs)
+            try:
+                response = generate(request)
+            finally:
+                cache.delete(lock_key)
+            response['X-Page-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
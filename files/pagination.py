@@ -0,0 +1,194 @@
+"""游标分页
+
+按 (排序字段, id) 做键集分页：下一页用 ``WHERE (created_at, id) < (上页最后一条)``
+代替 OFFSET，也不需要每次 COUNT(*)。游标经过签名，对客户端不透明。
+
+CursorPage 兼容 Django Page 的常用属性。``next_page_number`` 和
+``previous_page_number`` 保留给拼接 ``?page=`` 链接的旧模板，这类链接会退回
+OFFSET 分页；新模板应使用 ``next_cursor``/``previous_cursor``，或直接引入
+components/pagination.html。
+总数按查询条件缓存，只有模板实际读取 ``paginator.count`` 时才会计算。
+请求中带 ``page`` 参数时仍使用原有的页码分页。
+"""
+from datetime import datetime
+import hashlib
+import math
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CURSOR_SALT = 'files.pagination'
+COUNT_CACHE_TIMEOUT = 600
+
+# 各视图支持的排序方式
+ORDER_LATEST = ('-created_at', '-id')
+ORDER_POPULAR = ('-play_count', '-id')
+
+
+def encode_cursor(values, direction, number):
+    data = {
+        'v': [value.isoformat() if isinstance(value, datetime) else value for value in values],
+        'd': direction,
+        'n': number,
+    }
+    return signing.dumps(data, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """解析游标，无效时返回None"""
+    try:
+        return signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+
+
+class CursorPaginator:
+    """键集分页器"""
+
+    def __init__(self, queryset, per_page, ordering=ORDER_LATEST):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    @cached_property
+    def count(self):
+        """总数估计，按查询条件缓存"""
+        query_hash = hashlib.md5(str(self.queryset.query).encode()).hexdigest()
+        cache_key = f'pagination:count:{query_hash}'
+        count = cache.get(cache_key)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(cache_key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+    @property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+    def _parse_values(self, values):
+        parsed = []
+        for field, value in zip(self.fields, values):
+            model_field = self.queryset.model._meta.get_field(field)
+            if value is not None and model_field.get_internal_type() == 'DateTimeField':
+                value = datetime.fromisoformat(value)
+            parsed.append(value)
+        return parsed
+
+    def _seek(self, queryset, values, forward):
+        """构造 (字段...) 严格位于 values 之后（或之前）的条件"""
+        condition = Q()
+        for i, ordering in enumerate(self.ordering):
+            descending = ordering.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            clause = {field: value for field, value in zip(self.fields[:i], values[:i])}
+            clause[f'{self.fields[i]}__{lookup}'] = values[i]
+            condition |= Q(**clause)
+        return queryset.filter(condition)
+
+    def get_page(self, cursor=None):
+        """获取游标对应的页，游标为空或无效时返回第一页"""
+        data = decode_cursor(cursor) if cursor else None
+        if data is None or len(data.get('v', [])) != len(self.fields):
+            data = None
+
+        queryset = self.queryset
+        if data is None:
+            forward, number = True, 1
+            rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        else:
+            forward, number = data['d'] == 'n', data['n']
+            values = self._parse_values(data['v'])
+            queryset = self._seek(queryset, values, forward)
+            if forward:
+                rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+            else:
+                reverse_ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+                rows = list(queryset.order_by(*reverse_ordering)[:self.per_page + 1])
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            has_next, has_previous = has_more, number > 1
+        else:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        return CursorPage(rows, number, self, has_next, has_previous)
+
+
+class CursorPage:
+    """游标分页的一页，兼容 Django Page 的常用接口"""
+
+    def __init__(self, object_list, number, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<CursorPage {self.number}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def _values(self, obj):
+        return [getattr(obj, field) for field in self.paginator.fields]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_page_number(self):
+        """相邻页码，供拼接 ?page= 链接的旧模板使用"""
+        if not self._has_next:
+            raise EmptyPage('没有下一页')
+        return self.number + 1
+
+    def previous_page_number(self):
+        if not self._has_previous:
+            raise EmptyPage('没有上一页')
+        return self.number - 1
+
+    def start_index(self):
+        return (self.number - 1) * self.paginator.per_page + 1 if self.object_list else 0
+
+    def end_index(self):
+        return (self.number - 1) * self.paginator.per_page + len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return encode_cursor(self._values(self.object_list[-1]), 'n', self.number + 1)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return encode_cursor(self._values(self.object_list[0]), 'p', self.number - 1)
+
+
+def paginate(request, queryset, per_page, ordering=ORDER_LATEST):
+    """分页：带 page 参数时使用页码分页，否则使用游标分页"""
+    if 'page' in request.GET:
+        return Paginator(queryset.order_by(*ordering), per_page).get_page(request.GET.get('page'))
+    return CursorPaginator(queryset, per_page, ordering).get_page(request.GET.get('cursor'))
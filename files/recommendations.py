@@ -0,0 +1,294 @@
+"""相关视频推荐
+
+按标签、演员、导演和分类的共现离线计算每个视频最相似的 K 个视频：
+
+- 每个视频表示为稀疏特征向量，特征权重为类型权重乘以 IDF，只出现在一个视频中
+  的特征不产生相似度，出现在过多视频中的特征区分度低，两者都丢弃；向量按 L2
+  归一化，点积即余弦相似度
+- 视频 × 特征的 CSR 矩阵按行分块与自身转置相乘，每块的乘积非零元数不超过
+  RECOMMENDATION_BLOCK_NNZ，内存占用与视频总数无关；每块的前 K 个用排序一次性
+  选出，不逐行循环
+- 结果以 (视频ID, 相似度) 的紧凑二进制存放在 RelatedVideos 中，详情页按主键
+  读取一行即可，并缓存解码后的ID列表
+
+新增视频通过增量刷新加入：只计算还没有推荐结果的视频，同时把它们并入已有视频
+的推荐列表中（相似度进入对方前 K 名时）。特征变化较多时定期全量重建。
+
+计算需要 numpy 和 scipy，读取推荐结果不需要。
+"""
+import logging
+import math
+import struct
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Video, VideoActor, VideoCategory, VideoDirector, RelatedVideos
+
+logger = logging.getLogger(__name__)
+
+# 特征来源：(关联表, 特征ID字段, 类型权重)
+FEATURE_SOURCES = {
+    'tag': (Video.tags.through, 'tag_id', 1.0),
+    'actor': (VideoActor, 'actor_id', 1.5),
+    'director': (VideoDirector, 'director_id', 2.0),
+    'category': (VideoCategory, 'category_id', 0.5),
+}
+
+DEFAULT_TOP_K = 20
+DISPLAY_SIZE = 10
+# 每块乘积的非零元上限，约 24 字节/个
+DEFAULT_BLOCK_NNZ = 5_000_000
+
+# 出现在超过该比例视频中的特征丢弃（视频数较少时不丢弃）
+MAX_DF_RATIO = 0.2
+MIN_VIDEOS_FOR_DF_CAP = 1000
+
+RECORD = struct.Struct('<If')
+CACHE_TIMEOUT = 3600
+WRITE_BATCH_SIZE = 500
+
+
+class RecommendationError(Exception):
+    """无法计算推荐"""
+
+
+def require_numpy():
+    try:
+        import numpy as np
+        from scipy import sparse
+    except ImportError:
+        raise RecommendationError('未安装 numpy 和 scipy')
+    return np, sparse
+
+
+def cache_key(video_id):
+    return f'related:{video_id}'
+
+
+def encode(video_ids, scores):
+    return b''.join(RECORD.pack(int(video_id), float(score)) for video_id, score in zip(video_ids, scores))
+
+
+def decode(data):
+    """返回 [(视频ID, 相似度), ...]"""
+    if not data:
+        return []
+    return list(RECORD.iter_unpack(bytes(data)))
+
+
+def load_pairs(np, model, field, video_ids):
+    """关联表的 (行号, 特征ID)，只保留 video_ids 中的视频"""
+    pairs = np.array(
+        list(model.objects.filter(video__is_active=True).values_list('video_id', field).iterator(chunk_size=10000)),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    rows = np.searchsorted(video_ids, pairs[:, 0])
+    rows = np.minimum(rows, len(video_ids) - 1)
+    known = video_ids[rows] == pairs[:, 0]
+    return rows[known], pairs[known, 1]
+
+
+def build_matrix():
+    """返回 (按ID升序的视频ID数组, 行归一化的视频 × 特征 CSR 矩阵, 各特征的文档频率)"""
+    np, sparse = require_numpy()
+    video_ids = np.array(
+        sorted(Video.objects.filter(is_active=True).values_list('id', flat=True)), dtype=np.int64
+    )
+    total = len(video_ids)
+    if not total:
+        return video_ids, sparse.csr_matrix((0, 0), dtype=np.float32), np.zeros(0)
+
+    all_rows, all_cols, all_weights = [], [], []
+    offset = 0
+    for model, field, weight in FEATURE_SOURCES.values():
+        rows, features = load_pairs(np, model, field, video_ids)
+        if not len(rows):
+            continue
+        unique_features, cols = np.unique(features, return_inverse=True)
+        # 同一视频同一特征只计一次（如同一演员饰演多个角色）
+        entries = np.unique(rows * len(unique_features) + cols)
+        all_rows.append(entries // len(unique_features))
+        all_cols.append(entries % len(unique_features) + offset)
+        all_weights.append(np.full(len(entries), weight, dtype=np.float64))
+        offset += len(unique_features)
+    if not all_rows:
+        return video_ids, sparse.csr_matrix((total, 0), dtype=np.float32), np.zeros(0)
+
+    rows = np.concatenate(all_rows)
+    cols = np.concatenate(all_cols)
+    weights = np.concatenate(all_weights)
+
+    df = np.bincount(cols, minlength=offset)
+    useful = df >= 2
+    if total >= MIN_VIDEOS_FOR_DF_CAP:
+        useful &= df <= MAX_DF_RATIO * total
+    keep = useful[cols]
+    rows, cols, weights = rows[keep], cols[keep], weights[keep]
+
+    idf = np.log((1 + total) / (1 + df)) + 1
+    data = (weights * idf[cols]).astype(np.float32)
+    matrix = sparse.csr_matrix((data, (rows, cols)), shape=(total, offset), dtype=np.float32)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.diags((1 / norms).astype(np.float32)) @ matrix
+    return video_ids, matrix.tocsr(), np.where(useful, df, 0)
+
+
+def iter_blocks(np, matrix, df, rows, block_nnz):
+    """把 rows 切成若干块，每块与全矩阵相乘的非零元数估计不超过 block_nnz
+
+    一行乘积的非零元数不超过其各特征文档频率之和。
+    """
+    indicator = matrix[rows].copy()
+    indicator.data[:] = 1
+    costs = np.cumsum(indicator @ df)
+    start = 0
+    while start < len(rows):
+        base = costs[start - 1] if start else 0
+        end = max(start + 1, int(np.searchsorted(costs, base + block_nnz, side='right')))
+        yield rows[start:end]
+        start = end
+
+
+def top_k_entries(np, block, k, self_cols=None):
+    """每行相似度最高的 k 项，返回按 (行, 相似度降序) 排列的 (行号, 列号, 相似度)
+
+    self_cols 为各行对应视频自身的列号，结果中排除自身。相似度相同时较新（ID较大）
+    的视频在前。
+    """
+    block = block.tocsr()
+    rows = np.repeat(np.arange(block.shape[0], dtype=np.int64), np.diff(block.indptr))
+    cols = block.indices.astype(np.int64)
+    scores = block.data
+    keep = scores > 0
+    if self_cols is not None:
+        keep &= cols != self_cols[rows]
+    rows, cols, scores = rows[keep], cols[keep], scores[keep]
+    order = np.lexsort((-cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < k
+    return rows[keep], cols[keep], scores[keep]
+
+
+def write_rows(entries, computed_at):
+    """entries 为 {视频ID: data}，覆盖写入"""
+    objs = [RelatedVideos(video_id=video_id, data=data, computed_at=computed_at)
+            for video_id, data in entries.items()]
+    with transaction.atomic():
+        RelatedVideos.objects.filter(video_id__in=list(entries)).delete()
+        RelatedVideos.objects.bulk_create(objs, batch_size=WRITE_BATCH_SIZE)
+    cache.delete_many([cache_key(video_id) for video_id in entries])
+
+
+def compute_rows(np, video_ids, matrix, transposed, rows, k):
+    """计算 rows 中各视频的推荐，返回 ({视频ID: data}, 乘积矩阵)"""
+    block = matrix[rows] @ transposed
+    hit_rows, hit_cols, hit_scores = top_k_entries(np, block, k, self_cols=rows)
+    starts = np.searchsorted(hit_rows, np.arange(len(rows)))
+    ends = np.searchsorted(hit_rows, np.arange(len(rows)), side='right')
+    entries = {
+        int(video_ids[row]): encode(video_ids[hit_cols[start:end]], hit_scores[start:end])
+        for row, start, end in zip(rows, starts, ends)
+    }
+    return entries, block
+
+
+def build(top_k=None, block_nnz=None, stdout=None):
+    """全量重建所有视频的推荐，返回处理的视频数"""
+    np, _ = require_numpy()
+    top_k = top_k or getattr(settings, 'RECOMMENDATION_TOP_K', DEFAULT_TOP_K)
+    block_nnz = block_nnz or getattr(settings, 'RECOMMENDATION_BLOCK_NNZ', DEFAULT_BLOCK_NNZ)
+    started = timezone.now()
+
+    video_ids, matrix, df = build_matrix()
+    transposed = matrix.T.tocsr()
+    done = 0
+    for rows in iter_blocks(np, matrix, df, np.arange(len(video_ids)), block_nnz):
+        entries, _ = compute_rows(np, video_ids, matrix, transposed, rows, top_k)
+        write_rows(entries, started)
+        done += len(rows)
+        if stdout:
+            stdout.write(f'已计算 {done}/{len(video_ids)} 个视频')
+
+    # 已下线或删除的视频
+    RelatedVideos.objects.filter(computed_at__lt=started).delete()
+    return done
+
+
+def refresh(top_k=None, block_nnz=None, stdout=None):
+    """增量刷新：计算还没有推荐的视频，并把它们并入已有视频的推荐，返回新计算的视频数"""
+    np, _ = require_numpy()
+    top_k = top_k or getattr(settings, 'RECOMMENDATION_TOP_K', DEFAULT_TOP_K)
+    block_nnz = block_nnz or getattr(settings, 'RECOMMENDATION_BLOCK_NNZ', DEFAULT_BLOCK_NNZ)
+    computed_at = timezone.now()
+
+    video_ids, matrix, df = build_matrix()
+    existing = np.array(list(RelatedVideos.objects.values_list('video_id', flat=True)), dtype=np.int64)
+    is_new = ~np.isin(video_ids, existing)
+    new_rows = np.flatnonzero(is_new)
+    if not len(new_rows):
+        return 0
+
+    transposed = matrix.T.tocsr()
+    done = 0
+    for rows in iter_blocks(np, matrix, df, new_rows, block_nnz):
+        entries, block = compute_rows(np, video_ids, matrix, transposed, rows, top_k)
+        write_rows(entries, computed_at)
+
+        # 反向：已有视频的前 K 名候选中出现的新视频
+        rev_rows, rev_cols, rev_scores = top_k_entries(np, block.T, top_k)
+        keep = ~is_new[rev_rows]
+        candidates = {}
+        for row, col, score in zip(rev_rows[keep], rev_cols[keep], rev_scores[keep]):
+            candidates.setdefault(int(video_ids[row]), []).append((int(video_ids[rows[col]]), float(score)))
+        merge_candidates(candidates, top_k)
+
+        done += len(rows)
+        if stdout:
+            stdout.write(f'已计算 {done}/{len(new_rows)} 个新视频')
+    return done
+
+
+def merge_candidates(candidates, top_k):
+    """把候选 {视频ID: [(视频ID, 相似度), ...]} 并入已有推荐，只更新发生变化的行"""
+    video_ids = list(candidates)
+    for start in range(0, len(video_ids), WRITE_BATCH_SIZE):
+        batch = video_ids[start:start + WRITE_BATCH_SIZE]
+        changed = []
+        for obj in RelatedVideos.objects.filter(video_id__in=batch):
+            current = decode(obj.data)
+            floor = current[-1][1] if len(current) >= top_k else -math.inf
+            additions = [item for item in candidates[obj.video_id] if item[1] > floor]
+            if not additions:
+                continue
+            merged = dict(current)
+            merged.update(additions)
+            ranked = sorted(merged.items(), key=lambda item: (-item[1], -item[0]))[:top_k]
+            obj.data = encode([video_id for video_id, _ in ranked], [score for _, score in ranked])
+            changed.append(obj)
+        if changed:
+            RelatedVideos.objects.bulk_update(changed, ['data'], batch_size=WRITE_BATCH_SIZE)
+            cache.delete_many([cache_key(obj.video_id) for obj in changed])
+
+
+def get_related_ids(video_id):
+    """按相似度降序的相关视频ID，尚未计算时返回空列表"""
+    video_ids = cache.get(cache_key(video_id))
+    if video_ids is None:
+        data = RelatedVideos.objects.filter(video_id=video_id).values_list('data', flat=True).first()
+        video_ids = [related_id for related_id, _ in decode(data)]
+        cache.set(cache_key(video_id), video_ids, CACHE_TIMEOUT)
+    return video_ids
+
+
+def get_related_videos(video, limit=DISPLAY_SIZE):
+    """相关视频卡片，跳过已下线的视频"""
+    video_ids = get_related_ids(video.id)
+    if not video_ids:
+        return []
+    videos = Video.objects.filter(is_active=True).cards().in_bulk(video_ids)
+    return [videos[video_id] for video_id in video_ids if video_id in videos][:limit]
@@ -0,0 +1,260 @@
+"""视频搜索索引
+
+倒排索引存放在 SearchPosting 表中，按词元精确查找，代替 icontains 的全表扫描。
+中日韩文字按单字和二元组切分，其余文字按单词切分；标题、演员、导演、标签和
+描述按不同权重计入词频，查询时按 BM25 排序。
+
+全量重建按批替换各视频的倒排记录，最后删除已不存在的视频，重建期间旧索引一直
+可用；从空索引开始重建时，完成前搜索仍使用 icontains。
+"""
+from collections import defaultdict
+import logging
+import math
+import re
+import unicodedata
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Prefetch, Sum
+
+from .models import Video, Actor, Director, Tag, SearchDocument, SearchPosting
+
+logger = logging.getLogger(__name__)
+
+# 各字段的词频权重
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'actors': 2.0,
+    'directors': 2.0,
+    'tags': 2.0,
+    'description': 1.0,
+}
+
+# 影响索引内容的 Video 字段，只更新其他字段时不重建索引
+INDEXED_FIELDS = {'title', 'description', 'is_active'}
+
+MAX_TERM_LENGTH = 50
+MAX_RESULTS = 1000
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 出现在超过该比例文档中的词元视为停用词（查询只剩停用词时仍然使用）
+MAX_DF_RATIO = 0.3
+
+# 查询词元至少命中的比例
+MIN_SHOULD_MATCH = 0.75
+
+STATS_CACHE_KEY = 'search_index:stats'
+STATS_CACHE_TIMEOUT = 300
+# 从空索引开始重建时设置，每批续期，重建进程异常退出后自动失效
+REBUILDING_CACHE_KEY = 'search_index:rebuilding'
+REBUILDING_TIMEOUT = 600
+
+CJK_CHARS = r'぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+TOKEN_RE = re.compile(rf'[{CJK_CHARS}]+|[0-9a-z]+')
+CJK_RE = re.compile(rf'[{CJK_CHARS}]')
+
+
+def tokenize(text, unigrams=True):
+    """切分词元
+
+    中日韩文字输出二元组，单独一个字时输出该字；unigrams 为真时额外输出每个单字，
+    用于建索引，使单字查询也能命中。其余文字按单词切分并转为小写。
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = []
+    for run in TOKEN_RE.findall(text):
+        if CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+                continue
+            if unigrams:
+                tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run[:MAX_TERM_LENGTH])
+    return tokens
+
+
+def analyze_video(video):
+    """计算视频的加权词频和文档长度
+
+    演员、导演和标签通过 all() 读取，批量重建时使用预取的结果。
+    """
+    fields = {
+        'title': [video.title],
+        'description': [video.description],
+        'actors': [actor.name for actor in video.actors.all()],
+        'directors': [director.name for director in video.directors.all()],
+        'tags': [tag.name for tag in video.tags.all()],
+    }
+    weights = defaultdict(float)
+    length = 0.0
+    for field, texts in fields.items():
+        field_weight = FIELD_WEIGHTS[field]
+        for text in texts:
+            for token in tokenize(text):
+                weights[token] += field_weight
+                length += field_weight
+    return weights, length
+
+
+def build_postings(video):
+    """视频的倒排记录和文档"""
+    weights, length = analyze_video(video)
+    postings = [
+        SearchPosting(term=term, video_id=video.id, weight=weight, doc_length=length)
+        for term, weight in weights.items()
+    ]
+    return postings, SearchDocument(video_id=video.id, length=length)
+
+
+def index_video(video):
+    """重建单个视频的索引"""
+    if not video.is_active:
+        remove_video(video.id)
+        return
+
+    postings, document = build_postings(video)
+    with transaction.atomic():
+        SearchPosting.objects.filter(video_id=video.id).delete()
+        SearchPosting.objects.bulk_create(postings, batch_size=1000)
+        SearchDocument.objects.update_or_create(video_id=video.id, defaults={'length': document.length})
+
+
+def remove_video(video_id):
+    """从索引中移除视频"""
+    with transaction.atomic():
+        SearchPosting.objects.filter(video_id=video_id).delete()
+        SearchDocument.objects.filter(video_id=video_id).delete()
+
+
+def rebuild_index(batch_size=500, stdout=None):
+    """全量重建索引
+
+    按批替换倒排记录，每批只需读取视频和预取演员、导演、标签的几条查询。
+    """
+    initial = not SearchDocument.objects.exists()
+    if initial:
+        cache.set(REBUILDING_CACHE_KEY, True, REBUILDING_TIMEOUT)
+
+    active = Video.objects.filter(is_active=True)
+    ids = list(active.order_by('id').values_list('id', flat=True))
+    videos = active.only('id', 'title', 'description', 'is_active').prefetch_related(
+        Prefetch('actors', queryset=Actor.objects.only('id', 'name')),
+        Prefetch('directors', queryset=Director.objects.only('id', 'name')),
+        Prefetch('tags', queryset=Tag.objects.only('id', 'name')),
+    )
+    total = 0
+    try:
+        for start in range(0, len(ids), batch_size):
+            batch_ids = ids[start:start + batch_size]
+            postings = []
+            documents = []
+            for video in videos.filter(id__in=batch_ids):
+                video_postings, document = build_postings(video)
+                postings.extend(video_postings)
+                documents.append(document)
+            with transaction.atomic():
+                SearchPosting.objects.filter(video_id__in=batch_ids).delete()
+                SearchDocument.objects.filter(video_id__in=batch_ids).delete()
+                SearchPosting.objects.bulk_create(postings, batch_size=1000)
+                SearchDocument.objects.bulk_create(documents, batch_size=1000)
+            total += len(documents)
+            if initial:
+                cache.set(REBUILDING_CACHE_KEY, True, REBUILDING_TIMEOUT)
+            if stdout:
+                stdout.write(f'已索引 {total} 个视频')
+
+        # 重建期间删除或停用的视频
+        with transaction.atomic():
+            SearchPosting.objects.exclude(video__is_active=True).delete()
+            SearchDocument.objects.exclude(video__is_active=True).delete()
+    finally:
+        cache.delete_many([REBUILDING_CACHE_KEY, STATS_CACHE_KEY])
+    return total
+
+
+def get_index_stats():
+    """获取文档总数和平均文档长度"""
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        aggregate = SearchDocument.objects.aggregate(count=Count('video_id'), total=Sum('length'))
+        count = aggregate['count'] or 0
+        stats = {
+            'count': count,
+            'avg_length': (aggregate['total'] or 0) / count if count else 0,
+        }
+        cache.set(STATS_CACHE_KEY, stats, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def bm25_score(weight, doc_length, doc_freq, doc_count, avg_length):
+    """单个词元的 BM25 得分"""
+    idf = math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_length / (avg_length or 1))
+    return idf * weight * (BM25_K1 + 1) / (weight + norm)
+
+
+def rank(postings, doc_freqs, doc_count, avg_length, term_count, limit=MAX_RESULTS):
+    """根据倒排记录计算排序结果
+
+    postings 为 (term, video_id, weight, doc_length) 序列，返回按得分降序的视频ID列表。
+    """
+    scores = defaultdict(float)
+    matched = defaultdict(int)
+    for term, video_id, weight, doc_length in postings:
+        scores[video_id] += bm25_score(weight, doc_length, doc_freqs[term], doc_count, avg_length)
+        matched[video_id] += 1
+
+    min_match = max(1, math.ceil(term_count * MIN_SHOULD_MATCH))
+    candidates = [video_id for video_id in scores if matched[video_id] >= min_match]
+    candidates.sort(key=lambda video_id: (-scores[video_id], -video_id))
+    return candidates[:limit]
+
+
+def select_terms(terms, doc_freqs, doc_count):
+    """挑选需要读取倒排记录的词元
+
+    返回 (词元列表, 参与最少命中计算的词元数)，命中词元不足时返回 ([], 0)。
+    """
+    if len(doc_freqs) < math.ceil(len(terms) * MIN_SHOULD_MATCH):
+        return [], 0
+
+    # 去掉过于常见的词元，减少需要读取的倒排记录
+    selective = [term for term in doc_freqs if doc_freqs[term] <= doc_count * MAX_DF_RATIO]
+    query_terms = selective or list(doc_freqs)
+    return query_terms, len(terms) - (len(doc_freqs) - len(query_terms))
+
+
+def search_video_ids(query, limit=MAX_RESULTS):
+    """搜索视频，返回按相关度排序的视频ID列表"""
+    terms = list(dict.fromkeys(tokenize(query, unigrams=False)))
+    if not terms:
+        return []
+
+    stats = get_index_stats()
+    if not stats['count']:
+        return []
+
+    doc_freqs = dict(
+        SearchPosting.objects.filter(term__in=terms)
+        .values('term').annotate(df=Count('id')).values_list('term', 'df')
+    )
+    query_terms, term_count = select_terms(terms, doc_freqs, stats['count'])
+    if not query_terms:
+        return []
+
+    postings = SearchPosting.objects.filter(term__in=query_terms).values_list(
+        'term', 'video_id', 'weight', 'doc_length'
+    )
+    return rank(postings, doc_freqs, stats['count'], stats['avg_length'], term_count, limit)
+
+
+def is_index_ready():
+    """索引是否已建立，从空索引开始的重建完成前为否"""
+    return get_index_stats()['count'] > 0 and not cache.get(REBUILDING_CACHE_KEY)
@@ -0,0 +1,304 @@
+"""热门搜索统计
+
+搜索词先放入无锁的 deque（CPython 中 append 是原子操作，搜索请求不争用锁），由
+后台线程汇总到两个固定大小的结构中：
+
+- Count-Min Sketch（保守更新）：估计任意搜索词的次数，大小与搜索词种类无关
+- Space-Saving 候选表：只保留估计次数最高的 SEARCH_TRENDS_CAPACITY 个搜索词
+
+计数按时间衰减，半衰期为 SEARCH_TRENDS_HALF_LIFE，一个搜索词的分数约等于按
+距今时间折算后的搜索次数。衰减使用前向衰减：新的搜索按 2^(t/半衰期) 加权，
+查询时再统一折算，不需要定期遍历全部计数。
+
+后台线程每隔 SEARCH_TRENDS_FLUSH_INTERVAL 秒把本进程的前若干名写入缓存，抢到
+锁的进程合并各进程的结果，按 keyword 一次 upsert 写入 HotSearch 的 count 字段。
+统计只维护自己创建的搜索词（is_tracked）：新搜索词以未启用状态创建，由后台审核
+后启用，不在前列的搜索词 count 置零；后台手工添加的搜索词次数不受影响。搜索请求
+本身从不写库。
+队列已满时丢弃最早的搜索词。
+
+相关配置：
+    SEARCH_TRENDS_ENABLED = True
+    SEARCH_TRENDS_HALF_LIFE = 21600       # 半衰期（秒）
+    SEARCH_TRENDS_FLUSH_INTERVAL = 60     # 写入间隔（秒）
+    SEARCH_TRENDS_CAPACITY = 200          # 候选表大小
+    HOT_SEARCH_SIZE = 20                  # 写入 HotSearch 的搜索词数
+"""
+from collections import deque
+import atexit
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import suggestions
+from .models import HotSearch
+
+logger = logging.getLogger(__name__)
+
+MAX_KEYWORD_LENGTH = HotSearch._meta.get_field('keyword').max_length
+QUEUE_SIZE = 10000
+AGGREGATE_INTERVAL = 1
+
+SKETCH_WIDTH = 4096
+SKETCH_DEPTH = 4
+# 前向衰减的权重超过该值时整体折算，避免浮点溢出
+RESCALE_THRESHOLD = 2.0 ** 40
+
+NODES_KEY = 'search_trends:nodes'
+SNAPSHOT_KEY_TEMPLATE = 'search_trends:snapshot:{node}'
+NODES_LOCK_KEY = 'search_trends:nodes_lock'
+FLUSH_LOCK_KEY = 'search_trends:flush_lock'
+# 进程列表锁的超时（秒）、最多尝试次数和重试间隔（秒）
+NODES_LOCK_TIMEOUT = 5
+NODES_LOCK_ATTEMPTS = 20
+NODES_LOCK_WAIT = 0.05
+
+
+def normalize(query):
+    """规范化搜索词：合并空白、转为小写，无效时返回None"""
+    keyword = ' '.join((query or '').split()).lower()
+    if not keyword or len(keyword) > MAX_KEYWORD_LENGTH:
+        return None
+    return keyword
+
+
+class CountMinSketch:
+    """保守更新的 Count-Min Sketch"""
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = [[0.0] * width for _ in range(depth)]
+
+    def _cells(self, key):
+        # 双重哈希：各行位置为 h1 + i * h2，只需计算一次摘要
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key, amount):
+        """增加计数，返回增加后的估计值
+
+        保守更新只把各行中不足 “最小值 + amount” 的计数提升到该值，高估更少。
+        """
+        cells = self._cells(key)
+        estimate = min(row[cell] for row, cell in zip(self.table, cells)) + amount
+        for row, cell in zip(self.table, cells):
+            if row[cell] < estimate:
+                row[cell] = estimate
+        return estimate
+
+    def estimate(self, key):
+        return min(row[cell] for row, cell in zip(self.table, self._cells(key)))
+
+    def scale(self, factor):
+        for row in self.table:
+            row[:] = [value * factor for value in row]
+
+
+class SpaceSaving:
+    """Space-Saving 候选表，只保留估计值最高的 capacity 个键"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # 表中最小估计值的下界，只有超过它的新键才需要替换
+        self._floor = 0.0
+
+    def offer(self, key, estimate):
+        if key in self.counts:
+            self.counts[key] = estimate
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = estimate
+            return
+        if estimate <= self._floor:
+            return
+        min_key = min(self.counts, key=self.counts.get)
+        if estimate > self.counts[min_key]:
+            del self.counts[min_key]
+            self.counts[key] = estimate
+            self._floor = min(self.counts.values())
+        else:
+            self._floor = self.counts[min_key]
+
+    def scale(self, factor):
+        self.counts = {key: value * factor for key, value in self.counts.items()}
+        self._floor *= factor
+
+    def top(self, n):
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+
+
+class SearchTrends:
+    """按时间衰减的热门搜索统计"""
+
+    def __init__(self, half_life=None, capacity=None, flush_interval=None):
+        self.half_life = half_life or getattr(settings, 'SEARCH_TRENDS_HALF_LIFE', 6 * 3600)
+        self.capacity = capacity or getattr(settings, 'SEARCH_TRENDS_CAPACITY', 200)
+        self.flush_interval = flush_interval or getattr(settings, 'SEARCH_TRENDS_FLUSH_INTERVAL', 60)
+        self.size = getattr(settings, 'HOT_SEARCH_SIZE', 20)
+        self.node = f'{socket.gethostname()}:{os.getpid()}'
+        self.sketch = CountMinSketch()
+        self.candidates = SpaceSaving(self.capacity)
+        self.landmark = time.time()
+        self._queue = deque(maxlen=QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def record(self, query):
+        """记录一次搜索，只入队不加锁"""
+        keyword = normalize(query)
+        if keyword is None or not getattr(settings, 'SEARCH_TRENDS_ENABLED', True):
+            return
+        self._queue.append((keyword, time.time()))
+        self.start()
+
+    def _weight(self, timestamp):
+        return 2.0 ** ((timestamp - self.landmark) / self.half_life)
+
+    def aggregate(self):
+        """把队列中的搜索词汇总到计数结构中，返回处理的条数"""
+        processed = 0
+        with self._lock:
+            while True:
+                try:
+                    keyword, timestamp = self._queue.popleft()
+                except IndexError:
+                    break
+                weight = self._weight(timestamp)
+                if weight > RESCALE_THRESHOLD:
+                    self._rescale(timestamp)
+                    weight = 1.0
+                self.candidates.offer(keyword, self.sketch.add(keyword, weight))
+                processed += 1
+        return processed
+
+    def _rescale(self, timestamp):
+        """把前向衰减的基准时间移到 timestamp"""
+        factor = 1 / self._weight(timestamp)
+        self.sketch.scale(factor)
+        self.candidates.scale(factor)
+        self.landmark = timestamp
+
+    def top(self, n=None):
+        """当前的热门搜索词 [(搜索词, 衰减后的分数), ...]"""
+        self.aggregate()
+        with self._lock:
+            factor = 1 / self._weight(time.time())
+            return [(keyword, score * factor) for keyword, score in self.candidates.top(n or self.size)]
+
+    def publish(self):
+        """把本进程的热门搜索词写入缓存，并在进程列表中登记，返回是否登记成功
+
+        进程列表的读取、修改、写回持有缓存锁，多个进程同时发布时不会覆盖彼此的
+        登记。一直抢不到锁时本轮不登记，已有的登记在过期前仍然有效。
+        """
+        now = time.time()
+        ttl = self.flush_interval * 3
+        cache.set(SNAPSHOT_KEY_TEMPLATE.format(node=self.node), dict(self.top(self.capacity)), ttl)
+        for _ in range(NODES_LOCK_ATTEMPTS):
+            if cache.add(NODES_LOCK_KEY, self.node, NODES_LOCK_TIMEOUT):
+                break
+            time.sleep(NODES_LOCK_WAIT)
+        else:
+            logger.warning('热门搜索进程列表被占用，本轮未登记')
+            return False
+        try:
+            nodes = cache.get(NODES_KEY) or {}
+            nodes = {node: seen for node, seen in nodes.items() if now - seen < ttl}
+            nodes[self.node] = now
+            cache.set(NODES_KEY, nodes, None)
+        finally:
+            cache.delete(NODES_LOCK_KEY)
+        return True
+
+    def merged_top(self):
+        """合并各进程的热门搜索词"""
+        nodes = cache.get(NODES_KEY) or {}
+        snapshots = cache.get_many([SNAPSHOT_KEY_TEMPLATE.format(node=node) for node in nodes])
+        scores = {}
+        for snapshot in snapshots.values():
+            for keyword, score in snapshot.items():
+                scores[keyword] = scores.get(keyword, 0) + score
+        return sorted(scores.items(), key=lambda item: -item[1])[:self.size]
+
+    def flush(self):
+        """发布本进程结果；抢到锁时合并各进程结果写入 HotSearch，返回写入的搜索词数"""
+        self.publish()
+        if not cache.add(FLUSH_LOCK_KEY, self.node, max(1, self.flush_interval - 1)):
+            return 0
+        top = [(keyword, round(score)) for keyword, score in self.merged_top() if score >= 1]
+        write_hot_searches(top)
+        return len(top)
+
+    def start(self):
+        """启动后台汇总线程"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='search-trends', daemon=True)
+            self._thread.start()
+            atexit.register(self._stopped.set)
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stopped.wait(AGGREGATE_INTERVAL):
+            self.aggregate()
+            if time.monotonic() < next_flush:
+                continue
+            next_flush = time.monotonic() + self.flush_interval
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('热门搜索写入失败')
+
+
+def write_hot_searches(top):
+    """批量写入热门搜索词的次数
+
+    只更新统计创建的搜索词，新搜索词以未启用状态创建；不在 top 中的统计搜索词
+    次数置零。与手工添加的搜索词重复的跳过。统计搜索词的新增和更新按 keyword
+    唯一约束合并为一条 upsert，冲突时只更新次数和更新时间，不改变启用状态。
+    """
+    counts = dict(top)
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(HotSearch.objects.filter(keyword__in=list(counts)).values_list('id', 'keyword', 'is_tracked'))
+        curated = {keyword for _, keyword, is_tracked in rows if not is_tracked}
+        tracked_ids = [row_id for row_id, _, is_tracked in rows if is_tracked]
+        HotSearch.objects.bulk_create(
+            [
+                HotSearch(keyword=keyword, count=count, is_active=False, is_tracked=True, updated_at=now)
+                for keyword, count in top
+                if keyword not in curated
+            ],
+            update_conflicts=True,
+            unique_fields=['keyword'],
+            update_fields=['count', 'updated_at'],
+        )
+        dropped = HotSearch.objects.filter(is_tracked=True, count__gt=0).exclude(keyword__in=list(counts))
+        dropped_ids = list(dropped.values_list('id', flat=True))
+        HotSearch.objects.filter(id__in=dropped_ids).update(count=0, updated_at=now)
+        # 批量操作不触发 post_save，热度变化需要单独通知搜索建议；新建的搜索词未启用，不在建议中
+        suggestions.mark_changed('keyword', tracked_ids + dropped_ids)
+
+trends = SearchTrends()
+
+
+def record(query):
+    """记录一次搜索"""
+    trends.record(query)
@@ -0,0 +1,144 @@
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Category, Video, VideoCategory, Comment, Actor, Director, Tag, HotSearch
+from .category_tree import invalidate_category_tree
+from .counters import counters_flushed
+from . import search_index
+from . import leaderboards
+from . import fragments
+from . import page_cache
+from . import facets
+from . import suggestions
+from cms.models import Slide
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, **kwargs):
+    """分类变更后使分类树缓存和页面缓存失效"""
+    invalidate_category_tree()
+    page_cache.purge('index', 'channel')
+
+
+@receiver(post_save, sender=Video)
+def video_saved(sender, instance, update_fields=None, **kwargs):
+    """视频保存后更新搜索索引和排行榜"""
+    if update_fields is None or search_index.INDEXED_FIELDS.intersection(update_fields):
+        search_index.index_video(instance)
+    if update_fields is None or leaderboards.RANKED_FIELDS.intersection(update_fields):
+        leaderboards.refresh_videos([instance.id])
+    if update_fields is None or facets.FACET_FIELDS.intersection(update_fields):
+        facets.mark_changed([instance.id])
+    if update_fields is None or {'title', 'is_active'}.intersection(update_fields):
+        suggestions.mark_changed('video', [instance.id])
+    fragments.invalidate_cards([instance.id])
+
+
+@receiver(post_delete, sender=Video)
+def video_deleted(sender, instance, **kwargs):
+    fragments.invalidate_cards([instance.id])
+    facets.mark_changed([instance.id])
+    suggestions.mark_changed('video', [instance.id])
+
+
+SUGGESTION_KINDS = {Actor: 'actor', Director: 'director', Tag: 'tag', HotSearch: 'keyword'}
+
+
+def suggestion_source_changed(sender, instance, **kwargs):
+    """演员、导演、标签和热门搜索词变更后更新搜索建议"""
+    suggestions.mark_changed(SUGGESTION_KINDS[sender], [instance.pk])
+
+
+for model in SUGGESTION_KINDS:
+    post_save.connect(suggestion_source_changed, sender=model)
+    post_delete.connect(suggestion_source_changed, sender=model)
+
+
+def video_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """标签、演员、导演关联变更后更新搜索索引"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        search_index.index_video(instance)
+    elif pk_set:
+        for video in Video.objects.filter(id__in=pk_set):
+            search_index.index_video(video)
+
+
+for relation in (Video.tags.through, Video.actors.through, Video.directors.through):
+    m2m_changed.connect(video_relations_changed, sender=relation)
+
+
+def video_facets_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """分类、标签关联变更后更新分面索引"""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            facets.mark_changed([instance.id])
+    elif action in ('post_add', 'post_remove') and pk_set:
+        facets.mark_changed(pk_set)
+    elif action == 'pre_clear':
+        facets.mark_changed(instance.videos.values_list('id', flat=True))
+
+
+for relation in (Video.tags.through, Video.categories.through):
+    m2m_changed.connect(video_facets_changed, sender=relation)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    """删除评论（包括级联删除的回复）后原子递减视频评论数"""
+    Video.objects.filter(pk=instance.video_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
+
+
+def video_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """视频分类关联变更后更新排行榜"""
+    if action in ('pre_remove', 'pre_clear'):
+        if reverse:
+            category_ids = [instance.id]
+        else:
+            category_ids = pk_set or list(instance.categories.values_list('id', flat=True))
+        leaderboards.invalidate(leaderboards.affected_scopes(category_ids))
+    elif action == 'post_add':
+        leaderboards.refresh_videos(pk_set if reverse else [instance.id])
+
+
+m2m_changed.connect(video_categories_changed, sender=Video.categories.through)
+
+
+@receiver(post_save, sender=VideoCategory)
+def video_category_saved(sender, instance, **kwargs):
+    leaderboards.refresh_videos([instance.video_id])
+    facets.mark_changed([instance.video_id])
+
+
+@receiver(post_delete, sender=VideoCategory)
+def video_category_deleted(sender, instance, **kwargs):
+    leaderboards.invalidate(leaderboards.affected_scopes([instance.category_id]))
+    facets.mark_changed([instance.video_id])
+
+
+@receiver(counters_flushed)
+def counters_flushed_handler(sender, changes, **kwargs):
+    """播放数落库后更新热门榜，并使卡片缓存失效以显示新计数"""
+    video_ids = changes.get(('files.Video', 'play_count'))
+    if video_ids:
+        leaderboards.refresh_videos(video_ids)
+    changed = set()
+    for (model_label, field), pks in changes.items():
+        if model_label == 'files.Video':
+            changed.update(pks)
+    if changed:
+        fragments.invalidate_cards(changed)
+
+
+@receiver([post_save, post_delete], sender=Slide)
+def slide_changed(sender, **kwargs):
+    """幻灯片变更后使首页和频道页缓存过期"""
+    page_cache.purge('index', 'channel')
+
+
+@receiver(leaderboards.board_changed)
+def leaderboard_changed(sender, kind, category_ids, **kwargs):
+    """榜单展示部分的成员变化后使首页和频道页缓存过期"""
+    page_cache.purge('index', 'channel')
@@ -0,0 +1,404 @@
+"""搜索建议
+
+视频标题、演员、导演、标签和热门搜索词构成一个进程内的前缀索引，输入框每次
+按键只查内存，不访问数据库：
+
+- 每个条目生成若干个检索键：规范化后的名称，中文名称另加全拼和首字母（需要
+  pypinyin，未安装时只有名称本身）
+- 检索键排序后存放在紧凑的列表中，前缀查询就是二分查找出一个连续区间；区间
+  不超过 SCAN_LIMIT 时直接在区间内取分数最高的条目，更大的区间（较短的前缀）
+  的结果在构建时预先算好
+- 条目分数为类型权重乘以 log(1 + 热度)，热度为视频播放数、演员/导演作品的总
+  播放数、标签的视频数、热门搜索次数
+
+构建结果保存为快照文件（SUGGESTION_SNAPSHOT_PATH），新进程直接加载快照，不必
+查库和排序；``build_suggestions`` 命令定期重建快照以更新热度，各进程发现快照
+更新后重新加载。条目新增、改名或删除时（见 signals.py）变更记入缓存中的变更
+日志，各进程把变更的条目放入一个小的增量索引，旧条目标记删除，不重建主索引。
+变更日志不完整或增量索引过大时，查询继续使用当前索引，由后台线程重建。
+"""
+from bisect import bisect_left, insort
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q, Sum
+from django.urls import reverse
+
+from .models import Video, Actor, Director, Tag, HotSearch
+
+logger = logging.getLogger(__name__)
+
+# 类型：(模型, 类型权重)
+KINDS = {
+    'keyword': (HotSearch, 1.2),
+    'video': (Video, 1.0),
+    'actor': (Actor, 0.8),
+    'director': (Director, 0.6),
+    'tag': (Tag, 0.5),
+}
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 20
+MAX_KEY_LENGTH = 64
+# 名称中从第2个词起最多为几个词生成检索键
+MAX_WORD_KEYS = 4
+# 前缀区间不超过该数量时直接扫描
+SCAN_LIMIT = 512
+# 预先计算的结果数，多于 MAX_LIMIT 以容纳被标记删除的条目
+PRECOMPUTED_SIZE = 40
+# 增量索引超过该数量时重建
+MAX_DELTA_ITEMS = 5000
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_CHECK_INTERVAL = 30
+# 两次读取缓存中版本号的最小间隔，查询路径上大多不访问缓存
+VERSION_CHECK_INTERVAL = 1
+
+VERSION_KEY = 'suggestions:version'
+CHANGE_KEY_TEMPLATE = 'suggestions:change:{seq}'
+CHANGE_TIMEOUT = 3600
+MAX_PENDING_CHANGES = 500
+# 变更日志不完整时只有抢到锁的进程在后台重建，其他进程等快照更新后加载
+REBUILD_LOCK_KEY = 'suggestions:rebuild_lock'
+REBUILD_LOCK_TIMEOUT = 600
+
+CJK_RE = re.compile(r'[一-鿿㐀-䶿]')
+KEY_END = '\U0010ffff'
+
+_pinyin = None
+
+
+def snapshot_path():
+    default_dir = getattr(settings, 'BASE_DIR', None) or tempfile.gettempdir()
+    return getattr(settings, 'SUGGESTION_SNAPSHOT_PATH', os.path.join(default_dir, 'suggestions.snapshot'))
+
+
+def normalize_key(text):
+    """检索键：全角转半角、转小写，只保留字母、数字和汉字"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return ''.join(ch for ch in text if ch.isalnum())[:MAX_KEY_LENGTH]
+
+
+def load_pinyin():
+    """pypinyin 的 lazy_pinyin，未安装时返回None"""
+    global _pinyin
+    if _pinyin is None:
+        try:
+            from pypinyin import lazy_pinyin
+            _pinyin = lazy_pinyin
+        except ImportError:
+            logger.info('未安装 pypinyin，搜索建议不支持拼音')
+            _pinyin = False
+    return _pinyin or None
+
+
+def item_keys(text):
+    """条目的检索键：名称本身和从其后各个词开始的部分，中文名称另加全拼和首字母"""
+    key = normalize_key(text)
+    if not key:
+        return set()
+    keys = {key}
+    words = text.split()
+    for i in range(1, min(len(words), MAX_WORD_KEYS)):
+        keys.add(normalize_key(' '.join(words[i:])))
+    lazy_pinyin = load_pinyin() if CJK_RE.search(text) else None
+    if lazy_pinyin:
+        syllables = [normalize_key(syllable) for syllable in lazy_pinyin(text)]
+        syllables = [syllable for syllable in syllables if syllable]
+        keys.add(''.join(syllables)[:MAX_KEY_LENGTH])
+        keys.add(''.join(syllable[0] for syllable in syllables)[:MAX_KEY_LENGTH])
+    keys.discard('')
+    return keys
+
+
+def score(kind, popularity):
+    return KINDS[kind][1] * math.log1p(max(popularity or 0, 0))
+
+
+def load_items(kind, ids=None):
+    """从数据库加载条目 [(类型, ID, 名称, 分数), ...]"""
+    if kind == 'video':
+        queryset = Video.objects.filter(is_active=True).values_list('id', 'title', 'play_count')
+    elif kind in ('actor', 'director'):
+        model = KINDS[kind][0]
+        queryset = model.objects.filter(status='active').annotate(
+            popularity=Sum('videos__play_count', filter=Q(videos__is_active=True))
+        ).values_list('id', 'name', 'popularity')
+    elif kind == 'tag':
+        queryset = Tag.objects.filter(is_active=True).annotate(
+            popularity=Count('videos', filter=Q(videos__is_active=True))
+        ).values_list('id', 'name', 'popularity')
+    else:
+        queryset = HotSearch.objects.filter(is_active=True).values_list('id', 'keyword', 'count')
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    return [(kind, pk, text, score(kind, popularity)) for pk, text, popularity in queryset.iterator() if text]
+
+
+class SuggestionIndex:
+    """前缀索引：排序的检索键 + 大区间的预计算结果 + 增量索引"""
+
+    def __init__(self, items, keys, key_items, precomputed, version, built_at):
+        self.items = items                  # [(类型, ID, 名称, 分数), ...]
+        self.keys = keys                    # 排序的检索键
+        self.key_items = key_items          # 与 keys 对应的条目下标
+        self.precomputed = precomputed      # 大区间前缀 -> 分数最高的条目下标
+        self.version = version
+        self.built_at = built_at
+        self.positions = {(item[0], item[1]): i for i, item in enumerate(items)}
+        self.removed = set()
+        self.delta_keys = []                # 排序的 (检索键, (类型, ID))
+        self.delta_items = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, items, version):
+        pairs = sorted((key, i) for i, item in enumerate(items) for key in item_keys(item[2]))
+        keys = [key for key, _ in pairs]
+        key_items = [i for _, i in pairs]
+        index = cls(items, keys, key_items, {}, version, time.time())
+        index.precomputed = index._precompute()
+        return index
+
+    def _range(self, prefix):
+        return bisect_left(self.keys, prefix), bisect_left(self.keys, prefix + KEY_END)
+
+    def _top(self, lo, hi, k):
+        """区间内分数最高的 k 个条目下标，同一条目只计一次"""
+        candidates = {i for i in self.key_items[lo:hi] if i not in self.removed}
+        return heapq.nlargest(k, candidates, key=lambda i: self.items[i][3])
+
+    def _precompute(self):
+        """为区间超过 SCAN_LIMIT 的所有前缀预先计算结果"""
+        precomputed = {}
+        stack = ['']
+        while stack:
+            prefix = stack.pop()
+            lo, hi = self._range(prefix)
+            if hi - lo <= SCAN_LIMIT:
+                continue
+            if prefix:
+                precomputed[prefix] = tuple(self._top(lo, hi, PRECOMPUTED_SIZE))
+            depth = len(prefix)
+            stack.extend(prefix + ch for ch in {key[depth] for key in self.keys[lo:hi] if len(key) > depth})
+        return precomputed
+
+    def lookup(self, query, limit=DEFAULT_LIMIT):
+        prefix = normalize_key(query)
+        if not prefix:
+            return []
+        with self.lock:
+            if prefix in self.precomputed:
+                positions = [i for i in self.precomputed[prefix] if i not in self.removed]
+            else:
+                # 多取一些，按名称去重后仍能凑满
+                positions = self._top(*self._range(prefix), limit * 2)
+            candidates = [self.items[i] for i in positions]
+            lo = bisect_left(self.delta_keys, (prefix,))
+            hi = bisect_left(self.delta_keys, (prefix + KEY_END,))
+            candidates.extend(self.delta_items[item_id] for _, item_id in self.delta_keys[lo:hi])
+
+        results = []
+        seen = set()
+        for item in sorted(candidates, key=lambda item: -item[3]):
+            text = normalize_key(item[2])
+            if (item[0], item[1]) in seen or text in seen:
+                continue
+            seen.update({(item[0], item[1]), text})
+            results.append(item)
+            if len(results) >= limit:
+                break
+        return results
+
+    def apply(self, changed, version):
+        """changed 为 {(类型, ID): 新条目或None}"""
+        with self.lock:
+            self.delta_keys = [entry for entry in self.delta_keys if entry[1] not in changed]
+            for item_id, item in changed.items():
+                self.delta_items.pop(item_id, None)
+                if item_id in self.positions:
+                    self.removed.add(self.positions[item_id])
+                if item is not None:
+                    self.delta_items[item_id] = item
+                    for key in item_keys(item[2]):
+                        insort(self.delta_keys, (key, item_id))
+            self.version = version
+
+    def save(self, path):
+        """写入快照文件"""
+        data = {
+            'format': SNAPSHOT_FORMAT,
+            'version': self.version,
+            'built_at': self.built_at,
+            'items': self.items,
+            'keys': self.keys,
+            'key_items': self.key_items,
+            'precomputed': self.precomputed,
+        }
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """读取快照文件，格式不符时返回None"""
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('format') != SNAPSHOT_FORMAT:
+            return None
+        return cls(data['items'], data['keys'], data['key_items'], data['precomputed'],
+                   data['version'], data['built_at'])
+
+
+def build(save=True):
+    """从数据库重建索引，默认同时写入快照"""
+    version = cache.get(VERSION_KEY, 0)
+    items = [item for kind in KINDS for item in load_items(kind)]
+    index = SuggestionIndex.build(items, version)
+    if save:
+        index.save(snapshot_path())
+    return index
+
+
+_local = {'index': None, 'snapshot_mtime': None, 'checked_at': 0, 'version_checked_at': 0, 'rebuild_thread': None}
+_build_lock = threading.Lock()
+
+
+def mark_changed(kind, ids):
+    """记录新增、改名或删除的条目，事务提交后生效"""
+    ids = list(ids)
+    if not ids:
+        return
+
+    def record():
+        cache.add(VERSION_KEY, 0, None)
+        try:
+            seq = cache.incr(VERSION_KEY)
+        except ValueError:
+            return
+        cache.set(CHANGE_KEY_TEMPLATE.format(seq=seq), (kind, ids), CHANGE_TIMEOUT)
+
+    transaction.on_commit(record)
+
+
+def _snapshot_mtime():
+    try:
+        return os.stat(snapshot_path()).st_mtime
+    except OSError:
+        return None
+
+
+def _load_or_build():
+    """优先加载快照，没有快照或快照无效时从数据库重建"""
+    mtime = _snapshot_mtime()
+    if mtime is not None:
+        try:
+            index = SuggestionIndex.load(snapshot_path())
+            if index is not None:
+                return index, mtime
+        except Exception:
+            logger.exception('搜索建议快照读取失败，从数据库重建')
+    index = build()
+    return index, _snapshot_mtime()
+
+
+def _catch_up(index, version):
+    """应用变更日志，日志不完整时返回False"""
+    if version - index.version > MAX_PENDING_CHANGES:
+        return False
+    keys = [CHANGE_KEY_TEMPLATE.format(seq=seq) for seq in range(index.version + 1, version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return False
+    ids_by_kind = {}
+    for kind, ids in changes.values():
+        ids_by_kind.setdefault(kind, set()).update(ids)
+    changed = {}
+    for kind, ids in ids_by_kind.items():
+        changed.update({(kind, pk): None for pk in ids})
+        changed.update({(item[0], item[1]): item for item in load_items(kind, ids)})
+    index.apply(changed, version)
+    return True
+
+
+def get_index():
+    """返回与快照和变更日志同步的索引"""
+    now = time.monotonic()
+    index = _local['index']
+    if index is not None and now - _local['version_checked_at'] < VERSION_CHECK_INTERVAL:
+        return index
+    version = cache.get(VERSION_KEY, 0)
+    _local['version_checked_at'] = now
+    if index is not None and index.version == version and now - _local['checked_at'] < SNAPSHOT_CHECK_INTERVAL:
+        return index
+
+    with _build_lock:
+        index = _local['index']
+        mtime = _snapshot_mtime()
+        _local['checked_at'] = now
+        if index is None or (mtime is not None and mtime != _local['snapshot_mtime']):
+            index, _local['snapshot_mtime'] = _load_or_build()
+            _local['index'] = index
+        if index.version > version:
+            # 缓存被清空，变更日志不可用
+            index.version = version
+        elif index.version < version:
+            if not _catch_up(index, version) or len(index.delta_items) > MAX_DELTA_ITEMS:
+                rebuild_in_background()
+        return index
+
+
+def rebuild_in_background():
+    """在后台线程重建索引和快照，重建完成前继续使用当前索引"""
+    thread = _local['rebuild_thread']
+    if thread is not None and thread.is_alive():
+        return
+    if not cache.add(REBUILD_LOCK_KEY, True, REBUILD_LOCK_TIMEOUT):
+        return
+
+    def run():
+        close_old_connections()
+        try:
+            index = build()
+            with _build_lock:
+                _local['index'] = index
+                _local['snapshot_mtime'] = _snapshot_mtime()
+        except Exception:
+            logger.exception('搜索建议索引重建失败')
+        finally:
+            cache.delete(REBUILD_LOCK_KEY)
+            close_old_connections()
+
+    thread = threading.Thread(target=run, name='suggestions-rebuild', daemon=True)
+    _local['rebuild_thread'] = thread
+    thread.start()
+
+
+def item_url(item):
+    kind, pk, text, _ = item
+    if kind == 'video':
+        return reverse('files:video_detail', args=[pk])
+    return f"{reverse('files:search')}?{urlencode({'q': text})}"
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    """搜索建议 [{'type', 'id', 'text', 'url'}, ...]"""
+    limit = max(1, min(limit, MAX_LIMIT))
+    return [
+        {'type': item[0], 'id': item[1], 'text': item[2], 'url': item_url(item)}
+        for item in get_index().lookup(query, limit)
+    ]
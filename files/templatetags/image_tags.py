@@ -0,0 +1,23 @@
+from django import template
+
+from files import image_derivatives
+
+register = template.Library()
+
+
+@register.simple_tag
+def image_src(obj, preset):
+    """衍生图片的默认地址"""
+    return image_derivatives.default_src(obj, preset)
+
+
+@register.simple_tag
+def image_srcset(obj, preset):
+    """衍生图片的 srcset 属性值"""
+    return image_derivatives.srcset(obj, preset)
+
+
+@register.simple_tag
+def image_sizes(preset):
+    """用途对应的 sizes 属性值"""
+    return image_derivatives.PRESET_SIZES[preset]
@@ -0,0 +1,17 @@
+from django import template
+
+from files import fragments
+
+register = template.Library()
+
+
+@register.simple_tag
+def video_cards(videos, template_name=fragments.CARD_TEMPLATE):
+    """渲染一组卡片，返回 HTML 片段列表，配合 as 使用"""
+    return fragments.render_cards(videos, template_name)
+
+
+@register.simple_tag
+def video_grid(videos, template_name=fragments.CARD_TEMPLATE):
+    """渲染视频网格中的全部卡片，整组按视频ID列表缓存"""
+    return fragments.render_grid(videos, template_name)
@@ -0,0 +1,91 @@
+"""卡片查询：列表页和详情页每页的查询数与卡片数无关"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from files import fragments, recommendations, views
+from files.models import Category, ImageResource, RelatedVideos, Tag, Video
+
+
+def render_cards(request, template_name, context):
+    """代替整页模板只渲染卡片，模板读取未加载的字段或关联时会产生额外查询"""
+    videos = context['recommended_videos'] if 'recommended_videos' in context else context['videos']
+    return HttpResponse(''.join(
+        html
+        for template in fragments.CARD_TEMPLATES
+        for html in fragments.render_cards(videos, template)
+    ))
+
+
+@override_settings(SEARCH_TRENDS_ENABLED=False, PAGE_CACHE_ENABLED=False)
+class CardQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='cards', password='x')
+        cls.channel = Category.objects.create(
+            name='电影', slug='movie', description='', is_root=True, show_in_menu=True,
+        )
+        cls.genre = Category.objects.create(
+            name='动作', slug='action', description='', parent=cls.channel, show_in_menu=True,
+        )
+        cls.tags = [Tag.objects.create(name=f'标签{i}', slug=f'tag-{i}') for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch.object(views, 'render', render_cards)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_videos(self, count):
+        videos = []
+        for _ in range(count):
+            video = Video.objects.create(title=f'卡片视频{Video.objects.count()}', created_by=self.user)
+            video.categories.add(self.channel, self.genre)
+            video.tags.add(*self.tags)
+            ImageResource.objects.create(video=video, url='https://img.example.com/a.jpg', is_main=True)
+            videos.append(video)
+        return videos
+
+    def assertPageQueries(self, num, url, cards):
+        """分类树、分面索引等进程级缓存预热后，清除卡片片段缓存再计数"""
+        self.client.get(url)
+        fragments.invalidate_cards(Video.objects.values_list('id', flat=True))
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode().count('class="card h-100"'), cards)
+
+    def assertListQueries(self, num, url):
+        self.add_videos(2)
+        self.assertPageQueries(num, url, 2)
+        self.add_videos(10)
+        self.assertPageQueries(num, url, 12)
+
+    def test_category_view(self):
+        self.assertListQueries(5, reverse('files:category_view', args=['action']))
+
+    def test_subcategory_list(self):
+        self.assertListQueries(6, reverse('files:subcategory', args=['movie', 'action']))
+
+    def test_search(self):
+        self.assertListQueries(6, reverse('files:search') + '?q=卡片')
+
+    def test_video_list(self):
+        self.assertListQueries(5, reverse('files:video_list'))
+
+    def test_video_detail_recommendations(self):
+        video, *others = self.add_videos(11)
+        related = RelatedVideos.objects.create(video=video)
+        url = reverse('files:video_detail', args=[video.id])
+        for count in (2, 10):
+            ids = [other.id for other in others[:count]]
+            related.data = recommendations.encode(ids, [1.0] * count)
+            related.save()
+            cache.delete(recommendations.cache_key(video.id))
+            self.assertPageQueries(5, url, count)
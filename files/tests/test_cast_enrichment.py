@@ -0,0 +1,100 @@
+"""演员、导演简介：占位、缓存复用、失败后重试"""
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from files import cast_enrichment
+from files.models import Actor, CastDescription, Director
+
+
+class FlakyGenerator:
+    """第一次生成失败，之后成功"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, name, role):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError('接口超时')
+        return f'{name}的简介'
+
+
+class RecordingEnricher:
+
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, name, role):
+        self.scheduled.append((name, role))
+
+
+class ProcessCastTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.enricher = RecordingEnricher()
+        patcher = mock.patch.object(cast_enrichment, 'get_enricher', return_value=self.enricher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self, names, role='actor'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return cast_enrichment.process_cast(names, role)
+
+    def test_new_people_get_placeholder_and_are_scheduled(self):
+        people = self.process('张三，李四，张三')
+        self.assertEqual([person.name for person in people], ['张三', '李四'])
+        self.assertEqual(people[0].description, '张三是一位知名演员。')
+        self.assertEqual(self.enricher.scheduled, [('张三', 'actor'), ('李四', 'actor')])
+
+    def test_placeholder_rescheduled_until_generated(self):
+        self.process('张三')
+        self.process('张三')
+        self.assertEqual(self.enricher.scheduled, [('张三', 'actor')] * 2)
+
+    def test_cached_description_replaces_placeholder(self):
+        self.process('张三')
+        CastDescription.objects.create(name='张三', role='actor', description='张三的简介')
+        [person] = self.process('张三')
+        self.assertEqual(person.description, '张三的简介')
+        self.assertEqual(Actor.objects.get(name='张三').description, '张三的简介')
+        self.assertEqual(len(self.enricher.scheduled), 1)
+
+    def test_edited_description_kept(self):
+        Director.objects.create(name='王五', description='手工编辑的简介')
+        [person] = self.process('王五', 'director')
+        self.assertEqual(person.description, '手工编辑的简介')
+        self.assertEqual(self.enricher.scheduled, [])
+
+    def test_retry_placeholders(self):
+        self.process('张三')
+        Actor.objects.create(name='李四', description='已有简介')
+        self.enricher.scheduled.clear()
+        cast_enrichment.retry_placeholders()
+        self.assertEqual(self.enricher.scheduled, [('张三', 'actor')])
+
+
+class EnrichTests(TestCase):
+
+    def setUp(self):
+        # 在测试线程中直接调用 _enrich，不能关闭测试事务所在的连接
+        patcher = mock.patch.object(cast_enrichment, 'close_old_connections', lambda: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_generation_retried(self):
+        generator = FlakyGenerator()
+        enricher = cast_enrichment.CastEnricher(generator=generator, concurrency=1)
+        self.addCleanup(enricher.executor.shutdown)
+        Actor.objects.create(name='张三', description=cast_enrichment.placeholder_description('张三', 'actor'))
+
+        self.assertIsNone(enricher._enrich('张三', 'actor'))
+        self.assertTrue(cast_enrichment.with_placeholder('actor').filter(name='张三').exists())
+        self.assertFalse(CastDescription.objects.exists())
+
+        self.assertEqual(enricher._enrich('张三', 'actor'), '张三的简介')
+        self.assertEqual(Actor.objects.get(name='张三').description, '张三的简介')
+        self.assertFalse(cast_enrichment.with_placeholder('actor').exists())
@@ -0,0 +1,94 @@
+"""频道页、发现页数据：查询数与幻灯片数、视频数无关"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+
+from cms.models import Slide
+
+from files import channel_data, leaderboards
+from files.category_tree import get_category_tree
+from files.models import Category, Video
+
+
+class ChannelDataQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='channel', password='x')
+        cls.channel = Category.objects.create(
+            name='电影', slug='movie', description='', is_root=True, show_in_menu=True,
+        )
+        cls.discover = Category.objects.create(
+            name='发现', slug='discover', description='', is_root=True, show_in_menu=True,
+        )
+        cls.genres = [
+            Category.objects.create(name=f'类型{i}', slug=f'genre-{i}', description='', parent=cls.channel)
+            for i in range(2)
+        ]
+        cls.topics = [
+            Category.objects.create(name=f'专题{i}', slug=f'topic-{i}', description='', parent=cls.discover)
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def add_videos(self, count, position):
+        for i in range(count):
+            video = Video.objects.create(title=f'频道视频{Video.objects.count()}', created_by=self.user)
+            video.categories.add(self.genres[i % 2], self.topics[i % 2])
+            if channel_data.slide_has_video():
+                Slide.objects.create(position=position, order=i, video=video)
+            else:
+                Slide.objects.create(position=position, order=i)
+        # 视频变化后重新构建的分类树和榜单属于缓存，不计入每页的查询
+        cache.clear()
+
+    def warm(self, *scopes):
+        get_category_tree()
+        for kind, category in scopes:
+            leaderboards.get_board(kind, category.id if category is not None else None)
+
+    def load_channel(self):
+        page = channel_data.load_channel_page(self.channel)
+        if channel_data.slide_has_video():
+            # 读取幻灯片关联的视频，不应逐条查询
+            for slide in page.slides:
+                slide.video.title
+        return page
+
+    def test_channel_page(self):
+        for count in (2, 8):
+            self.add_videos(count, 'movie')
+            self.warm((leaderboards.LATEST, self.channel), (leaderboards.HOT, self.channel))
+            # 幻灯片一次，视频卡片一次加三次预取
+            with self.assertNumQueries(5):
+                page = self.load_channel()
+            self.assertEqual(len(page.slides), Slide.objects.filter(position='movie').count())
+            self.assertEqual(len(page.latest_videos), min(Video.objects.count(), 12))
+            self.assertEqual([sub.id for sub in page.subcategories], [genre.id for genre in self.genres])
+
+    def test_channel_page_falls_back_to_home_slides(self):
+        for count in (2, 8):
+            self.add_videos(count, 'home')
+            self.warm((leaderboards.LATEST, self.channel), (leaderboards.HOT, self.channel))
+            with self.assertNumQueries(5):
+                page = self.load_channel()
+            self.assertEqual(len(page.slides), Slide.objects.filter(position='home').count())
+
+    def test_discover_page(self):
+        for count in (2, 8):
+            self.add_videos(count, 'discover')
+            self.warm((leaderboards.HOT, self.topics[0]))
+            with self.assertNumQueries(5):
+                page = channel_data.load_discover_page(self.discover, 'topic-0')
+            self.assertEqual(page.selected_subcategory.id, self.topics[0].id)
+            self.assertEqual(len(page.hot_videos), Video.objects.filter(categories=self.topics[0]).count())
+            self.assertEqual(len(page.subcategories), 2)
+
+    def test_cold_boards_cost_one_query_each(self):
+        self.add_videos(4, 'movie')
+        get_category_tree()
+        with self.assertNumQueries(7):
+            self.load_channel()
@@ -0,0 +1,44 @@
+"""弹幕写入管道与分段截止点"""
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from files import danmaku_segments
+from files.danmaku_ingest import DanmakuIngestor
+from files.models import Danmaku, Video
+
+
+class CurrentUntilTests(SimpleTestCase):
+
+    def test_boundary_closes_after_delay(self):
+        boundary = 1_700_000_100 - 1_700_000_100 % danmaku_segments.CLOSE_INTERVAL
+        previous = boundary - danmaku_segments.CLOSE_INTERVAL
+        self.assertEqual(danmaku_segments.current_until(boundary), previous)
+        self.assertEqual(danmaku_segments.current_until(boundary + danmaku_segments.CLOSE_DELAY - 1), previous)
+        self.assertEqual(danmaku_segments.current_until(boundary + danmaku_segments.CLOSE_DELAY), boundary)
+        self.assertFalse(danmaku_segments.is_valid_until(boundary, boundary + 1))
+
+
+class IngestTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = get_user_model().objects.create(username='viewer')
+        self.video = Video.objects.create(title='弹幕测试', created_by=self.user)
+        self.ingestor = DanmakuIngestor(batch_wait=0.01)
+        self.ingestor.start = lambda: None
+
+    def test_created_at_set_when_written(self):
+        queued_at = timezone.now()
+        self.ingestor.submit(self.video.id, self.user.id, {'text': '前排', 'time': 1})
+        written_at = queued_at + timedelta(seconds=5)
+        with mock.patch('files.danmaku_ingest.timezone.now', return_value=written_at):
+            self.ingestor.write(self.ingestor.drain(block=False))
+        self.assertEqual(Danmaku.objects.get().created_at, written_at)
+        [item] = self.ingestor.ring.recent(self.video.id)
+        self.assertEqual(item['created_at'], written_at.timestamp())
@@ -0,0 +1,50 @@
+"""卡片和视频网格的片段缓存"""
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from files import fragments
+from files.models import Video
+
+
+class GridCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        now = timezone.now()
+        self.videos = [
+            Video(id=i, title=f'网格视频{i}', thumbnail=f'https://example.com/{i}.jpg',
+                  created_at=now, updated_at=now)
+            for i in range(1, 4)
+        ]
+
+    def render(self, videos):
+        with mock.patch.object(fragments, 'render_to_string', wraps=render_to_string) as rendered:
+            html = render_to_string(fragments.GRID_TEMPLATE, {'videos': videos})
+        return html, rendered.call_count
+
+    def test_grid_hit_skips_cards(self):
+        html, rendered = self.render(self.videos)
+        self.assertEqual(rendered, 3)
+        with mock.patch.object(fragments, 'render_cards') as render_cards:
+            self.assertEqual(self.render(self.videos)[0], html)
+        render_cards.assert_not_called()
+
+    def test_new_order_reuses_cards(self):
+        self.render(self.videos)
+        html, rendered = self.render(list(reversed(self.videos)))
+        self.assertEqual(rendered, 0)
+        self.assertLess(html.index('网格视频3'), html.index('网格视频1'))
+
+    def test_updated_video_rerendered(self):
+        self.render(self.videos)
+        self.videos[1].title = '新标题'
+        self.videos[1].updated_at += timedelta(seconds=1)
+        html, rendered = self.render(self.videos)
+        self.assertEqual(rendered, 1)
+        self.assertIn('新标题', html)
@@ -0,0 +1,172 @@
+"""剧集 HLS 本地缓存：文件命名、下载、刷新复用，远端由本地 HTTP 服务代替"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import shutil
+import tempfile
+import threading
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from files import hls_cache
+from files.models import SeriesVideo, Video
+
+
+class LocalNameTests(SimpleTestCase):
+
+    def test_signature_ignored(self):
+        self.assertEqual(
+            hls_cache.local_name('https://cdn.example.com/a/seg1.ts?sign=abc&expires=100'),
+            hls_cache.local_name('https://cdn.example.com/a/seg1.ts?expires=200&sign=def'),
+        )
+
+    def test_s3_presigned_params_ignored(self):
+        self.assertEqual(
+            hls_cache.local_name('https://s3.example.com/seg1.ts?X-Amz-Signature=a&X-Amz-Date=1'),
+            hls_cache.local_name('https://s3.example.com/seg1.ts?X-Amz-Signature=b&X-Amz-Date=2'),
+        )
+
+    def test_other_params_kept(self):
+        names = {
+            hls_cache.local_name('https://cdn.example.com/seg.php?n=1&token=a'),
+            hls_cache.local_name('https://cdn.example.com/seg.php?n=2&token=a'),
+            hls_cache.local_name('https://cdn.example.com/seg.php?token=b&n=1'),
+        }
+        self.assertEqual(len(names), 2)
+
+    def test_extension_kept(self):
+        self.assertTrue(hls_cache.local_name('https://cdn.example.com/k/key.bin?n=1').endswith('.bin'))
+        self.assertTrue(hls_cache.local_name('https://cdn.example.com/seg.php?n=1').endswith('.php'))
+
+    @override_settings(HLS_CACHE_VOLATILE_PARAMS=['t'])
+    def test_volatile_params_configurable(self):
+        self.assertEqual(
+            hls_cache.local_name('https://cdn.example.com/seg1.ts?t=1'),
+            hls_cache.local_name('https://cdn.example.com/seg1.ts?t=2'),
+        )
+        self.assertNotEqual(
+            hls_cache.local_name('https://cdn.example.com/seg1.ts?sign=a'),
+            hls_cache.local_name('https://cdn.example.com/seg1.ts?sign=b'),
+        )
+
+
+class FakeOrigin:
+    """本地 HTTP 服务，按路径返回内容并记录请求"""
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                origin.requests.append(self.path)
+                body = origin.files.get(urlsplit(self.path).path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetched(self, path):
+        return sum(1 for request in self.requests if urlsplit(request).path == path)
+
+
+def media_playlist(sign, segments):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:10', f'#EXT-X-KEY:METHOD=AES-128,URI="/k/key.bin?sign={sign}"']
+    for segment in segments:
+        separator = '&' if '?' in segment else '?'
+        lines += ['#EXTINF:10.0,', f'{segment}{separator}sign={sign}']
+    return '\n'.join(lines).encode()
+
+
+class CacheSeriesTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media_root, MEDIA_URL='/media/')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.origin = FakeOrigin()
+        self.addCleanup(self.origin.close)
+        self.origin.files.update({
+            '/master.m3u8': (
+                b'#EXTM3U\n'
+                b'#EXT-X-STREAM-INF:BANDWIDTH=800000\nlow/index.m3u8\n'
+                b'#EXT-X-STREAM-INF:BANDWIDTH=2400000\nhigh/index.m3u8\n'
+            ),
+            '/high/index.m3u8': media_playlist('a', ['s1.ts', 's2.ts']),
+            '/high/s1.ts': b'segment-1',
+            '/high/s2.ts': b'segment-2',
+            '/high/s3.ts': b'segment-3',
+            '/k/key.bin': b'0123456789abcdef',
+        })
+
+        user = get_user_model().objects.create_user(username='hls', password='x')
+        video = Video.objects.create(title='剧集', created_by=user)
+        self.series = SeriesVideo.objects.create(
+            video=video, series_title='剧集', episode_number=1, total_episodes=1,
+            update_status='ongoing', m3u8_url=f'{self.origin.url}/master.m3u8?sign=a',
+        )
+
+    def test_cache_and_rewrite(self):
+        size = hls_cache.cache_series(self.series, concurrency=2)
+
+        playlist = hls_cache.playlist_for(self.series)
+        self.assertNotIn(self.origin.url, playlist)
+        self.assertIn(f'URI="/media/media_files/{self.series.id}/', playlist)
+        # 只下载码率最高的子播放列表
+        self.assertEqual(self.origin.fetched('/low/index.m3u8'), 0)
+        directory = hls_cache.series_dir(self.series.id)
+        self.assertEqual(len(os.listdir(directory)), 4)
+        self.assertEqual(size, hls_cache.directory_size(directory))
+
+        self.series.refresh_from_db()
+        self.assertTrue(self.series.is_downloaded)
+        self.assertEqual(self.series.cache_size, size)
+
+    def test_refresh_reuses_files_across_signatures(self):
+        hls_cache.cache_series(self.series)
+        self.origin.files['/high/index.m3u8'] = media_playlist('b', ['s2.ts', 's3.ts'])
+        self.series.m3u8_url = f'{self.origin.url}/master.m3u8?sign=b'
+        hls_cache.cache_series(self.series)
+
+        self.assertEqual(self.origin.fetched('/high/s2.ts'), 1)
+        self.assertEqual(self.origin.fetched('/k/key.bin'), 1)
+        self.assertEqual(self.origin.fetched('/high/s3.ts'), 1)
+        # 新播放列表不再引用的分片被删除
+        names = set(os.listdir(hls_cache.series_dir(self.series.id)))
+        self.assertNotIn(hls_cache.local_name(f'{self.origin.url}/high/s1.ts'), names)
+        self.assertIn(hls_cache.local_name(f'{self.origin.url}/high/s3.ts'), names)
+
+    def test_segments_distinguished_by_query(self):
+        self.origin.files['/high/index.m3u8'] = media_playlist('a', ['seg.php?n=1', 'seg.php?n=2'])
+        self.origin.files['/high/seg.php'] = b'segment'
+        hls_cache.cache_series(self.series)
+        self.assertEqual(self.origin.fetched('/high/seg.php'), 2)
+        self.assertEqual(len(os.listdir(hls_cache.series_dir(self.series.id))), 4)
+
+    def test_missing_segment_fails(self):
+        del self.origin.files['/high/s2.ts']
+        with self.assertRaises(hls_cache.HLSCacheError):
+            hls_cache.cache_series(self.series)
+        self.series.refresh_from_db()
+        self.assertFalse(self.series.is_downloaded)
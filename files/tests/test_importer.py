@@ -0,0 +1,164 @@
+"""第三方导入：对本地的苹果CMS格式假来源分页导入、断点续传"""
+import asyncio
+import socket
+from unittest import mock, skipUnless
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from files import importer
+from files.models import ThirdPartySource, Video, VideoMedia
+
+PAGE_COUNT = 3
+PER_PAGE = 2
+
+
+def vod(page, index):
+    vod_id = page * 100 + index
+    return {
+        'vod_id': vod_id,
+        'vod_name': f'视频{vod_id}',
+        'vod_play_from': 'm3u8$$$mp4',
+        'vod_play_url': f'第1集$http://cdn.test/{vod_id}/1.m3u8#第2集$http://cdn.test/{vod_id}/2.m3u8'
+                        f'$$$正片$http://cdn.test/{vod_id}.mp4',
+    }
+
+
+class FakeSource:
+    """本地假来源，记录每次请求的参数"""
+
+    def __init__(self):
+        self.requests = []
+        self.failing = set()
+
+    async def handle(self, request):
+        page = int(request.query['pg'])
+        self.requests.append(dict(request.query))
+        if page in self.failing:
+            return web.Response(status=503)
+        return web.json_response({
+            'code': 1,
+            'page': page,
+            'pagecount': PAGE_COUNT,
+            'list': [vod(page, index) for index in range(PER_PAGE)],
+        })
+
+    def pages(self):
+        return sorted(int(query['pg']) for query in self.requests)
+
+
+@skipUnless(web, '未安装 aiohttp')
+class ImporterTests(TransactionTestCase):
+    """写入在导入器自己的数据库线程中提交，不能放在测试事务中"""
+
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        get_user_model().objects.create(id=1, username='importer')
+        self.fake = FakeSource()
+        self.port = self.free_port()
+        self.source = ThirdPartySource.objects.create(
+            name='假来源', base_url=f'http://127.0.0.1:{self.port}/api.php/provide/vod/',
+            api_key='secret', extra_info={},
+        )
+        for name, value in [('RETRY_BACKOFF', 0), ('BATCH_WAIT', 0.01)]:
+            patcher = mock.patch.object(importer, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def free_port(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def run_import(self, **options):
+        async def main():
+            app = web.Application()
+            app.router.add_get('/api.php/provide/vod/', self.fake.handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', self.port).start()
+            try:
+                job = importer.Importer(self.source, concurrency=2, batch_size=3, **options)
+                result = await job.run()
+                return result, sorted(job.failed_pages)
+            finally:
+                await runner.cleanup()
+
+        return asyncio.run(main())
+
+    def checkpoint(self):
+        self.source.refresh_from_db()
+        return self.source.extra_info.get(importer.CHECKPOINT_KEY)
+
+    def test_full_import(self):
+        (videos, media), failed = self.run_import()
+        self.assertEqual((videos, media, failed), (6, 18, []))
+        self.assertEqual(self.fake.pages(), [1, 2, 3])
+        self.assertEqual(self.fake.requests[0]['ac'], 'detail')
+        self.assertEqual(self.fake.requests[0]['api_key'], 'secret')
+
+        video = Video.objects.get(third_party_id=f'{self.source.id}:101')
+        self.assertEqual(video.title, '视频101')
+        self.assertEqual(video.video_type, 'series')
+        self.assertEqual(sorted(video.media_files.values_list('source_index', 'episode_index')),
+                         [(0, 0), (0, 1), (1, 0)])
+        self.assertIsNone(self.checkpoint())
+        self.assertIn('last_import_at', self.source.extra_info)
+
+    def test_reimport_updates_in_place(self):
+        self.run_import()
+        self.run_import()
+        self.assertEqual(Video.objects.count(), 6)
+        self.assertEqual(VideoMedia.objects.count(), 18)
+
+    def test_failed_page_resumed_from_checkpoint(self):
+        self.fake.failing.add(2)
+        _, failed = self.run_import()
+        self.assertEqual(failed, [2])
+        checkpoint = self.checkpoint()
+        self.assertEqual((checkpoint['next_page'], checkpoint['done_pages']), (2, [3]))
+
+        self.fake.failing.clear()
+        self.fake.requests.clear()
+        (videos, _), failed = self.run_import()
+        # 只请求上次失败的页
+        self.assertEqual((self.fake.pages(), videos, failed), ([2], 2, []))
+        self.assertIsNone(self.checkpoint())
+        self.assertEqual(Video.objects.count(), 6)
+
+    def test_checkpoint_ignored_when_params_change(self):
+        self.fake.failing.add(2)
+        self.run_import()
+        self.fake.failing.clear()
+        self.fake.requests.clear()
+
+        self.run_import(extra_params={'h': 24})
+        self.assertEqual(self.fake.pages(), [1, 2, 3])
+        self.assertTrue(all(query['h'] == '24' for query in self.fake.requests))
+
+    def test_checkpoint_kept_for_same_params(self):
+        self.fake.failing.add(2)
+        self.run_import(extra_params={'h': 24})
+        self.assertEqual(self.checkpoint()['params'], {'h': 24})
+        self.fake.failing.clear()
+        self.fake.requests.clear()
+
+        self.run_import(extra_params={'h': 24})
+        self.assertEqual(self.fake.pages(), [2])
+
+    def test_restart_ignores_checkpoint(self):
+        self.fake.failing.add(2)
+        self.run_import()
+        self.fake.failing.clear()
+        self.fake.requests.clear()
+
+        self.run_import(restart=True)
+        self.assertEqual(self.fake.pages(), [1, 2, 3])
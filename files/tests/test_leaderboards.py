@@ -0,0 +1,63 @@
+"""排行榜增量更新"""
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from files import leaderboards
+
+
+class MergeIntoBoardTests(SimpleTestCase):
+
+    key = 'leaderboard:test'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def set_board(self, scores):
+        """scores 为 {视频ID: 得分}"""
+        board = sorted(([score, video_id] for video_id, score in scores.items()), reverse=True)
+        cache.set(self.key, board)
+
+    def board_ids(self):
+        return [video_id for _, video_id in cache.get(self.key)]
+
+    def test_rise_into_display(self):
+        with mock.patch.multiple(leaderboards, BOARD_SIZE=4, DISPLAY_SIZE=2):
+            self.set_board({1: 40, 2: 30, 3: 20, 4: 10})
+            self.assertTrue(leaderboards.merge_into_board(self.key, 4, 35))
+        self.assertEqual(self.board_ids(), [1, 4, 2, 3])
+
+    def test_reorder_within_display_not_reported(self):
+        with mock.patch.multiple(leaderboards, BOARD_SIZE=4, DISPLAY_SIZE=2):
+            self.set_board({1: 40, 2: 30, 3: 20, 4: 10})
+            self.assertFalse(leaderboards.merge_into_board(self.key, 2, 50))
+        self.assertEqual(self.board_ids(), [2, 1, 3, 4])
+
+    def test_outsider_below_tail_ignored(self):
+        with mock.patch.multiple(leaderboards, BOARD_SIZE=4, DISPLAY_SIZE=2):
+            self.set_board({1: 40, 2: 30, 3: 20, 4: 10})
+            self.assertFalse(leaderboards.merge_into_board(self.key, 5, 5))
+        self.assertEqual(self.board_ids(), [1, 2, 3, 4])
+
+    def test_member_falling_below_tail_invalidates(self):
+        with mock.patch.multiple(leaderboards, BOARD_SIZE=4, DISPLAY_SIZE=2):
+            self.set_board({1: 40, 2: 30, 3: 20, 4: 10})
+            self.assertTrue(leaderboards.merge_into_board(self.key, 1, 5))
+        self.assertIsNone(cache.get(self.key))
+
+    def test_member_decrease_in_partial_board(self):
+        with mock.patch.multiple(leaderboards, BOARD_SIZE=4, DISPLAY_SIZE=2):
+            self.set_board({1: 40, 2: 30, 3: 20})
+            self.assertTrue(leaderboards.merge_into_board(self.key, 1, 5))
+        self.assertEqual(self.board_ids(), [2, 3, 1])
+
+    def test_contended_lock_invalidates(self):
+        key = leaderboards.board_key(leaderboards.HOT)
+        cache.set(key, [[1, 1]])
+        cache.add(leaderboards.lock_key(key), True)
+        with mock.patch.object(leaderboards.board_changed, 'send') as send:
+            leaderboards.update_board(leaderboards.HOT, None, 2, 5)
+        self.assertIsNone(cache.get(key))
+        send.assert_called_once()
@@ -0,0 +1,172 @@
+"""媒体元数据读取：MP4 box 偏移、MPEG-TS 首尾 PTS、H.264 SPS 宽高"""
+import os
+import struct
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from files import media_probe
+
+
+def box(kind, *children):
+    body = b''.join(children)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def mvhd(timescale, duration, version=0):
+    if version == 1:
+        body = struct.pack('>B3xQQIQ', 1, 0, 0, timescale, duration)
+    else:
+        body = struct.pack('>B3xIIII', 0, 0, 0, timescale, duration)
+    return box(b'mvhd', body + b'\x00' * 80)
+
+
+def tkhd(width, height, version=0):
+    # 宽高为 16.16 定点数，v0 位于内容偏移 76，v1 位于 88
+    prefix = b'\x00' * (88 if version == 1 else 76)
+    prefix = bytes([version]) + prefix[1:]
+    return box(b'tkhd', prefix + struct.pack('>II', width << 16, height << 16))
+
+
+def trak(handler, width, height, version=0):
+    hdlr = box(b'hdlr', b'\x00' * 8 + handler + b'\x00' * 12)
+    return box(b'trak', tkhd(width, height, version), box(b'mdia', hdlr))
+
+
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+
+    def u(self, count, value):
+        self.bits.extend((value >> (count - 1 - i)) & 1 for i in range(count))
+
+    def ue(self, value):
+        value += 1
+        length = value.bit_length()
+        self.u(length - 1, 0)
+        self.u(length, value)
+
+    def bytes(self):
+        bits = self.bits + [1]  # rbsp_stop_one_bit
+        bits += [0] * (-len(bits) % 8)
+        return bytes(int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+
+
+def sps(width_mbs, height_map_units, crop_bottom=0, profile_idc=66):
+    writer = BitWriter()
+    writer.u(8, profile_idc)
+    writer.u(16, 0x001F)  # constraint flags, level_idc
+    writer.ue(0)  # seq_parameter_set_id
+    if profile_idc == 100:
+        writer.ue(1)  # chroma_format_idc
+        writer.ue(0)
+        writer.ue(0)
+        writer.u(1, 0)
+        writer.u(1, 0)  # seq_scaling_matrix_present_flag
+    writer.ue(0)  # log2_max_frame_num_minus4
+    writer.ue(0)  # pic_order_cnt_type
+    writer.ue(0)  # log2_max_pic_order_cnt_lsb_minus4
+    writer.ue(1)  # max_num_ref_frames
+    writer.u(1, 0)
+    writer.ue(width_mbs - 1)
+    writer.ue(height_map_units - 1)
+    writer.u(1, 1)  # frame_mbs_only_flag
+    writer.u(1, 1)  # direct_8x8_inference_flag
+    writer.u(1, 1 if crop_bottom else 0)
+    if crop_bottom:
+        for value in (0, 0, 0, crop_bottom):
+            writer.ue(value)
+    writer.u(1, 0)  # vui_parameters_present_flag
+    return b'\x67' + writer.bytes()
+
+
+def encode_pts(pts):
+    return bytes([
+        0x21 | ((pts >> 29) & 0x0E),
+        (pts >> 22) & 0xFF,
+        ((pts >> 14) & 0xFE) | 1,
+        (pts >> 7) & 0xFF,
+        ((pts << 1) & 0xFE) | 1,
+    ])
+
+
+def ts_packet(pid, payload=b'', unit_start=False):
+    header = bytes([0x47, (0x40 if unit_start else 0) | (pid >> 8), pid & 0xFF, 0x10])
+    return header + payload.ljust(184, b'\xff')[:184]
+
+
+def pes(pts, es=b''):
+    return b'\x00\x00\x01\xe0\x00\x00\x80\x80\x05' + encode_pts(pts) + es
+
+
+class ProbeTestCase(SimpleTestCase):
+
+    def probe(self, data):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(data)
+        self.addCleanup(os.remove, f.name)
+        return media_probe.probe_file(f.name)
+
+
+class MP4Tests(ProbeTestCase):
+
+    def test_moov_after_mdat(self):
+        data = (
+            box(b'ftyp', b'isom\x00\x00\x02\x00')
+            + box(b'mdat', b'\x00' * 5000)
+            + box(b'moov', mvhd(1000, 93500), trak(b'soun', 0, 0), trak(b'vide', 1280, 720))
+        )
+        result = self.probe(data)
+        self.assertEqual((result.format, result.duration, result.width, result.height), ('mp4', 94, 1280, 720))
+        self.assertEqual(result.file_size, len(data))
+
+    def test_version_1_headers(self):
+        data = box(b'ftyp', b'isom') + box(b'moov', mvhd(600, 600 * 3600, version=1), trak(b'vide', 1920, 1080, version=1))
+        result = self.probe(data)
+        self.assertEqual((result.duration, result.width, result.height), (3600, 1920, 1080))
+
+    def test_missing_moov(self):
+        with self.assertRaises(media_probe.ProbeError):
+            self.probe(box(b'ftyp', b'isom') + box(b'mdat', b'\x00' * 100))
+
+
+class SPSTests(SimpleTestCase):
+
+    def test_cropped_1080p(self):
+        es = b'\x00\x00\x00\x01' + sps(120, 68, crop_bottom=4) + b'\x00\x00\x01\x68\xce'
+        self.assertEqual(media_probe.find_h264_dimensions(es), (1920, 1080))
+
+    def test_high_profile(self):
+        es = b'\x00\x00\x01' + sps(80, 45, profile_idc=100)
+        self.assertEqual(media_probe.find_h264_dimensions(es), (1280, 720))
+
+    def test_no_sps(self):
+        self.assertEqual(media_probe.find_h264_dimensions(b'\x00\x00\x01\x65' + b'\x88' * 20), (0, 0))
+
+
+class TSTests(ProbeTestCase):
+
+    def build(self, first_pts, last_pts, filler_packets):
+        es = b'\x00\x00\x00\x01' + sps(40, 23, crop_bottom=4)  # 640x360
+        packets = [ts_packet(0, b'\x00', unit_start=True)]  # PAT 之类的非视频包
+        packets.append(ts_packet(0x100, pes(first_pts, es), unit_start=True))
+        packets += [ts_packet(0x100, b'\x00' * 184)] * filler_packets
+        packets.append(ts_packet(0x100, pes(last_pts), unit_start=True))
+        packets.append(ts_packet(0x101, pes(last_pts + 90000 * 50), unit_start=True))  # 其他 PID 不计入
+        return b''.join(packets)
+
+    def test_duration_from_head_and_tail_pts(self):
+        with mock.patch.object(media_probe, 'TS_SCAN_BYTES', 188 * 20):
+            result = self.probe(self.build(90000, 90000 + 90000 * 125, filler_packets=100))
+        self.assertEqual((result.format, result.duration, result.width, result.height), ('ts', 125, 640, 360))
+
+    def test_pts_wraparound(self):
+        # 首个 PTS 在回绕前10秒，末尾 PTS 在回绕后10秒
+        result = self.probe(self.build((1 << 33) - 90000 * 10, 90000 * 10, filler_packets=3))
+        self.assertEqual(result.duration, 20)
+
+    def test_without_video_stream(self):
+        data = b''.join(ts_packet(0x100, b'\x00' * 184, unit_start=True) for _ in range(5))
+        with self.assertRaises(media_probe.ProbeError):
+            self.probe(data)
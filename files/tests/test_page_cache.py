@@ -0,0 +1,108 @@
+"""匿名整页缓存：新鲜、过期后台刷新、软清除、登录用户绕过"""
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from files import page_cache
+
+
+class SyncExecutor:
+    """同步执行后台刷新，便于断言"""
+
+    def submit(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+class PageCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch.object(page_cache, '_executor', SyncExecutor())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+        self.calls = 0
+
+    def make_view(self, **options):
+        @page_cache.anonymous_page_cache('test', vary_on=('page',), **options)
+        def view(request):
+            self.calls += 1
+            return HttpResponse(f'render {self.calls}')
+        return view
+
+    def get(self, view, path='/', user=None, **params):
+        request = self.factory.get(path, params)
+        request.user = user or AnonymousUser()
+        return view(request)
+
+    def test_fresh_hit(self):
+        view = self.make_view(fresh=60, stale=60)
+        first = self.get(view)
+        second = self.get(view)
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(second.content, b'render 1')
+        self.assertEqual(self.calls, 1)
+
+    def test_vary_on_only_listed_params(self):
+        view = self.make_view(fresh=60, stale=60)
+        self.get(view, page='1')
+        self.assertEqual(self.get(view, page='1', utm_source='x')['X-Page-Cache'], 'hit')
+        self.assertEqual(self.get(view, page='2')['X-Page-Cache'], 'miss')
+        self.assertEqual(self.calls, 2)
+
+    def test_stale_served_then_refreshed(self):
+        view = self.make_view(fresh=60, stale=600)
+        self.get(view)
+        with mock.patch.object(page_cache.time, 'time', return_value=page_cache.time.time() + 120):
+            stale = self.get(view)
+            self.assertEqual(stale['X-Page-Cache'], 'stale')
+            self.assertEqual(stale.content, b'render 1')
+            # 后台刷新已写入新页面
+            self.assertEqual(self.calls, 2)
+            fresh = self.get(view)
+        self.assertEqual(fresh['X-Page-Cache'], 'hit')
+        self.assertEqual(fresh.content, b'render 2')
+
+    def test_purge_marks_stale(self):
+        view = self.make_view(fresh=60, stale=600)
+        self.get(view)
+        with mock.patch.object(page_cache.time, 'time', return_value=page_cache.time.time() + 1):
+            page_cache.purge('test')
+        with mock.patch.object(page_cache.time, 'time', return_value=page_cache.time.time() + 2):
+            self.assertEqual(self.get(view)['X-Page-Cache'], 'stale')
+        self.assertEqual(self.calls, 2)
+
+    def test_authenticated_user_bypasses_cache(self):
+        view = self.make_view(fresh=60, stale=60)
+        user = mock.Mock(is_authenticated=True)
+        self.get(view)
+        response = self.get(view, user=user)
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertEqual(response.content, b'render 2')
+        # 登录用户的页面不会写入缓存
+        self.assertEqual(self.get(view)['X-Page-Cache'], 'hit')
+        self.assertEqual(self.get(view).content, b'render 1')
+
+    def test_response_with_cookie_not_cached(self):
+        @page_cache.anonymous_page_cache('cookie', fresh=60, stale=60)
+        def view(request):
+            self.calls += 1
+            response = HttpResponse('personal')
+            response.set_cookie('session', 'x')
+            return response
+
+        self.get(view)
+        self.assertEqual(self.get(view)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.calls, 2)
+
+    def test_disabled_by_setting(self):
+        view = self.make_view(fresh=60, stale=60)
+        with self.settings(PAGE_CACHE_ENABLED=False):
+            self.get(view)
+            self.get(view)
+        self.assertEqual(self.calls, 2)
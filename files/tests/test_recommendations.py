@@ -0,0 +1,120 @@
+"""相关视频推荐：按手工计算的小矩阵校验稀疏前 K 名"""
+import math
+from unittest import skipUnless
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from files import recommendations
+from files.models import RelatedVideos, Tag, Video
+
+
+def idf(df, total):
+    return math.log((1 + total) / (1 + df)) + 1
+
+
+@skipUnless(sparse, '未安装 numpy 和 scipy')
+class TopKEntriesTests(SimpleTestCase):
+
+    def test_rank_and_exclude_self(self):
+        block = sparse.csr_matrix(np.array([
+            [1.0, 0.5, 0.0, 0.9],
+            [0.2, 1.0, 0.2, 0.0],
+        ], dtype=np.float32))
+        rows, cols, scores = recommendations.top_k_entries(np, block, 2, self_cols=np.array([0, 1]))
+        self.assertEqual(rows.tolist(), [0, 0, 1, 1])
+        # 自身排除，同分时ID较大的在前
+        self.assertEqual(cols.tolist(), [3, 1, 2, 0])
+        np.testing.assert_allclose(scores, [0.9, 0.5, 0.2, 0.2])
+
+    def test_iter_blocks_respects_budget(self):
+        matrix = sparse.csr_matrix(np.array([
+            [1, 1, 0],
+            [1, 0, 0],
+            [0, 0, 1],
+        ], dtype=np.float32))
+        df = np.array([2, 1, 1])
+        blocks = list(recommendations.iter_blocks(np, matrix, df, np.arange(3), 3))
+        # 各行代价 3、2、1
+        self.assertEqual([block.tolist() for block in blocks], [[0], [1, 2]])
+
+
+@skipUnless(sparse, '未安装 numpy 和 scipy')
+class BuildTests(TestCase):
+    """五个视频只有标签特征（权重 1.0）：
+
+        v1: a b    v2: a b    v3: a c    v4: c    v5: d
+
+    d 只出现在一个视频中被丢弃，v5 没有推荐。
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = get_user_model().objects.create(username='editor')
+        self.tags = {name: Tag.objects.create(name=name, slug=f'tag-{name}') for name in 'abcd'}
+        self.videos = [self.create_video(f'v{i}', names) for i, names in
+                       enumerate(['ab', 'ab', 'ac', 'c', 'd'], start=1)]
+
+    def create_video(self, title, tag_names):
+        video = Video.objects.create(title=title, created_by=self.user)
+        video.tags.set([self.tags[name] for name in tag_names])
+        return video
+
+    def related(self, video):
+        data = RelatedVideos.objects.get(video_id=video.id).data
+        return [(video_id, round(score, 4)) for video_id, score in recommendations.decode(data)]
+
+    def expected_scores(self):
+        a, bc = idf(3, 5), idf(2, 5)
+        pair = a * a + bc * bc
+        return {
+            'same': 1.0,
+            'ab_ac': round(a * a / pair, 4),
+            'ac_c': round(bc / math.sqrt(pair), 4),
+        }
+
+    def assert_built(self):
+        v1, v2, v3, v4, v5 = self.videos
+        scores = self.expected_scores()
+        self.assertEqual(self.related(v1), [(v2.id, scores['same']), (v3.id, scores['ab_ac'])])
+        self.assertEqual(self.related(v2), [(v1.id, scores['same']), (v3.id, scores['ab_ac'])])
+        # v1、v2 与 v3 同分，取ID较大的 v2
+        self.assertEqual(self.related(v3), [(v4.id, scores['ac_c']), (v2.id, scores['ab_ac'])])
+        self.assertEqual(self.related(v4), [(v3.id, scores['ac_c'])])
+        self.assertEqual(self.related(v5), [])
+
+    def test_build(self):
+        self.assertEqual(recommendations.build(top_k=2), 5)
+        self.assert_built()
+        self.assertEqual(recommendations.get_related_ids(self.videos[0].id),
+                         [self.videos[1].id, self.videos[2].id])
+
+    def test_build_in_single_row_blocks(self):
+        recommendations.build(top_k=2, block_nnz=1)
+        self.assert_built()
+
+    def test_inactive_video_dropped(self):
+        recommendations.build(top_k=2)
+        Video.objects.filter(id=self.videos[3].id).update(is_active=False)
+        recommendations.build(top_k=2)
+        self.assertFalse(RelatedVideos.objects.filter(video_id=self.videos[3].id).exists())
+        self.assertNotIn(self.videos[3].id, recommendations.get_related_ids(self.videos[2].id))
+
+    def test_refresh_adds_new_video(self):
+        v1, v2, v3, v4, v5 = self.videos
+        recommendations.build(top_k=2)
+        v6 = self.create_video('v6', 'ab')
+        self.assertEqual(recommendations.refresh(top_k=2), 1)
+        self.assertEqual({video_id for video_id, _ in self.related(v6)}, {v1.id, v2.id})
+        # 新视频进入已有视频的前 K 名，挤掉相似度较低的 v3
+        self.assertEqual({video_id for video_id, _ in self.related(v1)}, {v2.id, v6.id})
+        self.assertEqual(self.related(v4), [(v3.id, self.expected_scores()['ac_c'])])
+        self.assertEqual(recommendations.refresh(top_k=2), 0)
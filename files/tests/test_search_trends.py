@@ -0,0 +1,175 @@
+"""热门搜索统计：计数结构、时间衰减、进程列表登记和写入 HotSearch"""
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from files import search_trends
+from files.models import HotSearch
+
+
+class SketchTests(SimpleTestCase):
+
+    def test_count_min_never_underestimates(self):
+        sketch = search_trends.CountMinSketch(width=16, depth=2)
+        counts = {f'kw{i}': i + 1 for i in range(50)}
+        for keyword, count in counts.items():
+            sketch.add(keyword, count)
+        for keyword, count in counts.items():
+            self.assertGreaterEqual(sketch.estimate(keyword), count)
+
+    def test_space_saving_keeps_heavy_hitters(self):
+        candidates = search_trends.SpaceSaving(3)
+        for keyword, estimate in [('a', 5), ('b', 1), ('c', 2), ('d', 4), ('e', 1), ('f', 6)]:
+            candidates.offer(keyword, estimate)
+        self.assertEqual([keyword for keyword, _ in candidates.top(3)], ['f', 'a', 'd'])
+
+
+class TrendsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.trends = search_trends.SearchTrends(half_life=100, capacity=10, flush_interval=60)
+        self.trends.start = lambda: None
+        self.now = 1_000_000.0
+        self.trends.landmark = self.now
+        patcher = mock.patch.object(search_trends.time, 'time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_normalize(self):
+        self.assertEqual(search_trends.normalize('  Hello   World '), 'hello world')
+        self.assertIsNone(search_trends.normalize('   '))
+        self.assertIsNone(search_trends.normalize('x' * (search_trends.MAX_KEYWORD_LENGTH + 1)))
+
+    def test_counts_decay_by_half_life(self):
+        for _ in range(4):
+            self.trends.record('Python')
+        self.trends.record('django')
+        self.assertEqual(self.trends.top(), [('python', 4.0), ('django', 1.0)])
+        self.now += 100
+        self.assertEqual(self.trends.top(), [('python', 2.0), ('django', 0.5)])
+
+    def test_recent_searches_outrank_old(self):
+        for _ in range(3):
+            self.trends.record('old')
+        self.now += 200
+        for _ in range(2):
+            self.trends.record('new')
+        self.assertEqual([keyword for keyword, _ in self.trends.top()], ['new', 'old'])
+
+    def test_rescale_keeps_scores(self):
+        self.trends.record('kw')
+        self.now += 100 * 41
+        self.trends.record('kw')
+        [(keyword, score)] = self.trends.top()
+        self.assertEqual(self.trends.landmark, self.now)
+        self.assertAlmostEqual(score, 1.0)
+
+
+class WriteHotSearchesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_new_keywords_created_inactive(self):
+        search_trends.write_hot_searches([('spam', 9)])
+        row = HotSearch.objects.get(keyword='spam')
+        self.assertEqual(row.count, 9)
+        self.assertFalse(row.is_active)
+        self.assertTrue(row.is_tracked)
+
+    def test_curated_keywords_untouched(self):
+        HotSearch.objects.create(keyword='curated', count=500)
+        HotSearch.objects.create(keyword='also curated', count=300)
+        search_trends.write_hot_searches([('curated', 3)])
+        self.assertEqual(HotSearch.objects.get(keyword='curated').count, 500)
+        self.assertEqual(HotSearch.objects.get(keyword='also curated').count, 300)
+        self.assertEqual(HotSearch.objects.filter(keyword='curated').count(), 1)
+
+    def test_single_upsert(self):
+        search_trends.write_hot_searches([('a', 5)])
+        HotSearch.objects.create(keyword='curated', count=500)
+        # 保存点两条，加上查询已有搜索词、upsert、查询跌出前列的搜索词（没有时不执行清零）
+        with self.assertNumQueries(5):
+            search_trends.write_hot_searches([('a', 6), ('b', 2), ('c', 1), ('curated', 9)])
+        self.assertEqual(
+            dict(HotSearch.objects.values_list('keyword', 'count')),
+            {'a': 6, 'b': 2, 'c': 1, 'curated': 500},
+        )
+
+    def test_tracked_keywords_updated_and_zeroed(self):
+        search_trends.write_hot_searches([('a', 5), ('b', 3)])
+        HotSearch.objects.filter(keyword='a').update(is_active=True)
+        search_trends.write_hot_searches([('a', 7)])
+        a, b = HotSearch.objects.get(keyword='a'), HotSearch.objects.get(keyword='b')
+        self.assertEqual((a.count, a.is_active), (7, True))
+        self.assertEqual(b.count, 0)
+
+    def test_flush_merges_nodes(self):
+        first = search_trends.SearchTrends(flush_interval=60)
+        second = search_trends.SearchTrends(flush_interval=60)
+        first.start = second.start = lambda: None
+        second.node = 'other'
+        for _ in range(2):
+            first.record('shared')
+            second.record('shared')
+            second.record('other')
+        second.publish()
+        self.assertEqual(first.flush(), 2)
+        self.assertEqual(dict(HotSearch.objects.values_list('keyword', 'count')), {'shared': 4, 'other': 2})
+        # 锁未过期时其他进程只发布不写库
+        self.assertEqual(second.flush(), 0)
+
+
+class SlowNodesCache:
+    """读取进程列表后稍作停顿，放大读取与写回之间的窗口，没有锁时后写的进程会覆盖先写的登记"""
+
+    def __getattr__(self, name):
+        return getattr(cache, name)
+
+    def get(self, key, *args, **kwargs):
+        value = cache.get(key, *args, **kwargs)
+        if key == search_trends.NODES_KEY:
+            time.sleep(0.01)
+        return value
+
+
+class PublishTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def make_trends(self, node):
+        trends = search_trends.SearchTrends(flush_interval=60)
+        trends.start = lambda: None
+        trends.node = node
+        return trends
+
+    def test_concurrent_publish_keeps_every_node(self):
+        nodes = [self.make_trends(f'node-{i}') for i in range(8)]
+        barrier = threading.Barrier(len(nodes))
+
+        def publish(trends):
+            barrier.wait()
+            trends.publish()
+
+        with mock.patch.object(search_trends, 'cache', SlowNodesCache()):
+            threads = [threading.Thread(target=publish, args=(trends,)) for trends in nodes]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(set(cache.get(search_trends.NODES_KEY)), {trends.node for trends in nodes})
+
+    def test_lock_held_skips_registration(self):
+        cache.set(search_trends.NODES_KEY, {'other': time.time()}, None)
+        cache.add(search_trends.NODES_LOCK_KEY, 'other', 60)
+        trends = self.make_trends('blocked')
+        with mock.patch.object(search_trends, 'NODES_LOCK_WAIT', 0):
+            self.assertFalse(trends.publish())
+        self.assertEqual(set(cache.get(search_trends.NODES_KEY)), {'other'})
+        self.assertIsNotNone(cache.get(search_trends.SNAPSHOT_KEY_TEMPLATE.format(node='blocked')))
@@ -0,0 +1,89 @@
+"""搜索建议：前缀查询、增量变更和后台重建"""
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from files import search_trends, suggestions
+from files.models import HotSearch
+
+
+def make_index(items, version=0):
+    return suggestions.SuggestionIndex.build(items, version)
+
+
+class LookupTests(SimpleTestCase):
+
+    def test_prefix_ordered_by_score(self):
+        index = make_index([
+            ('tag', 1, 'python', suggestions.score('tag', 10)),
+            ('keyword', 2, 'python 教程', suggestions.score('keyword', 100)),
+            ('tag', 3, 'java', suggestions.score('tag', 50)),
+        ])
+        self.assertEqual([item[1] for item in index.lookup('py')], [2, 1])
+        self.assertEqual(index.lookup('rust'), [])
+
+    def test_apply_replaces_and_removes(self):
+        index = make_index([('tag', 1, 'python', 1.0), ('tag', 2, 'perl', 1.0)])
+        index.apply({('tag', 1): ('tag', 1, 'pypy', 1.0), ('tag', 2): None}, 2)
+        self.assertEqual([item[2] for item in index.lookup('p')], ['pypy'])
+        self.assertEqual(index.version, 2)
+
+
+class GetIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        path = os.path.join(self.tempdir, 'suggestions.snapshot')
+        patcher = mock.patch.object(suggestions, 'snapshot_path', return_value=path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        local = mock.patch.dict(suggestions._local, {
+            'index': None, 'snapshot_mtime': None, 'checked_at': 0, 'version_checked_at': 0, 'rebuild_thread': None,
+        })
+        local.start()
+        self.addCleanup(local.stop)
+
+    def test_incomplete_change_log_rebuilds_in_background(self):
+        current = make_index([('tag', 1, 'old', 1.0)])
+        rebuilt = make_index([('tag', 1, 'new', 1.0)], version=600)
+        current.save(suggestions.snapshot_path())
+        cache.set(suggestions.VERSION_KEY, 600)
+
+        with mock.patch.object(suggestions, 'build', return_value=rebuilt) as build:
+            # 变更日志不完整时仍返回当前索引，不在请求中重建
+            self.assertEqual(suggestions.get_index().lookup('o')[0][2], 'old')
+            suggestions._local['rebuild_thread'].join(5)
+        build.assert_called_once_with()
+        self.assertIs(suggestions._local['index'], rebuilt)
+        self.assertIsNone(cache.get(suggestions.REBUILD_LOCK_KEY))
+
+    def test_other_process_rebuilding(self):
+        make_index([('tag', 1, 'old', 1.0)]).save(suggestions.snapshot_path())
+        cache.set(suggestions.VERSION_KEY, 600)
+        cache.set(suggestions.REBUILD_LOCK_KEY, True)
+        with mock.patch.object(suggestions, 'build') as build:
+            self.assertEqual(suggestions.get_index().lookup('o')[0][2], 'old')
+        build.assert_not_called()
+        self.assertIsNone(suggestions._local['rebuild_thread'])
+
+
+class KeywordChangeTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_trends_flush_marks_keywords_changed(self):
+        tracked = HotSearch.objects.create(keyword='tracked', count=5, is_tracked=True)
+        dropped = HotSearch.objects.create(keyword='dropped', count=5, is_tracked=True)
+        HotSearch.objects.create(keyword='curated', count=5)
+        with mock.patch.object(suggestions, 'mark_changed') as mark_changed:
+            search_trends.write_hot_searches([('tracked', 9)])
+        mark_changed.assert_called_once_with('keyword', [tracked.id, dropped.id])
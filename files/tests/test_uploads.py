@@ -0,0 +1,119 @@
+"""分块上传：文件头识别、中断后续传"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from files import uploads
+from files.models import Category, UploadSession
+
+CHUNK_SIZE = uploads.MIN_CHUNK_SIZE
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def ts_packets(count):
+    """count 个 188 字节的 MPEG-TS 包"""
+    return b''.join(b'\x47' + bytes([i % 256]) * 187 for i in range(count))
+
+
+class SniffTypeTests(SimpleTestCase):
+
+    def test_images(self):
+        self.assertEqual(uploads.sniff_type(b'GIF89a' + b'\x00' * 600), 'image/')
+        self.assertEqual(uploads.sniff_type(b'\x89PNG\r\n\x1a\n' + b'\x00' * 600), 'image/')
+        self.assertEqual(uploads.sniff_type(b'RIFF\x00\x00\x00\x00WEBPVP8 '), 'image/')
+
+    def test_videos(self):
+        self.assertEqual(uploads.sniff_type(b'\x00\x00\x00\x18ftypmp42'), 'video/')
+        self.assertEqual(uploads.sniff_type(b'RIFF\x00\x00\x00\x00AVI LIST'), 'video/')
+        self.assertEqual(uploads.sniff_type(ts_packets(3)), 'video/')
+
+    def test_single_sync_byte_is_not_ts(self):
+        self.assertIsNone(uploads.sniff_type(b'G' + b'\x00' * 600))
+        self.assertIsNone(uploads.sniff_type(b'Grocery list\n' * 50))
+
+
+class ChunkedUploadTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = get_user_model().objects.create(username='uploader')
+        self.category = Category.objects.create(name='短视频', slug='shorts', description='')
+        # 两个完整分块加一个不满的分块
+        self.content = ts_packets((CHUNK_SIZE * 2 + 1000) // 188 + 1)
+        self.session = uploads.create_session(
+            self.user, 'video', 'clip.ts', len(self.content), 'video/mp2t',
+            chunk_size=CHUNK_SIZE, metadata={'title': '测试', 'category': self.category.id},
+        )
+
+    def chunk(self, index):
+        return self.content[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+
+    def send(self, index, data=None, checksum=None):
+        data = self.chunk(index) if data is None else data
+        return uploads.write_chunk(self.session, index, io.BytesIO(data), checksum or sha256(self.chunk(index)))
+
+    def test_interrupted_chunk_is_not_recorded_and_can_be_resent(self):
+        self.send(0)
+        with self.assertRaises(uploads.UploadError):
+            # 连接在分块中途断开
+            self.send(1, data=self.chunk(1)[:1000])
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.received_chunks, [0])
+        self.assertEqual(uploads.missing_chunks(self.session), [1, 2])
+
+        self.send(2)
+        self.send(1)
+        self.session.refresh_from_db()
+        self.assertEqual(uploads.missing_chunks(self.session), [])
+
+        session = uploads.complete(self.session)
+        self.assertEqual(session.status, 'completed')
+        with open(os.path.join(settings.MEDIA_ROOT, session.media.file_path.name), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(os.path.exists(uploads.partial_path(session)))
+
+    def test_resending_a_received_chunk_is_idempotent(self):
+        self.send(0)
+        self.assertEqual(self.send(0), [0])
+
+    def test_checksum_mismatch_is_rejected(self):
+        self.send(0)
+        with self.assertRaises(uploads.UploadError):
+            self.send(1, checksum=sha256(b'other'))
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.received_chunks, [0])
+
+    def test_first_chunk_required_before_others(self):
+        with self.assertRaises(uploads.UploadError) as cm:
+            self.send(1)
+        self.assertEqual(cm.exception.status, 409)
+
+    def test_content_not_matching_declared_type(self):
+        session = uploads.create_session(
+            self.user, 'video', 'list.txt', CHUNK_SIZE, 'video/mp2t',
+            chunk_size=CHUNK_SIZE, metadata={'category': self.category.id},
+        )
+        data = b'Grocery list\n' * (CHUNK_SIZE // 13) + b'\n' * (CHUNK_SIZE % 13)
+        with self.assertRaises(uploads.UploadError):
+            uploads.write_chunk(session, 0, io.BytesIO(data), sha256(data))
+
+    def test_complete_with_missing_chunks(self):
+        self.send(0)
+        with self.assertRaises(uploads.UploadError) as cm:
+            uploads.complete(self.session)
+        self.assertEqual(cm.exception.status, 409)
+        self.assertEqual(UploadSession.objects.get(pk=self.session.pk).status, 'uploading')
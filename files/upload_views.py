@@ -0,0 +1,96 @@
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
+from functools import wraps
+import json
+import logging
+
+from . import uploads
+
+logger = logging.getLogger(__name__)
+
+
+def session_data(session):
+    return {
+        'upload_id': session.upload_id,
+        'status': session.status,
+        'chunk_size': session.chunk_size,
+        'total_size': session.total_size,
+        'total_chunks': session.total_chunks,
+        'received_chunks': session.received_chunks,
+        'missing_chunks': uploads.missing_chunks(session),
+    }
+
+
+def login_required_json(view):
+    """要求登录，并把 UploadError 转换为JSON错误响应"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'success': False, 'message': '请先登录'}, status=401)
+        try:
+            return view(request, *args, **kwargs)
+        except uploads.UploadError as e:
+            return JsonResponse({'success': False, 'message': e.message}, status=e.status)
+    return wrapper
+
+
+@require_http_methods(['POST'])
+@login_required_json
+def upload_create(request):
+    """创建分块上传会话"""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'message': '请求格式错误'}, status=400)
+
+    session = uploads.create_session(
+        user=request.user,
+        kind=data.get('kind', 'video'),
+        filename=data.get('filename'),
+        size=data.get('size'),
+        content_type=data.get('content_type'),
+        chunk_size=data.get('chunk_size'),
+        metadata={
+            'title': data.get('title', ''),
+            'description': data.get('description', ''),
+            'content': data.get('content', ''),
+            'category': data.get('category'),
+        },
+    )
+    return JsonResponse({'success': True, **session_data(session)}, status=201)
+
+
+@require_http_methods(['GET'])
+@login_required_json
+def upload_status(request, upload_id):
+    """查询上传进度，断线后据此补传缺失的分块"""
+    session = uploads.get_session(upload_id, request.user)
+    return JsonResponse({'success': True, **session_data(session)})
+
+
+@require_http_methods(['PUT'])
+@login_required_json
+def upload_chunk(request, upload_id, index):
+    """上传一个分块，请求体为分块内容，X-Chunk-Checksum 为其 SHA-256"""
+    session = uploads.get_session(upload_id, request.user)
+    received = uploads.write_chunk(session, index, request, request.headers.get('X-Chunk-Checksum'))
+    return JsonResponse({'success': True, 'received_chunks': received})
+
+
+@require_http_methods(['POST'])
+@login_required_json
+def upload_complete(request, upload_id):
+    """全部分块上传完成后创建视频记录"""
+    session = uploads.get_session(upload_id, request.user)
+    try:
+        session = uploads.complete(session)
+    except uploads.UploadError:
+        raise
+    except Exception as e:  # 文件移动或建记录失败
+        logger.error(f'上传合并失败: {str(e)}')
+        return JsonResponse({'success': False, 'message': '发布失败，请稍后重试'}, status=500)
+    return JsonResponse({
+        'success': True,
+        'message': '发布成功',
+        'video_id': session.media.videos.values_list('id', flat=True).first(),
+    })
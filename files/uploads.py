@@ -0,0 +1,230 @@
+"""分块断点续传
+
+客户端先创建上传会话并声明文件大小和类型，再逐块 PUT 文件内容。第一块到达时
+按文件头校验真实类型，每块按 SHA-256 校验，内容从请求流中分段读出后直接写入
+磁盘上的临时文件的对应偏移，不在内存中保存整个文件。全部分块到齐后移动到媒体
+目录并创建 VideoMedia 记录。连接中断后客户端查询已接收的分块，只补传缺失部分。
+"""
+from datetime import timedelta
+import hashlib
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Category, Video, VideoMedia, UploadSession
+from .encoding import enqueue_media
+
+logger = logging.getLogger(__name__)
+
+# 各上传类型的大小上限和允许的文件类型
+UPLOAD_LIMITS = {
+    'video': {'max_size': 500 * 1024 * 1024, 'content_types': ('video/',)},
+    'content': {'max_size': 100 * 1024 * 1024, 'content_types': ('image/', 'video/')},
+}
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+# 文件头特征：((偏移, 字节), ...) 全部匹配时为对应类型；图片在前，单字节的
+# MPEG-TS 同步字节需要在连续三个 188 字节的包头上出现
+MAGIC_NUMBERS = [
+    (((0, b'\xff\xd8\xff'),), 'image/'),
+    (((0, b'\x89PNG'),), 'image/'),
+    (((0, b'GIF8'),), 'image/'),
+    (((0, b'RIFF'), (8, b'WEBP')), 'image/'),
+    (((4, b'ftyp'),), 'video/'),           # MP4 / MOV
+    (((0, b'\x1a\x45\xdf\xa3'),), 'video/'),  # WebM / MKV
+    (((0, b'FLV'),), 'video/'),
+    (((0, b'RIFF'), (8, b'AVI ')), 'video/'),
+    (((0, b'\x47'), (188, b'\x47'), (376, b'\x47')), 'video/'),  # MPEG-TS
+]
+# 判断类型需要的文件头长度
+SNIFF_SIZE = 512
+
+
+class UploadError(Exception):
+    """上传请求无效"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def partial_path(session):
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', 'partial', f'{session.upload_id}.part')
+
+
+def sniff_type(head):
+    """根据文件头判断类型前缀，无法识别时返回None"""
+    for signature, type_prefix in MAGIC_NUMBERS:
+        if all(head[offset:offset + len(magic)] == magic for offset, magic in signature):
+            return type_prefix
+    return None
+
+
+def create_session(user, kind, filename, size, content_type, chunk_size=None, metadata=None):
+    """创建上传会话，先按声明的大小和类型校验"""
+    limits = UPLOAD_LIMITS.get(kind)
+    if limits is None:
+        raise UploadError('不支持的上传类型')
+    try:
+        size = int(size)
+        chunk_size = int(chunk_size or DEFAULT_CHUNK_SIZE)
+    except (TypeError, ValueError):
+        raise UploadError('文件大小无效')
+    if size <= 0:
+        raise UploadError('文件大小无效')
+    if size > limits['max_size']:
+        raise UploadError(f'文件大小不能超过{limits["max_size"] // (1024 * 1024)}MB')
+    if not content_type or not content_type.startswith(limits['content_types']):
+        raise UploadError('不支持的文件类型')
+    chunk_size = max(MIN_CHUNK_SIZE, min(chunk_size, MAX_CHUNK_SIZE))
+
+    metadata = metadata or {}
+    if not Category.objects.filter(id=metadata.get('category')).exists():
+        raise UploadError('分类不存在')
+
+    session = UploadSession.objects.create(
+        upload_id=uuid.uuid4().hex,
+        user=user,
+        kind=kind,
+        filename=os.path.basename(filename or 'upload'),
+        content_type=content_type,
+        total_size=size,
+        chunk_size=chunk_size,
+        metadata=metadata,
+    )
+
+    path = partial_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    return session
+
+
+def get_session(upload_id, user):
+    try:
+        return UploadSession.objects.get(upload_id=upload_id, user=user)
+    except UploadSession.DoesNotExist:
+        raise UploadError('上传会话不存在', status=404)
+
+
+def write_chunk(session, index, stream, checksum):
+    """把一个分块从请求流写入临时文件，返回已接收的分块列表"""
+    if session.status != 'uploading':
+        raise UploadError('上传会话已结束', status=409)
+    if not 0 <= index < session.total_chunks:
+        raise UploadError('分块序号无效')
+    if index != 0 and 0 not in session.received_chunks:
+        raise UploadError('请先上传第一个分块', status=409)
+    if not checksum:
+        raise UploadError('缺少分块校验值')
+
+    offset = index * session.chunk_size
+    expected = min(session.chunk_size, session.total_size - offset)
+
+    digest = hashlib.sha256()
+    received = 0
+    # 第一块先凑够 SNIFF_SIZE 字节（或整块）的文件头再判断类型
+    head = b'' if index == 0 else None
+    with open(partial_path(session), 'r+b') as f:
+        f.seek(offset)
+        while received < expected:
+            data = stream.read(min(READ_SIZE, expected - received))
+            if not data:
+                break
+            if head is not None:
+                head += data[:SNIFF_SIZE - len(head)]
+                if len(head) >= SNIFF_SIZE or received + len(data) >= expected:
+                    type_prefix = sniff_type(head)
+                    if type_prefix is None or not session.content_type.startswith(type_prefix):
+                        raise UploadError('文件内容与类型不符')
+                    head = None
+            digest.update(data)
+            f.write(data)
+            received += len(data)
+
+    if received != expected or stream.read(1):
+        raise UploadError('分块大小不正确')
+    if digest.hexdigest() != checksum.lower():
+        raise UploadError('分块校验失败')
+
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if index not in session.received_chunks:
+            session.received_chunks = sorted(session.received_chunks + [index])
+            session.save(update_fields=['received_chunks', 'updated_at'])
+    return session.received_chunks
+
+
+def missing_chunks(session):
+    received = set(session.received_chunks)
+    return [index for index in range(session.total_chunks) if index not in received]
+
+
+def complete(session):
+    """全部分块到齐后移动文件并创建视频和媒体记录"""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == 'completed':
+            return session
+        if session.status != 'uploading':
+            raise UploadError('上传会话已结束', status=409)
+        if missing_chunks(session):
+            raise UploadError('还有分块未上传', status=409)
+
+        extension = os.path.splitext(session.filename)[1].lower()
+        relative_path = os.path.join(
+            timezone.now().strftime('videos/%Y/%m/%d'), f'{session.upload_id}{extension}'
+        )
+        metadata = session.metadata
+        content = metadata.get('content', '')
+        video = Video.objects.create(
+            title=metadata.get('title') or content[:50],  # 内容发布截取前50个字符作为标题
+            description=metadata.get('description') or content or '暂无描述',
+            created_by=session.user,
+            is_active=True,
+            video_type='short' if session.kind == 'video' else 'single',
+        )
+        video.categories.add(metadata['category'])
+
+        media = VideoMedia.objects.create(
+            file_path=relative_path,
+            file_size=session.total_size,
+            media_type='image' if session.content_type.startswith('image/') else 'video',
+        )
+        video.media_files.add(media)
+        if media.media_type == 'video':
+            enqueue_media(media)
+
+        session.media = media
+        session.status = 'completed'
+        session.save(update_fields=['media', 'status', 'updated_at'])
+
+        # 最后移动文件，移动失败时数据库记录一并回滚
+        final_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(partial_path(session), final_path)
+    return session
+
+
+def cleanup_expired(max_age_hours=24):
+    """删除超时未完成的上传会话及其临时文件，返回删除数"""
+    cutoff = timezone.now() - timedelta(hours=max_age_hours)
+    expired = UploadSession.objects.filter(updated_at__lt=cutoff).exclude(status='completed')
+    count = 0
+    for session in expired:
+        try:
+            os.remove(partial_path(session))
+        except FileNotFoundError:
+            pass
+        session.delete()
+        count += 1
+    return count
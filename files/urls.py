@@ -1,6 +1,7 @@
 from django.urls import path
 from . import views
 from . import danmaku_views
+from . import upload_views
 
 app_name = 'files'
 
@@ -11,7 +12,10 @@ urlpatterns = [
     path('channel/<str:category_slug>/', views.channel_view, name='channel'),
     path('channel/<str:category_slug>/<str:subcategory_slug>/', views.subcategory_list, name='subcategory'),
     path('search/', views.search, name='search'),
+    path('api/suggest/', views.suggest, name='suggest'),
     path('video/<int:video_id>/', views.video_detail, name='video_detail'),
+    path('series/<int:series_id>/index.m3u8', views.series_playlist, name='series_playlist'),
+    path('img/<str:kind>/<int:object_id>/<str:preset>/<int:width>/', views.image_derivative, name='image_derivative'),
     path('music/', views.music_list, name='music_list'),
     path('music/playlists/', views.playlist_list, name='playlist_list'),
     path('music/playlists/<int:playlist_id>/', views.playlist_detail, name='playlist_detail'),
@@ -19,6 +23,12 @@ urlpatterns = [
     path('music/albums/<int:album_id>/', views.album_detail, name='album_detail'),
     path('api/publish/content/', views.publish_content, name='publish_content'),
     path('api/publish/video/', views.publish_video, name='publish_video'),
+    
+    # 分块上传API
+    path('api/uploads/', upload_views.upload_create, name='upload_create'),
+    path('api/uploads/<str:upload_id>/', upload_views.upload_status, name='upload_status'),
+    path('api/uploads/<str:upload_id>/chunks/<int:index>/', upload_views.upload_chunk, name='upload_chunk'),
+    path('api/uploads/<str:upload_id>/complete/', upload_views.upload_complete, name='upload_complete'),
     path('api/categories/<int:category_id>/children/', views.get_category_children, name='category_children'),
     path('api/categories/', views.get_categories, name='get_categories'),
     path('api/categories/<str:category_type>/', views.get_categories, name='get_categories_by_type'),
@@ -26,4 +36,7 @@ urlpatterns = [
     # 弹幕相关API
     path('api/videos/<str:video_id>/danmaku/', danmaku_views.DanmakuList.as_view(), name='danmaku_list'),
     path('api/danmaku/<int:pk>/', danmaku_views.DanmakuDetail.as_view(), name='danmaku_detail'),
+    path('api/videos/<int:video_id>/danmaku/seg/<int:segment>/', views.danmaku_segment, name='danmaku_segment'),
+    path('api/videos/<int:video_id>/danmaku/submit/', views.danmaku_submit, name='danmaku_submit'),
+    path('api/videos/<int:video_id>/danmaku/live/', views.danmaku_live, name='danmaku_live'),
 ]
@@ -0,0 +1,218 @@
+"""视频缓存容量管理
+
+VideoCache 记录的转码缓存文件受全局和按画质的字节预算限制，超出时按 GDSF
+（Greedy-Dual-Size-Frequency）淘汰：每条缓存的保留优先级为
+
+    H = L + 命中次数 × 画质权重 / 文件大小（MB）
+
+L 为膨胀值，等于最近一次淘汰的优先级，使长期未访问的缓存逐渐落后于新访问的
+缓存。同样的命中次数下文件越大优先级越低，高码率画质的权重更低（可以回退到
+低画质播放），因此低需求的高码率版本最先被淘汰。
+
+优先级存储在数据库并建有索引，每轮清理只按优先级取出有限的一批记录；文件大小
+以数据库为准，每轮只抽查一小段记录的实际文件，不会一次扫描全部文件。
+
+    VIDEO_CACHE_MAX_BYTES = 500 * 1024 ** 3
+    VIDEO_CACHE_QUALITY_BUDGETS = {'1080p': 200 * 1024 ** 3}
+"""
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Min, Sum
+from django.utils import timezone
+
+from .models import VideoCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 500 * 1024 ** 3
+
+# 画质权重：重新生成的代价相同，但高码率版本可以用低画质替代
+QUALITY_WEIGHTS = {
+    '240p': 1.0,
+    '480p': 1.0,
+    '720p': 0.8,
+    '1080p': 0.6,
+}
+
+# 每轮清理最多淘汰的条数和抽查文件的条数
+SWEEP_BATCH = 500
+VERIFY_BATCH = 200
+
+INFLATION_KEY = 'video_cache:inflation'
+VERIFY_CURSOR_KEY = 'video_cache:verify_cursor'
+METRIC_KEYS = ('hits', 'misses', 'evictions', 'evicted_bytes')
+
+
+def gdsf_priority(inflation, hits, size, quality):
+    """GDSF 保留优先级"""
+    size_mb = max(size, 1) / (1024 * 1024)
+    return inflation + max(hits, 1) * QUALITY_WEIGHTS.get(quality, 1.0) / size_mb
+
+
+def metric_key(name):
+    return f'video_cache:metrics:{name}'
+
+
+def incr_metric(name, amount=1):
+    try:
+        cache.incr(metric_key(name), amount)
+    except ValueError:
+        cache.add(metric_key(name), 0, None)
+        cache.incr(metric_key(name), amount)
+
+
+def get_metrics():
+    """命中、未命中、淘汰统计和当前用量"""
+    values = cache.get_many([metric_key(name) for name in METRIC_KEYS])
+    metrics = {name: values.get(metric_key(name), 0) for name in METRIC_KEYS}
+    lookups = metrics['hits'] + metrics['misses']
+    metrics['hit_ratio'] = metrics['hits'] / lookups if lookups else 0
+    metrics['usage'] = usage()
+    metrics['inflation'] = get_inflation()
+    return metrics
+
+
+def reset_metrics():
+    cache.delete_many([metric_key(name) for name in METRIC_KEYS])
+
+
+def get_inflation():
+    """当前膨胀值，缓存丢失时用剩余缓存的最低优先级恢复"""
+    inflation = cache.get(INFLATION_KEY)
+    if inflation is None:
+        inflation = VideoCache.objects.aggregate(value=Min('priority'))['value'] or 0
+        cache.set(INFLATION_KEY, inflation, None)
+    return inflation
+
+
+def get_budgets():
+    return (
+        getattr(settings, 'VIDEO_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES),
+        getattr(settings, 'VIDEO_CACHE_QUALITY_BUDGETS', {}),
+    )
+
+
+def usage():
+    """按画质汇总的缓存字节数，'total' 为合计"""
+    rows = VideoCache.objects.values_list('quality').annotate(size=Sum('file_size')).order_by()
+    result = {quality: size or 0 for quality, size in rows}
+    result['total'] = sum(result.values())
+    return result
+
+
+def absolute_path(file_path):
+    return file_path if os.path.isabs(file_path) else os.path.join(settings.MEDIA_ROOT, file_path)
+
+
+def lookup(video, quality):
+    """查找缓存并记录命中，未命中返回None"""
+    entry = VideoCache.objects.filter(video=video, quality=quality).first()
+    if entry is None:
+        incr_metric('misses')
+        return None
+    entry.hit_count += 1
+    entry.last_accessed_at = timezone.now()
+    entry.priority = gdsf_priority(get_inflation(), entry.hit_count, entry.file_size, quality)
+    VideoCache.objects.filter(id=entry.id).update(
+        hit_count=F('hit_count') + 1,
+        last_accessed_at=entry.last_accessed_at,
+        priority=entry.priority,
+    )
+    incr_metric('hits')
+    return entry
+
+
+def add(video, quality, file_path, file_size=None):
+    """登记新生成的缓存文件，超出预算时增量淘汰"""
+    if file_size is None:
+        file_size = os.path.getsize(absolute_path(file_path))
+    entry, _ = VideoCache.objects.update_or_create(
+        video=video,
+        quality=quality,
+        defaults={
+            'file_path': file_path,
+            'file_size': file_size,
+            'hit_count': 1,
+            'last_accessed_at': timezone.now(),
+            'priority': gdsf_priority(get_inflation(), 1, file_size, quality),
+        },
+    )
+    sweep()
+    return entry
+
+
+def evict(entries):
+    """删除缓存文件和记录，膨胀值提升到被淘汰的最高优先级，返回释放的字节数"""
+    freed = 0
+    evicted = []
+    for entry in entries:
+        try:
+            os.remove(absolute_path(entry.file_path))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f'删除缓存文件失败 {entry.file_path}: {e}')
+            continue
+        freed += entry.file_size
+        evicted.append(entry)
+    if not evicted:
+        return 0
+    VideoCache.objects.filter(id__in=[entry.id for entry in evicted]).delete()
+    incr_metric('evictions', len(evicted))
+    incr_metric('evicted_bytes', freed)
+    cache.set(INFLATION_KEY, max(get_inflation(), max(entry.priority for entry in evicted)), None)
+    return freed
+
+
+def evict_until(queryset, excess, limit):
+    """按优先级从低到高淘汰，直到释放 excess 字节或达到 limit 条，返回 (释放字节, 淘汰条数)"""
+    victims = []
+    planned = 0
+    for entry in queryset.order_by('priority', 'id')[:limit]:
+        if planned >= excess:
+            break
+        victims.append(entry)
+        planned += entry.file_size
+    return evict(victims), len(victims)
+
+
+def sweep(batch=SWEEP_BATCH):
+    """增量清理：先满足各画质预算，再满足全局预算，每轮最多淘汰 batch 条
+
+    返回本轮淘汰的条数，与 batch 相等时说明仍可能超出预算，需要继续调用。
+    """
+    max_bytes, quality_budgets = get_budgets()
+    current = usage()
+    evicted = 0
+    for quality, budget in quality_budgets.items():
+        excess = current.get(quality, 0) - budget
+        if excess > 0 and evicted < batch:
+            freed, count = evict_until(VideoCache.objects.filter(quality=quality), excess, batch - evicted)
+            current['total'] -= freed
+            evicted += count
+    excess = current['total'] - max_bytes
+    if excess > 0 and evicted < batch:
+        evicted += evict_until(VideoCache.objects.all(), excess, batch - evicted)[1]
+    return evicted
+
+
+def verify(batch=VERIFY_BATCH):
+    """按ID轮转抽查一段缓存记录：文件缺失的删除记录，大小不一致的更正，返回处理的条数"""
+    cursor = cache.get(VERIFY_CURSOR_KEY, 0)
+    entries = list(VideoCache.objects.filter(id__gt=cursor).order_by('id')[:batch])
+    for entry in entries:
+        try:
+            size = os.path.getsize(absolute_path(entry.file_path))
+        except FileNotFoundError:
+            VideoCache.objects.filter(id=entry.id).delete()
+            continue
+        if size != entry.file_size:
+            VideoCache.objects.filter(id=entry.id).update(
+                file_size=size,
+                priority=gdsf_priority(get_inflation(), entry.hit_count, size, entry.quality),
+            )
+    cache.set(VERIFY_CURSOR_KEY, entries[-1].id if len(entries) == batch else 0, None)
+    return len(entries)
@@ -1,47 +1,51 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse, Http404
-from django.views.decorators.http import require_http_methods
+from django.http import JsonResponse, HttpResponse, HttpResponseRedirect, FileResponse, Http404
+from django.views.decorators.http import require_http_methods, condition
 from django.core.paginator import Paginator
-from .models import Category, VideoMedia, Video, HotSearch, Actor, Director, Playlist, Album, Music
+from .models import Category, VideoMedia, Video, SeriesVideo, HotSearch, Playlist, Album, Music
+from .category_tree import get_category_tree
+from . import search_index
+from . import counters
+from .cast_enrichment import process_cast
+from . import leaderboards
+from .pagination import paginate, ORDER_LATEST, ORDER_POPULAR
+from . import danmaku_segments
+from . import hls_cache
+from . import image_derivatives
+from .page_cache import anonymous_page_cache
+from .channel_data import load_slides, load_channel_page, load_discover_page
+from .recommendations import get_related_videos
+from . import facets
+from . import search_trends
+from . import suggestions
+from .danmaku_ingest import ingestor as danmaku_ingestor, DanmakuValidationError
 from cloud_music.models import Song, Album as CloudMusicAlbum, Playlist as CloudMusicPlaylist, Artist
-from cms.models import Slide
 from django.db.models import Q
 import logging
-import openai
 from django.conf import settings
 import json
+import time
+from urllib.parse import urlencode
 
 logger = logging.getLogger(__name__)
 
 def get_nav_context():
     """获取导航栏需要的上下文数据"""
     return {
-        'main_categories': Category.objects.filter(
-            parent__isnull=True,  # 一级类目
-            is_active=True,
-            show_in_menu=True
-        ).order_by('order')
+        'main_categories': get_category_tree().get_roots(menu_only=True)
     }
 
+@anonymous_page_cache('index')
 def index(request):
     """首页视图"""
-    # 获取幻灯片
-    slides = Slide.objects.filter(
-        position='home',
-        is_active=True
-    ).order_by('order')
+    # 获取幻灯片（连同关联视频一次取出）
+    slides = load_slides('home')
     
-    # 获取一级分类(用于热门分类展示)
-    categories = Category.objects.filter(
-        parent__isnull=True,
-        is_active=True,
-        show_in_menu=True
-    ).prefetch_related('children').order_by('order')
+    # 获取一级分类(用于热门分类展示)，子分类已随分类树一并加载
+    categories = get_category_tree().get_roots(menu_only=True)
     
     # 获取热门视频
-    hot_videos = Video.objects.filter(
-        is_active=True
-    ).order_by('-play_count')[:12]
+    hot_videos = leaderboards.get_videos(leaderboards.HOT, limit=12)
     
     context = {
         'slides': slides,
@@ -61,12 +65,10 @@ def category_view(request, category_slug):
     videos = Video.objects.filter(
         categories=category,
         is_active=True
-    ).order_by('-created_at')
+    ).cards()
     
     # 分页
-    page = request.GET.get('page', 1)
-    paginator = Paginator(videos, 20)  # 每页20个视频
-    videos_page = paginator.get_page(page)
+    videos_page = paginate(request, videos, 20, ORDER_LATEST)  # 每页20个视频
     
     context = {
         'category': category,
@@ -78,6 +80,7 @@ def category_view(request, category_slug):
     
     return render(request, 'pages/category/detail.html', context)
 
+@anonymous_page_cache('channel', vary_on=('subcategory',))
 def channel_view(request, category_slug):
     """频道页视图"""
     # 获取一级类目
@@ -85,97 +88,17 @@ def channel_view(request, category_slug):
     
     # 发现频道使用独立模板和数据结构
     if category_slug == 'discover':
-        # 获取分类参数
-        subcategory_slug = request.GET.get('subcategory', None)
-        
-        # 获取发现页面的幻灯片
-        slides = Slide.objects.filter(
-            position='discover',
-            is_active=True
-        ).order_by('order')
-        
-        # 获取子分类及其视频数量
-        subcategories = category.children.filter(is_active=True).order_by('order')
-        
-        # 基础查询 - 热门视频
-        videos_query = Video.objects.filter(is_active=True)
-        
-        # 如果指定了子分类，筛选对应子分类的内容
-        selected_subcategory = None
-        if subcategory_slug:
-            try:
-                selected_subcategory = Category.objects.get(
-                    slug=subcategory_slug,
-                    parent=category,
-                    is_active=True
-                )
-                videos_query = videos_query.filter(categories=selected_subcategory)
-            except Category.DoesNotExist:
-                pass
-        
-        # 获取热门视频
-        hot_videos = videos_query.order_by('-play_count')[:20]
-
+        page = load_discover_page(category, request.GET.get('subcategory'), hot_limit=20)
         context = {
-            'slides': slides,
-            'hot_videos': hot_videos,
-            'is_channel_page': True,
-            'current_category': category,
-            'selected_subcategory': selected_subcategory,
-            'subcategories': subcategories,
+            **page.context(),
             **get_nav_context()  # 添加导航栏数据
         }
         return render(request, 'pages/discover.html', context)
     
-    # 其他频道的处理逻辑
-    # 获取该类目的幻灯片
-    slides = Slide.objects.filter(
-        position=category_slug,
-        is_active=True
-    ).order_by('order')
-    
-    # 如果没有找到该类目的幻灯片，使用首页幻灯片
-    if not slides.exists():
-        slides = Slide.objects.filter(
-            position='home',
-            is_active=True
-        ).order_by('order')
-    
-    # 获取二级类目
-    subcategories = Category.objects.filter(
-        parent=category,
-        is_active=True,
-        show_in_menu=True
-    ).order_by('order')
-    
-    # 获取该类目下的最新视频，确保只获取有效的视频对象
-    latest_videos = Video.objects.filter(
-        categories=category,
-        is_active=True,
-        id__isnull=False  # 确保有 ID
-    ).order_by('-created_at')[:12]
-    
-    # 获取该类目下的热门视频，确保只获取有效的视频对象
-    hot_videos = Video.objects.filter(
-        categories=category,
-        is_active=True,
-        id__isnull=False  # 确保有 ID
-    ).order_by('-play_count')[:12]
-    
-    # 检查幻灯片中的视频对象
-    valid_slides = []
-    for slide in slides:
-        if hasattr(slide, 'video') and slide.video and slide.video.id:
-            valid_slides.append(slide)
-    
+    # 其他频道：幻灯片（没有时使用首页幻灯片）、二级类目、最新和热门视频
+    page = load_channel_page(category, latest_limit=12, hot_limit=12)
     context = {
-        'category': category,
-        'slides': valid_slides,
-        'subcategories': subcategories,
-        'latest_videos': latest_videos,
-        'hot_videos': hot_videos,
-        'is_channel_page': True,
-        'current_category': category,
+        **page.context(),
         **get_nav_context()  # 添加导航栏数据
     }
     
@@ -194,28 +117,23 @@ def subcategory_list(request, category_slug, subcategory_slug):
     )
     
     # 获取同级的其他二级类目
-    sibling_categories = Category.objects.filter(
-        parent=parent_category,
-        show_in_menu=True
-    ).exclude(id=subcategory.id).order_by('order')
+    sibling_categories = [
+        sibling for sibling in get_category_tree().get_children(parent_category.id, menu_only=True)
+        if sibling.id != subcategory.id
+    ]
     
     # 获取该二级类目下的视频
     videos = Video.objects.filter(
         categories=subcategory,
         is_active=True
-    )
+    ).cards()
     
     # 获取筛选条件
     order_by = request.GET.get('order', '-created_at')  # 默认按创建时间倒序
-    if order_by == 'play_count':
-        videos = videos.order_by('-play_count')
-    elif order_by == 'created_at':
-        videos = videos.order_by('-created_at')
+    ordering = ORDER_POPULAR if order_by == 'play_count' else ORDER_LATEST
     
     # 分页
-    page = request.GET.get('page', 1)
-    paginator = Paginator(videos, 20)  # 每页20个视频
-    videos_page = paginator.get_page(page)
+    videos_page = paginate(request, videos, 20, ordering)  # 每页20个视频
     
     context = {
         'parent_category': parent_category,
@@ -223,6 +141,7 @@ def subcategory_list(request, category_slug, subcategory_slug):
         'sibling_categories': sibling_categories,
         'videos': videos_page,
         'current_order': order_by,
+        'filter_query': urlencode({'order': order_by}) if 'order' in request.GET else '',
         'is_channel_page': True,
         'current_category': parent_category,
         **get_nav_context()  # 添加导航栏数据
@@ -234,35 +153,69 @@ def search(request):
     """搜索视图"""
     query = request.GET.get('q', '')
     
-    if query:
-        # 搜索视频标题和描述
+    # 只统计第一页，翻页不重复计入热门搜索
+    if query and 'page' not in request.GET and 'cursor' not in request.GET:
+        search_trends.record(query)
+    
+    if query and search_index.is_index_ready():
+        # 通过倒排索引搜索，结果按相关度排序
+        video_ids = search_index.search_video_ids(query)
+        
+        # 分页，只加载当前页的视频
+        paginator = Paginator(video_ids, 20)  # 每页20个视频
+        page = request.GET.get('page')
+        videos = paginator.get_page(page)
+        videos_by_id = Video.objects.filter(is_active=True).cards().in_bulk(list(videos.object_list))
+        videos.object_list = [videos_by_id[video_id] for video_id in videos.object_list if video_id in videos_by_id]
+    elif query:
+        # 索引尚未建立时退回到标题和描述的模糊匹配
         videos = Video.objects.filter(
             Q(title__icontains=query) |
             Q(description__icontains=query),
             is_active=True
-        ).order_by('-created_at')
+        ).cards()
         
         # 分页
-        paginator = Paginator(videos, 20)  # 每页20个视频
-        page = request.GET.get('page')
-        videos = paginator.get_page(page)
+        videos = paginate(request, videos, 20, ORDER_LATEST)  # 每页20个视频
     else:
         videos = []
     
     context = {
         'query': query,
         'videos': videos,
+        'filter_query': urlencode({'q': query}),
         **get_nav_context()  # 添加导航栏数据
     }
     
     return render(request, 'pages/search/index.html', context)
 
+@require_http_methods(['GET'])
+def suggest(request):
+    """搜索建议，只查内存中的前缀索引"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', suggestions.DEFAULT_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': '参数无效'}, status=400)
+    
+    items = suggestions.suggest(query, limit) if query else []
+    response = JsonResponse({'query': query, 'suggestions': items})
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
 def video_detail(request, video_id):
     """视频详情页视图"""
     video = get_object_or_404(Video, id=video_id, is_active=True)
     
+    # 记录播放，计数经缓冲批量落库
+    counters.incr(video, 'play_count')
+    counters.incr(video, 'views')
+    video.play_count = counters.get_count(video, 'play_count')
+    video.views = counters.get_count(video, 'views')
+    
     context = {
         'video': video,
+        'recommended_videos': get_related_videos(video),
         **get_nav_context()
     }
     
@@ -410,59 +363,6 @@ def publish_video(request):
             'message': '发布失败，请稍后重试'
         }, status=500)
 
-def get_ai_description(name, role):
-    """使用AI生成演员或导演的描述"""
-    try:
-        # 设置 OpenAI API
-        openai.api_key = settings.OPENAI_API_KEY
-        
-        # 根据角色构建不同的提示
-        if role == 'actor':
-            prompt = f"请用100字简要介绍演员{name}的主要成就和代表作品。"
-        else:  # director
-            prompt = f"请用100字简要介绍导演{name}的导演风格和代表作品。"
-        
-        # 调用 OpenAI API
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "你是一个专业的影视资料编辑。"},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"AI生成描述失败: {str(e)}")
-        return f"{name}是一位知名{role=='actor' and '演员' or '导演'}。"
-
-def process_cast(names, role_type):
-    """处理演员或导演名单"""
-    result = []
-    for name in names.split('，'):  # 使用中文逗号分隔
-        name = name.strip()
-        if not name:
-            continue
-            
-        if role_type == 'actor':
-            person, created = Actor.objects.get_or_create(
-                name=name,
-                defaults={
-                    'description': get_ai_description(name, 'actor'),
-                    'status': 'active'
-                }
-            )
-        else:  # director
-            person, created = Director.objects.get_or_create(
-                name=name,
-                defaults={
-                    'description': get_ai_description(name, 'director'),
-                    'status': 'active'
-                }
-            )
-        result.append(person)
-    return result
-
 @require_http_methods(["POST"])
 def publish_movie(request):
     """发布影视内容"""
@@ -496,84 +396,164 @@ def publish_movie(request):
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)})
 
+def category_tree_etag(request, *args, **kwargs):
+    """分类接口的ETag"""
+    return get_category_tree().etag
+
+def category_tree_last_modified(request, *args, **kwargs):
+    """分类接口的Last-Modified"""
+    return get_category_tree().last_modified
+
+@condition(etag_func=category_tree_etag, last_modified_func=category_tree_last_modified)
 def get_categories(request, category_type=None):
     """获取分类列表"""
     try:
-        # 根据类型过滤分类
-        categories = Category.objects.filter(is_active=True)
-        if category_type:
-            categories = categories.filter(category_type=category_type)
+        tree = get_category_tree()
         
-        # 获取一级分类
-        root_categories = categories.filter(parent__isnull=True).order_by('order')
+        # 获取一级分类，并根据类型过滤
+        root_categories = tree.get_roots(category_type=category_type)
         
-        # 构建分类树
-        result = []
-        for category in root_categories:
-            children = category.children.filter(is_active=True).order_by('order')
-            result.append({
-                'id': category.id,
-                'name': category.name,
-                'children': [{'id': child.id, 'name': child.name} for child in children]
-            })
+        # 构建分类树，子分类按层级递归嵌套
+        result = [tree.serialize(category) for category in root_categories]
         
         return JsonResponse(result, safe=False)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@condition(etag_func=category_tree_etag, last_modified_func=category_tree_last_modified)
 def get_category_children(request, category_id):
     """获取分类的子分类"""
-    try:
-        category = Category.objects.get(id=category_id)
-        children = category.children.filter(is_active=True).order_by('order')
-        subcategories = [{'id': child.id, 'name': child.name} for child in children]
-        return JsonResponse(subcategories, safe=False)
-    except Category.DoesNotExist:
-        return JsonResponse([], safe=False)
+    tree = get_category_tree()
+    subcategories = [tree.serialize(child) for child in tree.get_children(category_id)]
+    return JsonResponse(subcategories, safe=False)
 
 def video_list(request):
-    """视频列表页视图"""
-    # 获取筛选条件
-    category_id = request.GET.get('category')
-    tag_id = request.GET.get('tag')
+    """视频列表页视图，按分面筛选"""
+    selection = facets.parse_selection(request.GET)
     sort = request.GET.get('sort', '-created_at')  # 默认按创建时间倒序
     
-    # 构建查询
-    videos = Video.objects.filter(is_active=True)
+    # 筛选和各分面数量由内存位图计算
+    max_ids = getattr(settings, 'FACET_MAX_ID_FILTER', facets.MAX_ID_FILTER)
+    video_ids, total, facet_counts = facets.get_index().search(selection, max_ids=max_ids)
     
-    # 分类筛选
-    if category_id:
-        videos = videos.filter(categories__id=category_id)
-    
-    # 标签筛选
-    if tag_id:
-        videos = videos.filter(tags__id=tag_id)
+    # 构建查询
+    videos = Video.objects.filter(is_active=True).cards()
+    if selection:
+        # 结果较少时按ID列表查询，较多时交给数据库筛选
+        videos = videos.filter(id__in=video_ids) if video_ids is not None else facets.filter_queryset(videos, selection)
     
     # 排序
-    if sort == 'popular':
-        videos = videos.order_by('-play_count')
-    elif sort == 'newest':
-        videos = videos.order_by('-created_at')
-    else:
-        videos = videos.order_by('-created_at')
+    ordering = ORDER_POPULAR if sort == 'popular' else ORDER_LATEST
     
     # 分页
-    page = request.GET.get('page', 1)
-    paginator = Paginator(videos, 20)  # 每页20个视频
-    videos_page = paginator.get_page(page)
+    videos_page = paginate(request, videos, 20, ordering)  # 每页20个视频
+    videos_page.paginator.count = total
     
     context = {
         'videos': videos_page,
-        'categories': Category.objects.filter(is_active=True),
-        'tags': Tag.objects.filter(is_active=True),
-        'selected_category': category_id,
-        'selected_tag': tag_id,
+        'facets': facets.facet_context(selection, facet_counts, sort=request.GET.get('sort')),
+        'total': total,
+        'selection_query': facets.selection_query(selection),
+        'filter_query': facets.selection_query(selection, sort=request.GET.get('sort')),
         'current_sort': sort,
         **get_nav_context()
     }
     
     return render(request, 'pages/video/list.html', context)
 
+@require_http_methods(['GET'])
+def series_playlist(request, series_id):
+    """剧集播放列表：已缓存时返回指向本地分片的m3u8，否则跳转到远端地址"""
+    series = get_object_or_404(SeriesVideo, id=series_id, video__is_active=True)
+    hls_cache.record_play(series)
+
+    playlist = hls_cache.playlist_for(series)
+    if playlist is not None:
+        response = HttpResponse(playlist, content_type='application/vnd.apple.mpegurl')
+        response['Cache-Control'] = 'no-cache'
+        return response
+    if not series.m3u8_url or series.is_m3u8_expired():
+        raise Http404('播放地址已过期')
+    return HttpResponseRedirect(series.m3u8_url)
+
+@require_http_methods(['GET'])
+def image_derivative(request, kind, object_id, preset, width):
+    """按需生成并返回指定宽度的衍生图片，生成失败时跳转到原图"""
+    model = image_derivatives.SOURCE_MODELS.get(kind)
+    if model is None or width not in image_derivatives.PRESETS.get(preset, ()):
+        raise Http404('图片不存在')
+    obj = get_object_or_404(model, id=object_id)
+
+    try:
+        path = image_derivatives.get_derivative_path(obj, preset, width)
+    except image_derivatives.DerivativeError as e:
+        logger.warning(f'生成衍生图片失败 {kind}:{object_id}: {e}')
+        source = image_derivatives.get_source(obj)
+        if source and source.startswith(('http://', 'https://')):
+            return HttpResponseRedirect(source)
+        raise Http404('图片不存在')
+
+    response = FileResponse(open(path, 'rb'), content_type='image/webp')
+    # 原图变化后 srcset 会指向新的媒体地址，这里只需短期缓存
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@require_http_methods(['GET'])
+def danmaku_segment(request, video_id, segment):
+    """按时间分段获取弹幕（gzip压缩的二进制格式）"""
+    now = time.time()
+    until = request.GET.get('until')
+    if until is None:
+        # 未指定截止点时使用最新已关闭的截止点，缓存到下一个截止点为止
+        until = danmaku_segments.current_until(now)
+        max_age = int(until + danmaku_segments.CLOSE_INTERVAL + danmaku_segments.CLOSE_DELAY - now)
+        cache_control = f'public, max-age={max(max_age, 1)}'
+    else:
+        try:
+            until = int(until)
+        except ValueError:
+            until = 0
+        if not danmaku_segments.is_valid_until(until, now):
+            return JsonResponse({'error': '无效的截止时间'}, status=400)
+        cache_control = 'public, max-age=31536000, immutable'
+    
+    body = danmaku_segments.get_segment(video_id, segment, until)
+    response = HttpResponse(body, content_type='application/octet-stream')
+    response['Content-Encoding'] = 'gzip'
+    response['Cache-Control'] = cache_control
+    response['X-Danmaku-Until'] = str(until)
+    response['X-Danmaku-Segment-Seconds'] = str(danmaku_segments.SEGMENT_SECONDS)
+    return response
+
+@require_http_methods(['POST'])
+def danmaku_submit(request, video_id):
+    """发送弹幕，进入写入队列后立即返回"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'message': '请先登录'}, status=401)
+    
+    try:
+        data = json.loads(request.body)
+        danmaku = danmaku_ingestor.submit(video_id, request.user.id, data)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'message': '请求格式错误'}, status=400)
+    except DanmakuValidationError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    return JsonResponse({'success': True, 'danmaku': danmaku}, status=202)
+
+@require_http_methods(['GET'])
+def danmaku_live(request, video_id):
+    """获取最近发布的弹幕，只读内存缓冲区"""
+    try:
+        since = float(request.GET['since']) if 'since' in request.GET else None
+        start = float(request.GET['start']) if 'start' in request.GET else None
+        end = float(request.GET['end']) if 'end' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': '参数无效'}, status=400)
+    
+    items = danmaku_ingestor.ring.recent(video_id, start=start, end=end, since=since)
+    return JsonResponse({'danmaku': items, 'now': time.time()})
+
 def music_list(request):
     """音乐列表页面"""
     # 获取所有音乐